@@ -0,0 +1,250 @@
+"""
+Tests for the Triple Triad Engine
+
+Checks the invariants the AI, the endgame tablebase, the move log and the
+webclient deltas rely on: every move is undone exactly, the position key
+always matches the position and pack() round-trips. A few hand-built
+positions check the Same, Same Wall, Plus, Combo and Elemental captures.
+
+Run with:
+    python -m pytest features/test_tripletriad_engine.py
+"""
+import random
+from features import tripletriad_cards as cards
+from features.tripletriad_engine import (TripleTriadEngine, CELLS, HAND_SIZE, EMPTY, PACKED_STATE,
+                                         CELL_INDEX, rules_mask, element_layout)
+from features.tripletriad_cards import ELEMENT_NAMES
+
+GAMES = 300
+CAPTURE_RULES = ("Same", "Same Wall", "Plus", "Elemental")
+
+
+def state(engine):
+    """
+    Returns everything a move may change, for comparison.
+    """
+    return (list(engine.hand), list(engine.board), list(engine.owner), list(engine.scores),
+            engine.turn, engine.empty, engine.key)
+
+
+def random_games(games=GAMES, seed=0):
+    """
+    Yields freshly dealt engines under random capture rules, with the rng
+    to play them.
+    """
+    rng = random.Random(seed)
+    for _ in range(games):
+        mask = rules_mask([rule for rule in CAPTURE_RULES if rng.random() < 0.5])
+        engine = TripleTriadEngine()
+        engine.set_rules(mask, element_layout(mask, rng.getrandbits(32)))
+        engine.deal(0, cards.random_hand(rng))
+        engine.deal(1, cards.random_hand(rng))
+        yield engine, rng
+
+
+def position(hands, placed, turn=0, rules=(), elements=None):
+    """
+    Returns an engine set up with hands dealt and cards already on the
+    board.
+
+    Args:
+        hands (tuple): Card names of each seat's hand.
+        placed (dict): {position: (seat, hand position, owner)} of each card
+                       on the board, e.g. {"b1": (1, 0, 1)}.
+        turn (int, optional): Seat to move.
+        rules (list, optional): Game Rules.
+        elements (dict, optional): {position: element} under Elemental.
+    """
+    ids = [cards.find(name) for hand in hands for name in hand]
+    board = [255] * CELLS
+    owned = 0
+    for name, (seat, card, owner) in placed.items():
+        cell = CELL_INDEX[name]
+        board[cell] = seat * HAND_SIZE + card
+        if owner:
+            owned |= 1 << cell
+    codes = [0] * CELLS
+    for name, element in (elements or {}).items():
+        codes[CELL_INDEX[name]] = 1 + ELEMENT_NAMES.index(element)
+    return TripleTriadEngine.unpack(PACKED_STATE.pack(bytes(ids), bytes(board), owned, turn,
+                                                      rules_mask(rules), bytes(codes)))
+
+
+##############################################################################
+#
+# Invariants
+#
+##############################################################################
+
+def test_undo_restores_every_move():
+    for engine, rng in random_games():
+        while not engine.is_over():
+            before = state(engine)
+            for card in engine.available_cards():
+                for cell in engine.available_cells():
+                    captured = engine.play(card, cell)
+                    engine.undo(card, cell, captured)
+                    assert state(engine) == before
+            engine.play(rng.choice(engine.available_cards()), rng.choice(engine.available_cells()))
+
+
+def test_key_and_pack_match_the_position():
+    for engine, rng in random_games():
+        while True:
+            restored = TripleTriadEngine.unpack(engine.pack())
+            assert restored.pack() == engine.pack()
+            assert state(restored) == state(engine)
+            assert restored.effective == engine.effective
+            if engine.is_over():
+                break
+            engine.play(rng.choice(engine.available_cards()), rng.choice(engine.available_cells()))
+
+
+def test_scores_count_every_card():
+    for engine, rng in random_games():
+        while not engine.is_over():
+            engine.play(rng.choice(engine.available_cards()), rng.choice(engine.available_cells()))
+            for seat in (0, 1):
+                in_hand = len(engine.available_cards(seat))
+                on_board = engine.owner.count(seat)
+                assert engine.scores[seat] == in_hand + on_board
+        assert sum(engine.scores) == CELLS + 1
+
+
+def test_key_ignores_hand_order():
+    rng = random.Random(1)
+    for _ in range(50):
+        hands = (cards.random_hand(rng), cards.random_hand(rng))
+        engines = []
+        for order in (hands, (hands[0][::-1], hands[1][::-1])):
+            engine = TripleTriadEngine()
+            engine.deal(0, order[0])
+            engine.deal(1, order[1])
+            engines.append(engine)
+        assert engines[0].key == engines[1].key
+        # The same card on the same cell gives the same key again.
+        engines[0].play(0, 4)
+        engines[1].play(HAND_SIZE - 1, 4)
+        assert engines[0].key == engines[1].key
+
+
+##############################################################################
+#
+# Capture Rules
+#
+##############################################################################
+
+# Caterchipillar is 4 up and 3 left. Gayla is 4 down and Bite Bug 3 right,
+# so placing Caterchipillar on b2 ties both without capturing either.
+SAME_HANDS = (("Caterchipillar", "Geezard", "Geezard", "Geezard", "Geezard"),
+              ("Gayla", "Bite Bug", "Red Bat", "Geezard", "Geezard"))
+SAME_BOARD = {"b1": (1, 0, 1), "a2": (1, 1, 1)}
+
+
+def test_basic_rule_captures_only_higher_ranks():
+    engine = position(SAME_HANDS, SAME_BOARD)
+    assert engine.play(0, CELL_INDEX["b2"]) == 0
+    assert engine.scores == [5, 5]
+
+
+def test_same_captures_matching_ranks():
+    engine = position(SAME_HANDS, SAME_BOARD, rules=["Same"])
+    captured = engine.play(0, CELL_INDEX["b2"])
+    assert captured == 1 << CELL_INDEX["b1"] | 1 << CELL_INDEX["a2"]
+    assert engine.owner[CELL_INDEX["b1"]] == engine.owner[CELL_INDEX["a2"]] == 0
+    assert engine.scores == [7, 3]
+
+
+def test_same_needs_two_sides():
+    board = {"b1": (1, 0, 1)}
+    engine = position(SAME_HANDS, board, rules=["Same"])
+    assert engine.play(0, CELL_INDEX["b2"]) == 0
+
+
+def test_combo_spreads_from_same():
+    # Red Bat on a1 is 1 right, below Gayla's left of 4 once Gayla is taken.
+    board = dict(SAME_BOARD, a1=(1, 2, 1))
+    engine = position(SAME_HANDS, board, rules=["Same"])
+    captured = engine.play(0, CELL_INDEX["b2"])
+    assert captured & 1 << CELL_INDEX["a1"]
+    assert engine.scores == [8, 2]
+    # Without Same, Red Bat is not touched at all.
+    engine = position(SAME_HANDS, board)
+    assert engine.play(0, CELL_INDEX["b2"]) == 0
+
+
+def test_same_wall_counts_the_edge_as_an_a():
+    # Pandemona is A up, so on b1 it matches the wall, and 7 down matches
+    # Grat's 7 up on b2.
+    hands = (("Pandemona", "Geezard", "Geezard", "Geezard", "Geezard"),
+             ("Grat", "Geezard", "Geezard", "Geezard", "Geezard"))
+    board = {"b2": (1, 0, 1)}
+    engine = position(hands, board, rules=["Same"])
+    assert engine.play(0, CELL_INDEX["b1"]) == 0
+    engine = position(hands, board, rules=["Same", "Same Wall"])
+    assert engine.play(0, CELL_INDEX["b1"]) == 1 << CELL_INDEX["b2"]
+
+
+def test_plus_captures_equal_sums():
+    # Caterchipillar's 4 up and 3 left face Belhelmel's 5 down and
+    # Forbidden's 6 right: both add up to 9.
+    hands = (("Caterchipillar", "Geezard", "Geezard", "Geezard", "Geezard"),
+             ("Belhelmel", "Forbidden", "Geezard", "Geezard", "Geezard"))
+    board = {"b1": (1, 0, 1), "a2": (1, 1, 1)}
+    engine = position(hands, board)
+    assert engine.play(0, CELL_INDEX["b2"]) == 0
+    engine = position(hands, board, rules=["Same"])
+    assert engine.play(0, CELL_INDEX["b2"]) == 0
+    engine = position(hands, board, rules=["Plus"])
+    assert engine.play(0, CELL_INDEX["b2"]) == 1 << CELL_INDEX["b1"] | 1 << CELL_INDEX["a2"]
+
+
+def test_same_and_plus_only_take_opponent_cards():
+    board = {"b1": (1, 0, 0), "a2": (1, 1, 1)}
+    engine = position(SAME_HANDS, board, rules=["Same"])
+    assert engine.play(0, CELL_INDEX["b2"]) == 1 << CELL_INDEX["a2"]
+
+
+def test_elemental_changes_basic_captures():
+    # Gayla is a Thunder card, 2 up, against Fastitocalon-F's 2 down.
+    hands = (("Gayla", "Geezard", "Geezard", "Geezard", "Geezard"),
+             ("Fastitocalon-F", "Geezard", "Geezard", "Geezard", "Geezard"))
+    board = {"b1": (1, 0, 1)}
+    engine = position(hands, board, rules=["Elemental"])
+    assert engine.play(0, CELL_INDEX["b2"]) == 0
+    engine = position(hands, board, rules=["Elemental"], elements={"b2": "Thunder"})
+    assert engine.play(0, CELL_INDEX["b2"]) == 1 << CELL_INDEX["b1"]
+    # Another element lowers Fastitocalon-F instead, which is Earth.
+    engine = position(hands, board, rules=["Elemental"], elements={"b1": "Fire"})
+    assert engine.play(0, CELL_INDEX["b2"]) == 1 << CELL_INDEX["b1"]
+
+
+def test_elemental_leaves_same_on_printed_ranks():
+    # A Fire b2 lowers Caterchipillar, which has no element, but Same still
+    # compares the printed ranks.
+    engine = position(SAME_HANDS, SAME_BOARD, rules=["Same", "Elemental"],
+                      elements={"b2": "Fire"})
+    assert engine.play(0, CELL_INDEX["b2"]) == 1 << CELL_INDEX["b1"] | 1 << CELL_INDEX["a2"]
+
+
+def test_redeal_gives_each_player_the_cards_they_own():
+    tied = 0
+    for engine, rng in random_games():
+        while not engine.is_over():
+            engine.play(rng.choice(engine.available_cards()), rng.choice(engine.available_cells()))
+        # Sudden Death only follows a tie.
+        if engine.winner() is not None:
+            continue
+        tied += 1
+        owned = ([], [])
+        for cell in range(CELLS):
+            owned[engine.owner[cell]].append(engine.cards[engine.board[cell]])
+        for slot in range(len(engine.cards)):
+            if engine.hand[slot]:
+                owned[slot // HAND_SIZE].append(engine.cards[slot])
+        engine.redeal()
+        assert engine.board == [EMPTY] * CELLS
+        for seat in (0, 1):
+            assert (sorted(engine.cards[seat * HAND_SIZE:(seat + 1) * HAND_SIZE]) 
+                    == sorted(owned[seat]))
+    assert tied
@@ -34,20 +34,41 @@ Elemental	In the elemental rule, one or more of the spaces are randomly
         apply.
 
 Add Winning Rules:
-One	1	Winner chooses one card from loser.
-Difference (Diff)	2	Winner chooses one card per score difference (2, 4, or 5).
+One	1	Winner takes one card from loser, their highest level card.
+Difference (Diff)	2	Winner takes one card per score difference (2, 4, or 5), 
+        highest level first.
 Direct	3	Players take cards that are their color at the end of the game.
 All	4	Winner takes all.
+The winner does not pick: the loser's highest level cards are taken 
+automatically (see trade_cards in features/tripletriad_collection.py).
 
 """
+import heapq
 import random
+import time
 import itertools
+from twisted.internet import threads
 from django.conf import settings
-from evennia import create_script
+from django.db import transaction
+from evennia import create_script, search_script
 from evennia import CmdSet
+from evennia.utils import logger
 from evennia.utils.utils import class_from_module
-from evennia.utils import evform
 from typeclasses.default_typeclasses import Character, Script
+from features.tripletriad_engine import (TripleTriadEngine, CELL_INDEX, POSITIONS, EMPTY, 
+                                         CELLS, HAND_SIZE, SLOTS, rules_mask, mask_rules, 
+                                         element_layout, RULES)
+from features.tripletriad_ai import DEFAULT_DIFFICULTY, HINT_DEPTH, WIN
+from features.tripletriad_workers import get_ai_service
+from features.tripletriad_render import (render_frames, frame_height, redraw_full, redraw_diff, 
+                                         REDRAW_RESET)
+from features.tripletriad_log import (Replay, new_log, encode_move, decode_move, get_archive, 
+                                      HEADER)
+from features.tripletriad_oob import state_message, move_message, end_message
+from features.tripletriad_history import get_history, result_rows, RESULT_NAMES
+from features.tripletriad_ladder import Ladder, MatchmakingQueue, PAGE_SIZE
+from features.tripletriad_regions import (start_match, starting_rules, DEFAULT_REGION, 
+                                          REGION_ATTRIBUTE, CARRIED_ATTRIBUTE)
 
 COMMAND_DEFAULT_CLASS = class_from_module(settings.COMMAND_DEFAULT_CLASS)
 
@@ -58,12 +79,39 @@ COMMAND_DEFAULT_CLASS = class_from_module(settings.COMMAND_DEFAULT_CLASS)
 #
 ##############################################################################
 
+# The 110 cards live in features/tripletriad_cards.py so that the engine and
+# offline tools can use them without Evennia. Hands and the board only hold 
+# card ids.
+from features import tripletriad_cards as cards
+
 ##############################################################################
 #
 # Triple Triad Card Mixin and Handler
 #
 ##############################################################################
 
+# Each character's cards are held by the CardCollectionMixin in 
+# features/tripletriad_collection.py, as a count per card id.
+from features.tripletriad_collection import (trade_cards, agreed_trade, DEFAULT_TRADE_RULE, 
+                                             TRADE_ATTRIBUTE, TRADE_RULES, MAX_COPIES,
+                                             DECK_ATTRIBUTE)
+
+
+def collection_hand(player, rules=(), rng=random):
+    """
+    Deals a player the deck they have chosen with 'tt deck', if they still
+    own it and the Random rule is not in play. Otherwise deals five cards 
+    drawn from their collection, as under the Random rule, or returns None 
+    if they own fewer than five.
+    """
+    collection = getattr(player, "card_collection", None)
+    if collection is None:
+        return None
+    deck = player.attributes.get(DECK_ATTRIBUTE)
+    if deck and "Random" not in rules and collection.owns(deck):
+        return list(deck)
+    return collection.random_hand(rng)
+
 ##############################################################################
 #
 # Triple Triad Command
@@ -72,16 +120,66 @@ COMMAND_DEFAULT_CLASS = class_from_module(settings.COMMAND_DEFAULT_CLASS)
 
 class CmdTripleTriad(COMMAND_DEFAULT_CLASS):
     """
-    
+    Play Triple Triad
+    Usage:
+        tt <character>                   # Challenge a character to a game
+        tt challenge <character>         # The same, for a name starting
+                                         # with one of the words below
+        tt <card> to <position>          # Play a card from your hand, 1 to
+                                         # 5, on the board, A1 to C3
+        tt hint                          # Show your best moves
+        tt forfeit                       # Give up your game
+        tt board                         # Send the board again
+        tt redraw [on/off]               # Redraw the board in place
+        tt watch [player]                # Watch a game, or stop watching
+        tt queue                         # Wait for a rated match
+        tt leave                         # Leave the rated match queue
+        tt ladder [page]                 # Show the rated match leaderboard
+        tt history [player]              # Show the latest games of a player
+        tt versus <player>               # Show your record against a player
+        tt games [rule, rule, ...]       # Show the latest games with rules
+        tt replay <match id> [turn]      # Replay a finished match
+        tt trade [rule/off]              # Trade cards under One, Diff,
+                                         # Direct or All, or stop trading
+        tt deck [card, card, ...]        # Choose the five cards you are dealt
+        tt deck off                      # Be dealt random cards again
+    Examples:
+        tt Squall
+        tt 2 to b1
+        tt replay 42 5
+        tt deck Geezard, Funguar, Bite Bug, Red Bat, Blobra
     """
     key = "tripletriad"
     aliases = ["tt"]
     help_category = "General"
     rhs_split = ("=", "to") # Prefer = delimiter, but allow " to " usage.
+    # Method handling each subcommand, by the first word of the input in
+    # lower case. The method is given the rest of the input. Any other 
+    # input is a challenge or, in a game, a move.
+    subcommands = {
+        "replay": "replay", "ladder": "ladder", "watch": "watch", "redraw": "redraw",
+        "board": "board", "trade": "trade", "deck": "deck", "history": "history",
+        "versus": "versus", "games": "games", "queue": "queue", "leave": "leave",
+        "hint": "hint", "forfeit": "forfeit", "concede": "forfeit", "quit": "forfeit",
+        "challenge": "challenge",
+    }
 
     def func(self):
         caller = self.caller
-        participants = [caller]
+        
+        # ---------------------------------------------------------------------
+        # Subcommands. Available in or out of a game, each checking for
+        # itself whether it needs one.
+        # Assumed Input: tt <subcommand> [arguments]
+        # ---------------------------------------------------------------------
+        
+        word, _, rest = self.args.partition(" ")
+        word, rest = word.lower(), rest.strip()
+        if self.args.lower() == "give up":
+            word = "forfeit"
+        if word in self.subcommands:
+            getattr(self, self.subcommands[word])(rest)
+            return
         
         # ---------------------------------------------------------------------
         # OUT OF GAME COMMANDS
@@ -93,69 +191,15 @@ class CmdTripleTriad(COMMAND_DEFAULT_CLASS):
         # ---------------------------------------------------------------------
         
         # If caller is not already in a game, assume invitation to start game.
-        if not caller.ndb.game_handler:
-            
-            # If no arguments, inform Caller they need a target.
-            if not self.args:
-                    caller.msg("Play with whom?")
-                    return
-            
-            participant = caller.search(self.args)
-        
-            # If Participant could not be located, inform Caller.
-            if not participant:
-                caller.msg(self.args + " could not be located.")
-                return
-            
-            # If Particpant isn't a character, inform Caller.
-            if not isinstance(participant, Character):
-                caller.msg(self.args + " is not able to play a game.")
-                return
-            
-            # If Participant is already playing a game, inform Caller.
-            if participant.ndb.game_handler:
-                caller.msg(self.args + " is already playing a game.")
-                return
-            
-            # If Participant is themselves, inform Caller.
-            if participant in participants:
-                caller.msg("You cannot play by yourself.")
-                return
-    
-            participants.append(participant)
-            
-            # TODO: COLLECT CARDS? THIS IS A MOCK SET UP
-            def rand_card():
-                """ 
-                """
-                temp_card = {"name": "Geezard", "element": None, "type": "Monster"}
-                temp_card["up"] = random.randrange(1, 10)
-                temp_card["right"] = random.randrange(1, 10)
-                temp_card["down"] = random.randrange(1, 10)
-                temp_card["left"] = random.randrange(1, 10)
-                return temp_card
-
-            participants = {participant:[rand_card(),rand_card(),rand_card(),rand_card(),rand_card()] for participant in participants}
-            
-            # Create list and initialise the game.
-            handler = create_script(TripleTriadHandler)
-            handler.initialise_game_information(participants, "game")
+        game = get_match(caller)
+        if not game:
+            self.challenge(self.args)
             return
 
         # ---------------------------------------------------------------------
         # IN-GAME COMMANDS
         # ---------------------------------------------------------------------
-        game = caller.ndb.game_handler        
 
-        # ---------------------------------------------------------------------
-        # Forfeit game command
-        # Assumed Input: tt forfeit
-        # ---------------------------------------------------------------------
-
-        if self.args in ("forfeit", "give up", "concede", "quit"):
-            game.forfeit(caller)
-            return
-            
         # ---------------------------------------------------------------------
         # Take Turn command
         # Assumed Input: tt 2 to A3
@@ -169,7 +213,7 @@ class CmdTripleTriad(COMMAND_DEFAULT_CLASS):
         
         # CHECK TARGET CARD
         target_card = self.lhs
-        current_hand = game.db.participants[current_player]
+        engine = game.engine
         
         # If target card is not numeral 1-5, inform Caller.
         if not target_card in ("1", "2", "3", "4", "5"):
@@ -179,24 +223,23 @@ class CmdTripleTriad(COMMAND_DEFAULT_CLASS):
         target_card = int(target_card) - 1
         
         # If target card is no longer in hand, inform Caller.
-        if not current_hand[target_card]:
-            caller.msg("Target card " + str(target_card) + " is not in your hand. Pick another.")
+        if engine.hand_card(engine.turn, target_card) == EMPTY:
+            caller.msg("Target card " + str(target_card + 1) + " is not in your hand. Pick another.")
             return
         
         # Target Card should be valid.
     
         # CHECK BOARD POSITION
-        target_position = self.rhs.lower()
-        gameboard = game.db.gameboard
+        target_position = (self.rhs or "").lower()
         
         # If target position not a board position, inform Caller.
-        if not target_position in ("a1", "a2", "a3", "b1", "b2", "b3", "c1", "c2", "c3"):
+        if not target_position in CELL_INDEX:
             caller.msg(target_position + " is not a valid board position. Usage: 'tt [card in hand - 1 to 5] to [board position - A1 to C3]'")
             return
         
         # If target position is occupied, inform Caller.
-        if gameboard[target_position][0]:
-            caller.msg("Target position " + str(target_card) + " is already occupied. Pick another.")
+        if engine.board[CELL_INDEX[target_position]] != EMPTY:
+            caller.msg("Target position " + target_position + " is already occupied. Pick another.")
             return
 
         # target position should be valid
@@ -204,119 +247,562 @@ class CmdTripleTriad(COMMAND_DEFAULT_CLASS):
         # LODGE ACTION
         game.current_player_action(target_card, target_position)
 
+    def challenge(self, target):
+        """
+        Starts a match between the caller and another character, if 
+        neither is already playing.
+        """
+        caller = self.caller
+        if get_match(caller):
+            caller.msg("You are already playing a game.")
+            return
+        
+        # If no arguments, inform Caller they need a target.
+        if not target:
+            caller.msg("Play with whom?")
+            return
+        
+        participant = caller.search(target)
+        
+        # If Participant could not be located, inform Caller.
+        if not participant:
+            caller.msg(target + " could not be located.")
+            return
+        
+        # If Particpant isn't a character, inform Caller.
+        if not isinstance(participant, Character):
+            caller.msg(target + " is not able to play a game.")
+            return
+        
+        # If Participant is already playing a game, inform Caller.
+        if get_match(participant):
+            caller.msg(target + " is already playing a game.")
+            return
+        
+        # If Participant is themselves, inform Caller.
+        if participant == caller:
+            caller.msg("You cannot play by yourself.")
+            return
+        
+        # Start the match. Hands are dealt by the match.
+        participants = [caller, participant]
+        manager = get_manager()
+        for participant in participants:
+            manager.leave_queue(participant)
+        rules = manager.region_rules(caller, participants)
+        manager.create_match(participants, "game", rules)
+
+    def queue(self, args):
+        """
+        Puts the caller in the queue for a rated match.
+        """
+        caller = self.caller
+        if get_match(caller):
+            caller.msg("You are already playing a game.")
+            return
+        manager = get_manager()
+        caller.msg("You are waiting for a rated match. Your rating is %i." 
+                   % manager.ladder.rating(caller.id))
+        manager.join_queue(caller)
+
+    def leave(self, args):
+        """
+        Takes the caller out of the queue for a rated match.
+        """
+        get_manager().leave_queue(self.caller)
+        self.caller.msg("You have left the queue for a rated match.")
+
+    def forfeit(self, args):
+        """
+        Gives up the caller's match.
+        """
+        game = get_match(self.caller)
+        if not game:
+            self.caller.msg("You are not playing a game.")
+            return
+        game.forfeit(self.caller)
+
+    def replay(self, args):
+        """
+        Shows the board of a finished match as it was after a given turn, 
+        or at the end of the match. The replay is kept on the caller so 
+        seeking to another turn only plays or undoes the moves in between.
+        A new match's log is read from the archive in a thread.
+        """
+        caller = self.caller
+        args = args.split()
+        usage = "Usage: 'tt replay [match id] [turn - 0 to 9]'"
+        if not args or not args[0].isdigit() or (len(args) > 1 and not args[1].isdigit()):
+            caller.msg(usage)
+            return
+        match_id = int(args[0])
+        
+        replay = caller.ndb.tripletriad_replay
+        if replay is None or caller.ndb.tripletriad_replay_id != match_id:
+            if match_id in MATCHES:
+                caller.msg("Match " + args[0] + " has not finished yet.")
+                return
+            deferred = threads.deferToThread(get_archive().get, match_id)
+            deferred.addCallbacks(self.replay_loaded, self.replay_failed, 
+                                  callbackArgs=(match_id, args, usage))
+            return
+        self.show_replay(replay, match_id, args, usage)
+
+    def replay_loaded(self, log, match_id, args, usage):
+        """
+        Starts the replay of a log read from the archive.
+        """
+        if log is None:
+            self.caller.msg("There is no record of match %i." % match_id)
+            return
+        replay = self.caller.ndb.tripletriad_replay = Replay(log)
+        self.caller.ndb.tripletriad_replay_id = match_id
+        self.show_replay(replay, match_id, args, usage)
+
+    def replay_failed(self, failure):
+        """
+        Tells the caller a match could not be read from the archive, and 
+        logs why.
+        """
+        logger.log_err(failure.getTraceback())
+        self.caller.msg("The match archive is unavailable. Please try again later.")
+
+    def show_replay(self, replay, match_id, args, usage):
+        """
+        Shows a replay at the turn asked for.
+        """
+        turn = int(args[1]) if len(args) > 1 else len(replay)
+        engine = replay.seek(turn)
+        title = "TURN %i/%i" % (replay.turn, len(replay))
+        self.caller.msg(render_frames(engine, title=title)[0])
+        self.caller.msg("Match %i. %s" % (match_id, usage))
+
+    def hint(self, args):
+        """
+        Shows the current player's best moves with the cards each captures.
+        Under the Open rule either player may ask and the hint looks 
+        HINT_DEPTH moves ahead; otherwise only the current player, and only
+        one move ahead, so the hint does not give the hidden hand away.
+        
+        The hint is worked out by the match's AI worker, and a player can 
+        only wait on one hint at a time.
+        """
+        caller = self.caller
+        game = get_match(caller)
+        if not game:
+            caller.msg("You are not playing a game.")
+            return
+        engine = game.engine
+        open_hands = "Open" in game.rules
+        if caller != game.current_player() and not open_hands:
+            caller.msg("It is not your turn. Please wait for your Opponent.")
+            return
+        if caller.ndb.tripletriad_hinting:
+            caller.msg("Your last hint is still being worked out.")
+            return
+        
+        caller.ndb.tripletriad_hinting = True
+        deferred = get_ai_service().hint(game.id, engine, HINT_DEPTH if open_hands else 1)
+        deferred.addCallbacks(self.show_hint, self.hint_failed, 
+                              callbackArgs=(game, engine.key))
+
+    def show_hint(self, scores, game, key):
+        """
+        Shows a hint, unless the game has moved on since it was asked for.
+        """
+        caller = self.caller
+        caller.ndb.tripletriad_hinting = False
+        if MATCHES.get(game.id) is not game or game.engine.key != key:
+            caller.msg("The game moved on before your hint was ready.")
+            return
+        whose = "your" if caller == game.current_player() else game.current_player().key + "'s"
+        lines = ["Best moves on %s turn:" % whose]
+        for value, captured, card, cell in scores[:HINT_COUNT]:
+            if abs(value) >= WIN:
+                outcome = "final score %+i" % (value // WIN)
+            else:
+                outcome = "score %+i" % value
+            lines.append("  tt %i to %s - captures %i, %s" 
+                         % (card + 1, POSITIONS[cell].upper(), captured, outcome))
+        caller.msg("\n".join(lines))
+
+    def hint_failed(self, failure):
+        """
+        Tells the caller a hint could not be worked out, and logs why.
+        """
+        logger.log_err(failure.getTraceback())
+        self.caller.ndb.tripletriad_hinting = False
+        self.caller.msg("Hints are unavailable. Please try again later.")
+
+    def watch(self, target):
+        """
+        Starts watching the match of a player in the same room, or stops 
+        watching with no target.
+        """
+        caller = self.caller
+        watching = MATCHES.get(caller.ndb.tripletriad_watching)
+        if watching:
+            watching.remove_spectator(caller)
+            caller.msg("You stop watching the match.")
+        if not target:
+            if not watching:
+                caller.msg("Watch whom? Usage: 'tt watch [player]'")
+            return
+        
+        player = caller.search(target)
+        if not player:
+            caller.msg(target + " could not be located.")
+            return
+        match = get_match(player)
+        if not match:
+            caller.msg(player.key + " is not playing a game.")
+            return
+        if caller in match.participants:
+            caller.msg("You cannot watch your own match.")
+            return
+        caller.msg("You watch %s. Stop with 'tt watch'." 
+                   % " and ".join(participant.key for participant in match.participants))
+        match.add_spectator(caller)
+
+    def redraw(self, setting):
+        """
+        Turns board redraw on or off for the caller. See redraw_height().
+        """
+        caller = self.caller
+        setting = setting.lower()
+        if setting not in ("on", "off"):
+            caller.msg("Board redraw is %s. Usage: 'tt redraw [on/off]'" 
+                       % ("on" if caller.attributes.get(REDRAW_ATTRIBUTE) else "off"))
+            return
+        caller.attributes.add(REDRAW_ATTRIBUTE, setting == "on")
+        if setting == "off":
+            end_redraw(caller)
+            caller.msg("Board redraw is off.")
+            return
+        caller.msg("Board redraw is on. On telnet clients that report their screen "
+                   "size, the board stays at the top of the screen and only changes "
+                   "are sent. Redraw it with 'tt board'.")
+
+    def trade(self, setting):
+        """
+        Opts the caller in to a trade rule, or out of trading. Cards are
+        only traded when both players have opted in to the same rule.
+        """
+        caller = self.caller
+        rule = {rule.lower(): rule for rule in TRADE_RULES}.get(setting.lower())
+        if setting.lower() == "off":
+            caller.attributes.remove(TRADE_ATTRIBUTE)
+            caller.msg("You no longer trade cards.")
+        elif rule is None:
+            caller.msg("You trade cards under: %s. Usage: 'tt trade <%s/off>'" 
+                       % (caller.attributes.get(TRADE_ATTRIBUTE) or "no rule", 
+                          "/".join(TRADE_RULES)))
+        else:
+            caller.attributes.add(TRADE_ATTRIBUTE, rule)
+            caller.msg("You trade cards under the %s rule, against players who have "
+                       "chosen it too, when both hands are dealt from your "
+                       "collections." % rule)
+
+    def deck(self, setting):
+        """
+        Chooses the five cards the caller is dealt, from their collection,
+        or goes back to random cards with 'off'. Shows the deck with no 
+        setting.
+        """
+        caller = self.caller
+        usage = "Usage: 'tt deck [card], [card], [card], [card], [card]' or 'tt deck off'"
+        if setting.lower() == "off":
+            caller.attributes.remove(DECK_ATTRIBUTE)
+            caller.msg("You will be dealt random cards from your collection.")
+            return
+        if not setting:
+            deck = caller.attributes.get(DECK_ATTRIBUTE)
+            if not deck:
+                caller.msg("You have not chosen a deck. " + usage)
+            else:
+                caller.msg("Your deck: %s. %s" 
+                           % (", ".join(cards.NAMES[card_id] for card_id in deck), usage))
+            return
+        
+        names = [name.strip() for name in setting.split(",")]
+        deck = [cards.find(name) for name in names]
+        if len(deck) != HAND_SIZE:
+            caller.msg("A deck is %i cards. %s" % (HAND_SIZE, usage))
+            return
+        if None in deck:
+            caller.msg("There is no card called %s." % names[deck.index(None)])
+            return
+        if not caller.card_collection.owns(deck):
+            caller.msg("You do not own all of those cards.")
+            return
+        caller.attributes.add(DECK_ATTRIBUTE, tuple(deck))
+        caller.msg("Your deck is now: %s. It is dealt to you unless the Random rule is "
+                   "in play." % ", ".join(cards.NAMES[card_id] for card_id in deck))
+
+    def board(self, args):
+        """
+        Sends the board of the match the caller is playing or watching in 
+        full again.
+        """
+        caller = self.caller
+        match = get_match(caller) or MATCHES.get(caller.ndb.tripletriad_watching)
+        if not match:
+            caller.msg("You are not playing or watching a game.")
+            return
+        match.refresh_board(caller)
+
+    def history(self, target):
+        """
+        Shows the latest games and the record of the caller, or of another 
+        player. The lookup runs off the reactor (see 
+        features/tripletriad_history.py) and the caller is messaged when it
+        is done.
+        """
+        caller = self.caller
+        player = caller
+        if target:
+            player = caller.search(target, global_search=True)
+            if not player:
+                caller.msg(target + " could not be located.")
+                return
+        history = get_history()
+        
+        def lookup():
+            return history.recent(player.id), history.record(player.id)
+        
+        def show(found):
+            games, (wins, draws, losses) = found
+            if not games:
+                caller.msg(player.key + " has not finished a game.")
+                return
+            lines = ["Last %i games of %s - %i wins, %i draws, %i losses." 
+                     % (len(games), player.key, wins, draws, losses)]
+            lines.extend(history_line(game) for game in games)
+            lines.append("Replay a game with 'tt replay [match id]'.")
+            caller.msg("\n".join(lines))
+        
+        history.query(lookup).addCallbacks(show, self.history_failed)
+
+    def versus(self, target):
+        """
+        Shows the caller's record against another player and their latest 
+        games against each other.
+        """
+        caller = self.caller
+        if not target:
+            caller.msg("Versus whom? Usage: 'tt versus [player]'")
+            return
+        opponent = caller.search(target, global_search=True)
+        if not opponent:
+            caller.msg(target + " could not be located.")
+            return
+        if opponent == caller:
+            caller.msg("You cannot play by yourself.")
+            return
+        history = get_history()
+        
+        def lookup():
+            return (history.recent(caller.id, opponent=opponent.id), 
+                    history.record(caller.id, opponent.id))
+        
+        def show(found):
+            games, (wins, draws, losses) = found
+            lines = ["Against %s: %i wins, %i draws, %i losses." 
+                     % (opponent.key, wins, draws, losses)]
+            lines.extend(history_line(game) for game in games)
+            caller.msg("\n".join(lines))
+        
+        history.query(lookup).addCallbacks(show, self.history_failed)
+
+    def games(self, target):
+        """
+        Shows the latest games played under exactly the Game Rules given, 
+        separated by commas, or with no rules if none are given.
+        """
+        caller = self.caller
+        names = {rule.lower(): rule for rule in RULES}
+        rules = [names.get(rule.strip().lower()) for rule in target.split(",") if rule.strip()]
+        if None in rules:
+            caller.msg("Usage: 'tt games [rule, rule, ...]'. The rules are: %s." 
+                       % ", ".join(RULES))
+            return
+        
+        def show(games):
+            described = ", ".join(rules) or "no rules"
+            if not games:
+                caller.msg("No games have been played with %s." % described)
+                return
+            lines = ["Last %i games played with %s:" % (len(games), described)]
+            lines.extend(games_line(game) for game in games)
+            lines.append("Replay a game with 'tt replay [match id]'.")
+            caller.msg("\n".join(lines))
+        
+        history = get_history()
+        history.query(history.by_rules, rules_mask(rules)).addCallbacks(show, self.history_failed)
+
+    def history_failed(self, failure):
+        """
+        Tells the caller a match history lookup failed, and logs why.
+        """
+        logger.log_err(failure.getTraceback())
+        self.caller.msg("The match history is unavailable. Please try again later.")
+
+    def ladder(self, args):
+        """
+        Shows a page of the rated match leaderboard and the caller's rank.
+        """
+        caller = self.caller
+        ladder = get_manager().ladder
+        page = int(args) if args.isdigit() else 1
+        pages = max(1, -(-len(ladder) // PAGE_SIZE))
+        lines = ["Triple Triad Ladder - page %i of %i" % (min(page, pages), pages)]
+        for rank, name, rating, games in ladder.page(page):
+            lines.append("%4i. %-20s %5i  (%i games)" % (rank, name, rating, games))
+        rank = ladder.rank(caller.id)
+        if rank is None:
+            lines.append("You are unrated. Join a rated match with 'tt queue'.")
+        else:
+            lines.append("You are ranked %i with a rating of %i." 
+                         % (rank, ladder.rating(caller.id)))
+        caller.msg("\n".join(lines))
+
 ##############################################################################
 #
-# Triple Triad Script
+# Triple Triad Match
 #
 ##############################################################################
 
+TURN_TIMEOUT = 60 * 2   # Seconds a player has to take their turn.
+TIMEOUT_CHECK = 5       # Seconds between checks of the turn deadlines.
+MATCH_CATEGORY = "tripletriad_match"
+SUDDEN_DEATH_ROUNDS = 5 # Extra rounds played before a tie stands.
+HINT_COUNT = 5          # Moves shown by tt hint.
+REDRAW_ATTRIBUTE = "tripletriad_redraw"
+REDRAW_PROTOCOLS = ("telnet", "telnet/ssl", "ssh")
+REDRAW_SCROLL = 5       # Lines a screen needs below a redrawn board.
+CLIENT_FLAG = "TRIPLETRIAD_CLIENT"  # Protocol flag of webclients drawing boards.
+# Bytes logged per finished round.
+ROUND_LENGTH = HEADER.size + CELLS
 
-class TripleTriadHandler(Script):
-    """This implements the game handler."""
 
-    #########################################################################
-    # Create Game
-    #########################################################################
+class TripleTriadMatch:
+    """
+    One game of Triple Triad, hosted by the TripleTriadManager.
     
-    def at_script_creation(self):
+    Matches are plain objects rather than Scripts, so any number can run at 
+    once without a database row and timer each. A match is saved to a single
+    Attribute on the manager (see checkpoint()) and rebuilt from it after a
+    reload or restart.
+    
+    Attributes:
+        id (int): Match id, unique for the life of the manager.
+        phase (str): Used to determine what phase to initialise the game 
+                     for: invitation / game.
+        participants (list): Players in seat order. The player in seat 0 
+                             moves first. [player1, player2]
+        rules (list): Game Rules in effect, as named in the module 
+                      docstring. ["Open", "Same"]
+        engine (TripleTriadEngine): The live game, which keeps track of both
+                hands, the cards on the gameboard, their owners, the score 
+                and whose turn it is. See features/tripletriad_engine.py.
+        seed (int): Seed of everything random in the match. Saved with it,
+                    see TripleTriadManager.create_match.
+        rated (bool): Whether the result counts towards the ladder.
+        trade (str): Trade rule paid out at the end, from TRADE_RULES, or 
+                     None for no trade.
+        log (bytearray): Every move of the match, one byte each. See 
+                         features/tripletriad_log.py.
+        origins (bytearray): Seat each card slot was first dealt to, which 
+                             Sudden Death rounds can change from the seat 
+                             holding it.
+        deadline (float): Time by which the current player must move.
+        thinking (bool): Whether an AI move has been asked for and not yet 
+                         played.
+        spectators (list): Characters watching the match. Not saved, so 
+                           spectators stop watching after a reload.
+        shown (tuple): Length of the log and the owner of each cell when the
+                       board was last shown, or None.
+    """
+
+    def __init__(self, manager, match_id, participants, phase, rules=(), seed=0, 
+                 rated=False, trade=DEFAULT_TRADE_RULE, state=None, log=None, 
+                 origins=None):
+        self.manager = manager
+        self.id = match_id
+        self.participants = list(participants)
+        self.phase = phase
+        self.rules = list(rules)
+        self.seed = seed
+        self.rated = rated
+        self.trade = trade
+        self.engine = TripleTriadEngine.unpack(state) if state else TripleTriadEngine()
+        self.log = bytearray(log or b"")
+        self.origins = bytearray(origins or bytes(slot // HAND_SIZE for slot in range(SLOTS)))
+        self.saved_state = state
+        self.thinking = False
+        self.deadline = None
+        self.spectators = []
+        self.shown = None
+
+    @property
+    def attribute_key(self):
+        """
+        Key of the Attribute the match is saved to on the manager.
+        """
+        return "match_%i" % self.id
+
+    def checkpoint(self):
+        """
+        Saves the match to the database in a single write, if it has changed 
+        since the last checkpoint.
         """
-        Initialises Game Handler and idles waiting for Game to be Initialised.
-        
-        self.db.phase [str] - Used to determine what phase to initialise 
-                              the game for: invitation / game.
-        
-        self.db.gameboard [dict of lists] - Keeps track of cards on gameboard. 
-                Will be used like:
-                gameboard = {
-                    "A1": [card, player1],
-                    "A2": [card, player2],
-                    ...
-        
-        self.db.particpants [dict of lists] - Keeps track of players and 
-                their current hands. Will be used like:
-                participants = {player1: [card, None, card, card, card],
-                                player2: [card, card, None, None, card]}
-                            
-        self.db.turn_order [list] - Keeps track of turn order. 
-                Will be used like:
-                turn_order = [player1, player2]
-        """
-        # Script attributes.
-        self.key = "game_handler_%i" % random.randint(1, 1000)
-        self.desc = "handles games"
-        self.interval = 60 * 2  # two minute timeout
-        self.start_delay = True # Started with initialise_game_information()
-        
-        # Game attributes
-        self.db.phase = None
-        self.db.gameboard = {
-            "a1": [None, None],
-            "a2": [None, None],
-            "a3": [None, None],
-            "b1": [None, None],
-            "b2": [None, None],
-            "b3": [None, None],
-            "c1": [None, None],
-            "c2": [None, None],
-            "c3": [None, None]}
-        self.db.participants = {}
-        self.db.turn_order = []
+        state = self.engine.pack()
+        if state != self.saved_state:
+            self.manager.attributes.add(self.attribute_key,
+                                        {"participants": self.participants,
+                                         "phase": self.phase,
+                                         "rules": self.rules,
+                                         "seed": self.seed,
+                                         "rated": self.rated,
+                                         "trade": self.trade,
+                                         "state": state,
+                                         "log": bytes(self.log),
+                                         "origins": bytes(self.origins)},
+                                        category=MATCH_CATEGORY)
+            self.saved_state = state
 
     #########################################################################
     # Begin Game Lifecycle
     #########################################################################
 
-    def initialise_game_information(self, participants, phase):
+    def deal(self, hands):
         """
-        Triggered by external code to initialise game values before the game 
-        starts. Then starts the game!
+        Deals each player's five card ids, in seat order, onto a board set 
+        up for the match's rules.
         """
-        self.db.phase = phase
-        self.db.participants = participants
-        # Randomise first turn order
-        turn_order = list(participants.keys())
-        random.shuffle(turn_order)
-        self.db.turn_order = turn_order
+        mask = rules_mask(self.rules)
+        self.engine.set_rules(mask, element_layout(mask, self.seed))
+        for seat, hand in enumerate(hands):
+            self.engine.deal(seat, hand)
+        self.log = new_log(self.engine, self.rules, self.seed)
+        self.checkpoint()
 
-        self.at_start()
-    
-    def at_start(self):
+    def start_turn(self):
         """
         This method is called: 
-            1. When script first starts, 
+            1. When the match first starts, 
             2. After Evennia reloads, 
             3. At the start of each new turn.
-        It is assumed the script is stocked with the correct information.
+        Shows both players the board, starts the turn timer and lets an AI 
+        take its turn.
         """
-        # Set up the phase.
-        if self.db.phase == "game" and self.db.participants:
-            for participant in self.db.participants:
-                # self.initiate_new_turn(participant)
-                # TEST
-                participant.ndb.game_handler = self
-                participant.msg(self.display_gameboard(participant))
-                # End Test
+        if self.phase == "game" and self.participants:
+            self.show_gameboards()
+            self.manager.schedule(self)
         
             # If AIs turn, trigger AI.
             if not self.current_player().has_account:
-                self.random_ai_action()
-
-    #########################################################################
-    # Game Phase
-    #########################################################################
-
-    #########################
-    # Iniatiate new Game Turn
-    #########################
-
-    # def initiate_new_turn(self, participant):
-    #     """
-    #     Run for each participant.
-    #     Both players are presented the board. The player with the 'turn' is
-    #     prompted and the game waits for their reponse.
-    #     """
-    #     participant.ndb.game_handler = self
-    #     participant.msg(self.display_gameboard(participant))
+                self.ai_action()
 
     #########################
     # General Player Actions - available at any time
@@ -328,6 +814,7 @@ class TripleTriadHandler(Script):
         Forfeits the match.
         """
         self.msg_all(caller.key + " has forfeitted the game")
+        self.manager.record_result(self, 1 - self.participants.index(caller))
         self.stop()
 
     #########################
@@ -339,115 +826,83 @@ class TripleTriadHandler(Script):
         Called by a player making an action via the Triple Triad Command.
         Checks should already by made. We should assume the move is legal.
         """
-        current_player = self.current_player()
-        current_hand = self.db.participants[current_player]
-        played_card = current_hand[card_position]
-        gameboard = self.db.gameboard
-        
-        # Make the game data changes
-        gameboard[board_position][0] = played_card
-        gameboard[board_position][1] = current_player
-        current_hand[card_position] = None
-        
-        # Calculate Consequences
-        board_position_relationships = {
-            "a1": {"a2": ["down", "up"], "b1": ["right", "left"]},
-            "a2": {"a1": ["up", "down"], "a3": ["down", "up"], "b2": ["right", "left"]},
-            "a3": {"a2": ["up", "down"], "b3": ["right", "left"]},
-            "b1": {"b2": ["down", "up"], "a1": ["left", "right"], "c1": ["right", "left"]},
-            "b2": {"b1": ["up", "down"], "b3": ["down", "up"], "a2": ["left", "right"], "c2": ["right", "left"]},
-            "b3": {"b2": ["up", "down"], "a3": ["left", "right"], "c3": ["right", "left"]},
-            "c1": {"c2": ["down", "up"], "b1": ["left", "right"]},
-            "c2": {"c1": ["up", "down"], "c3": ["down", "up"], "b2": ["left", "right"]},
-            "c3": {"c2": ["up", "down"], "b3": ["left", "right"]}}
-        
-        for position in board_position_relationships[board_position]:
-            relationship = board_position_relationships[board_position][position]
-            adjacent_card = gameboard[position][0]
-            if adjacent_card and played_card[relationship[0]] > adjacent_card[relationship[1]]:
-                gameboard[position][1] = current_player
-            
-        # End Turn
-        self.ndb.turn_complete = True
-        self.db.phase = "game"
-        self.force_repeat()
+        self.play(card_position, CELL_INDEX[board_position])
+        self.end_turn()
 
-    def random_ai_action(self):
+    def ai_action(self):
         """
-        Called by an AI making an action via the Triple Triad Command.
-        Checks should already by made. We should assume the move is legal.
+        Called when it is an AI's turn. Asks the AI workers for a move at the
+        AI character's difficulty, set with the `tripletriad_difficulty` 
+        Attribute (see DIFFICULTIES in features/tripletriad_ai.py). The move
+        is played when the workers answer, so the search never holds up the
+        server (see features/tripletriad_workers.py).
+        
+        With the Open rule the AI can see both hands and searches the game 
+        tree with an AlphaBetaSearch, solving late-game positions exactly 
+        with the endgame tablebase at harder difficulties. Otherwise it 
+        plays a MonteCarloSearch, which only guesses at its opponent's hand.
+        """
+        if self.thinking:
+            return
+        difficulty = self.current_player().attributes.get("tripletriad_difficulty", 
+                                                          default=DEFAULT_DIFFICULTY)
+        self.thinking = True
+        deferred = get_ai_service().request(self.id, self.engine.turn, self.engine, self.log,
+                                            difficulty, hidden="Open" not in self.rules)
+        deferred.addCallback(self.ai_move, self.engine.key)
+        deferred.addErrback(lambda failure: logger.log_err(failure.getTraceback()))
+
+    def ai_move(self, result, key):
+        """
+        Plays the move chosen by the AI workers, unless the match has ended
+        or moved on while they were thinking.
+        
+        Args:
+            result (tuple): ((hand position, cell), fallback), fallback being 
+                            True if the workers missed their deadline.
+            key (int): Position key of the match when the move was asked for.
+        """
+        self.thinking = False
+        if MATCHES.get(self.id) is not self or self.engine.key != key:
+            return
+        move, fallback = result
+        self.play(*move, fallback=fallback)
+        self.end_turn()
+
+    def play(self, card_position, cell, fallback=False):
         """
-        current_player = self.current_player()
-        current_hand = self.db.participants[current_player]
-        gameboard = self.db.gameboard
-        
-        # Randomly select a card from available card positions
-        available_cards = [position for position in range(5) if current_hand[position] is not None]
-        card_position = random.choice(available_cards)
-        played_card = current_hand[card_position]
-        
-        # Randomly select a board position from available board positions
-        available_positions = [position for position in gameboard.keys() if gameboard[position][0] is None]
-        board_position = random.choice(available_positions)
-        
-        # Make the game data changes
-        gameboard[board_position][0] = played_card
-        gameboard[board_position][1] = current_player
-        current_hand[card_position] = None
-        
-        # Calculate Consequences
-        board_position_relationships = {
-            "a1": {"a2": ["down", "up"], "b1": ["right", "left"]},
-            "a2": {"a1": ["up", "down"], "a3": ["down", "up"], "b2": ["right", "left"]},
-            "a3": {"a2": ["up", "down"], "b3": ["right", "left"]},
-            "b1": {"b2": ["down", "up"], "a1": ["left", "right"], "c1": ["right", "left"]},
-            "b2": {"b1": ["up", "down"], "b3": ["down", "up"], "a2": ["left", "right"], "c2": ["right", "left"]},
-            "b3": {"b2": ["up", "down"], "a3": ["left", "right"], "c3": ["right", "left"]},
-            "c1": {"c2": ["down", "up"], "b1": ["left", "right"]},
-            "c2": {"c1": ["up", "down"], "c3": ["down", "up"], "b2": ["left", "right"]},
-            "c3": {"c2": ["up", "down"], "b3": ["left", "right"]}}
-        
-        for position in board_position_relationships[board_position]:
-            relationship = board_position_relationships[board_position][position]
-            adjacent_card = gameboard[position][0]
-            if adjacent_card and played_card[relationship[0]] > adjacent_card[relationship[1]]:
-                gameboard[position][1] = current_player
-        
-        # End Turn
-        self.ndb.turn_complete = True
-        self.db.phase = "game"
-        # Bypass force_repeat() because it doesn't like it being run during the
-        # first at_start() run and the ai's move is a fraction of a second any
-        # way so it doesn't matter that the turn timing is used for the next turn.
-        self.at_repeat()
+        Makes the game data changes, calculates consequences and logs the 
+        move, flagged if it was the AI's fallback move.
+        """
+        self.engine.play(card_position, cell)
+        self.log.append(encode_move(card_position, cell, fallback))
 
     #########################
     # Initiate end of Turn
     #########################
 
-    def at_repeat(self):
+    def end_turn(self):
         """
-        This is called every self.interval seconds (turn timeout) or
-        when force_repeat is called (when a player enters a command). We know 
-        this by checking the existence of the `invitation_turn` or 
-        `action_turn` NAttribute, set just before calling force_repeat.
+        Called once the current player has moved. The engine passes the turn
+        to the next player as part of each move.
         """
-        if self.ndb.turn_complete:
-            # Check win condition.
-            self.action_resolution()
-            
-            # Set up turn order for next turn.
-            order = self.db.turn_order
-            order[0], order[1] = order[1], order[0]
-            
-            # Set up players for next turn.
-            del self.ndb.turn_complete
-            self.at_start()
-            
-        else:
-            # turn timeout
-            self.msg_all("Game has ended due to inaction.")
-            self.stop()
+        # Save the completed turn.
+        self.checkpoint()
+        
+        # Check win condition.
+        if self.action_resolution():
+            return
+        
+        # Set up players for next turn.
+        self.start_turn()
+
+    def timeout(self):
+        """
+        Called by the manager when the current player misses their deadline.
+        """
+        self.msg_all("Game has ended due to inaction.")
+        self.manager.record_result(self, 1 - self.engine.turn)
+        self.stop()
 
     #########################
     # Check End of Game
@@ -456,163 +911,816 @@ class TripleTriadHandler(Script):
     def action_resolution(self):
         """
         Decides who the winner is.
+        
+        Returns:
+            ended (bool): True if the game is over and the match stopped.
         """
-        gameboard = self.db.gameboard
+        engine = self.engine
         
         # Game ends when all gameboard positions are filled.
-        if not [position for position in gameboard.keys() if gameboard[position][0] is None]:
-            for participant in self.db.participants:
-                participant.msg(self.display_gameboard(participant, title="GAME OVER"))
-                if self.calculate_score(participant) > 5:
-                    self.msg_all(participant.key + " has won the match.")
-                if self.calculate_score(participant) == 5:
-                    self.msg_all("The match was a tie.")
-            self.stop()
+        if not engine.is_over():
+            return False
+        
+        self.show_gameboards(title="GAME OVER")
+        
+        winner = engine.winner()
+        if winner is None and self.sudden_death():
+            return True
+        if winner is None:
+            self.msg_all("The match was a tie.")
+        else:
+            self.msg_all(self.participants[winner].key + " has won the match.")
+        self.manager.record_result(self, winner)
+        try:
+            self.pay_trades(winner)
+        except Exception:
+            logger.log_trace("Triple Triad trade of match %i failed." % self.id)
+            self.msg_all("The cards could not be traded. No cards have changed hands.")
+        self.msg_all("Replay this match with 'tt replay %i'." % self.id)
+        self.stop()
+        return True
+
+    def sudden_death(self):
+        """
+        Under the Sudden Death rule, continues a tied match with another 
+        round, up to SUDDEN_DEATH_ROUNDS. Each player is dealt the cards they
+        own at the end of the round. The match and its engine carry on in 
+        place.
+        
+        Returns:
+            continued (bool): True if a new round has started.
+        """
+        if "Sudden Death" not in self.rules:
+            return False
+        if len(self.log) >= (SUDDEN_DEATH_ROUNDS + 1) * ROUND_LENGTH:
+            return False
+        
+        order = self.engine.redeal()
+        self.origins[:] = bytes(self.origins[slot] for slot in order)
+        self.log += new_log(self.engine, self.rules, self.seed)
+        self.checkpoint()
+        self.msg_all("Sudden Death! The cards are dealt to whoever owns them.")
+        self.start_turn()
+        return True
+
+    def pay_trades(self, winner):
+        """
+        Moves the cards won under the trade rule between the participants' 
+        collections. Both collections are saved in one transaction, so a 
+        card is never lost or duplicated part way through.
+        
+        A card is skipped if its owner does not have a copy in their 
+        collection, and stays with its owner if the taker already has 
+        MAX_COPIES of it.
+        """
+        if not self.trade:
+            return
+        collections = [participant.card_collection for participant in self.participants]
+        changes = [{}, {}]
+        messages = []
+        for giver, taker, card_id in trade_cards(self.engine, self.trade, winner, 
+                                                 self.origins):
+            given = changes[giver].get(card_id, 0) - 1
+            if collections[giver].count(card_id) + given < 0:
+                continue
+            taken = changes[taker].get(card_id, 0) + 1
+            if collections[taker].count(card_id) + taken > MAX_COPIES:
+                messages.append("%s already has %i copies of %s, so %s keeps it." 
+                                % (self.participants[taker].key, MAX_COPIES, 
+                                   cards.NAMES[card_id], self.participants[giver].key))
+                continue
+            changes[giver][card_id] = given
+            changes[taker][card_id] = taken
+            messages.append("%s takes %s from %s." % (self.participants[taker].key, 
+                                                      cards.NAMES[card_id],
+                                                      self.participants[giver].key))
+        if not messages:
+            return
+        
+        try:
+            with transaction.atomic():
+                for participant, collection, change in zip(self.participants, 
+                                                           collections, changes):
+                    if not collection.apply(change):
+                        raise ValueError("Trade does not fit %s's collection." 
+                                         % participant.key)
+                    participant.save_card_collection()
+        except Exception:
+            # Reload both collections from the database as they were.
+            for participant in self.participants:
+                del participant.ndb.card_collection
+            raise
+        for message in messages:
+            self.msg_all(message)
 
     #########################
-    # Finish Script
+    # Finish Match
     #########################
 
-    def at_stop(self):
+    def stop(self):
         """
-        Called just before the script is stopped/destroyed.
-        
-        Conducts cleanup on each player connected to handler.
+        Ends the match, archives its log and removes it from the manager.
+        The log is written to the archive in the thread pool, so the
+        reactor never waits on the files or on a reader holding them.
         """
-        for participant in self.db.participants:
-            del participant.ndb.game_handler
+        deferred = threads.deferToThread(get_archive().append, self.id, bytes(self.log))
+        deferred.addErrback(self.archive_failed)
+        for viewer in self.participants + self.spectators:
+            end_board(viewer)
+        for spectator in self.spectators:
+            spectator.ndb.tripletriad_watching = None
+        self.spectators = []
+        self.manager.end_match(self)
+
+    def archive_failed(self, failure):
+        """
+        Logs a match log that could not be written to the archive.
+        """
+        logger.log_err("Triple Triad match %i could not be archived: %s" 
+                       % (self.id, failure.getTraceback()))
 
     #########################
     # Utility Methods
     #########################
 
-    def display_gameboard(self, participant, title = None):
-        
-        # Set Gameboard Appearance
-        form = {"FORM": """
-Your Cards                        xxxxKxxxx                        Their Cards
-  xxxxx                       A       B       C                       xxxxx
-1 xxAxx       Score       ┌───────┬───────┬───────┐       Score       xxFxx 6
-  xxxxx         xUx       │*xxxxx │*xxxxx │*xxxxx │         xVx       xxxxx
-    xxxxx               1 │ xxLxx │ xxMxx │ xxNxx │                 xxxxx
-  2 xxBxx                 │ xxxxx │ xxxxx │ xxxxx │                 xxGxx 7
-    xxxxx                 ├───────┼───────┼───────┤                 xxxxx
-      xxxxx               │*xxxxx │*xxxxx │*xxxxx │               xxxxx
-    3 xxCxx             2 │ xxOxx │ xxPxx │ xxQxx │               xxHxx 8 
-      xxxxx               │ xxxxx │ xxxxx │ xxxxx │               xxxxx
-        xxxxx             ├───────┼───────┼───────┤             xxxxx
-      4 xxDxx             │*xxxxx │*xxxxx │*xxxxx │             xxIxx 9
-        xxxxx           3 │ xxRxx │ xxSxx │ xxTxx │             xxxxx 
-          xxxxx           │ xxxxx │ xxxxx │ xxxxx │           xxxxx 
-        5 xxExx           └───────┴───────┴───────┘           xxJxx 10 
-          xxxxx                                               xxxxx
-"""}
-        
-        # Set Card Appearance
-        def return_card_string(card):
-            """ Turn {"name": "Geezard", "up": 5, "right": 5, "down": 5...}
-                Into:
-                      ┌ 1 ┐
-                      |1 1|
-                      └ 1 ┘
-            """
-            line1 = "┌ {} ┐".format(card["up"])
-            line2 = "|{}{}{}|".format(card["left"], card["element"] if card["element"] else " ", card["right"])
-            line3 = "└ {} ┘".format(card["down"])
-            return line1 + "\n" + line2 + "\n" + line3
-        
-        # Set Information to be displayed on Gameboard
-        cells = {}
-        participants = self.db.participants
-        turn_order = list(self.db.turn_order)
-        gameboard = self.db.gameboard
-        player = participant
-        opponent = list(turn_order)
-        opponent.remove(player)
-        opponent = opponent[0]
-        
-        # Prepare Player's Hand
-        keys = list("ABCDE")
-        for card in participants[player]:
-            if card:
-                cells[keys.pop(0)] = return_card_string(card)
-            else:
-                # Handle blank space
-                cells[keys.pop(0)] = " "*5 + "\n" + " "*5 + "\n" + " "*5
-        
-        # Prepare Opponent's Hand
-        keys = list("FGHIJ")
-        for card in participants[opponent]:
-            if card:
-                cells[keys.pop(0)] = return_card_string(card)
-            else:
-                # Handle blank space
-                cells[keys.pop(0)] = " "*5 + "\n" + " "*5 + "\n" + " "*5
-        
-        # Prepare Turn Indicator
-        if not title:
-            if player == turn_order[0]:
-                cells["K"] = "YOUR TURN"
-            else:
-                cells["K"] = "OPPS TURN"
-        else:
-            cells["K"] = title
-        
-        # Prepare GameBoard
-        keys = list("LMNOPQRST")
-        positions = ["a1", "b1", "c1", "a2", "b2", "c2", "a3", "b3", "c3"]
-        for position in positions:
-            if gameboard[position][0]:
-                cells[keys.pop(0)] = return_card_string(gameboard[position][0])
-            else:
-                # Handle blank space
-                cells[keys.pop(0)] = " "*5 + "\n" + " "*5 + "\n" + " "*5
-        
-        # Prepare Score
-        cells["U"] = self.calculate_score(player)
-        cells["V"] = self.calculate_score(opponent)
-        
-        form = str(evform.EvForm(form=form, cells=cells))
-        
-        # Switch out the card ownership symbols * with < or >
-        positions = ["a1", "b1", "c1", "a2", "b2", "c2", "a3", "b3", "c3"]
-        for position in positions:
-            if gameboard[position][1]:
-                if gameboard[position][1] == player:
-                    form = form.replace("*", "<", 1)
-                else:
-                    form = form.replace("*", ">", 1)
+    def display_gameboards(self, title=None):
+        """
+        Draws the gameboard as seen by each participant, in seat order, 
+        then as seen by spectators if anyone is watching. All views are 
+        built together so shared pieces are only drawn once.
+        """
+        # Without the Open rule, the opponent's hand is face down.
+        hidden = "Open" not in self.rules and title != "GAME OVER"
+        return render_frames(self.engine, title=title, hidden=(hidden, hidden),
+                             neutral=hidden if self.spectators else None)
+
+    def show_gameboards(self, title=None):
+        """
+        Sends each participant their view of the gameboard and every 
+        spectator the one spectators' view. The text board is only drawn if
+        a session is to be sent it.
+        """
+        if self.spectators:
+            self.prune_spectators()
+        shared = {}
+        for index, viewer in enumerate(self.participants + self.spectators):
+            self.show_viewer(viewer, min(index, 2), title, shared)
+        self.shown = (len(self.log), tuple(self.engine.owner))
+
+    def show_viewer(self, viewer, view, title=None, shared=None, sessions=None):
+        """
+        Sends one viewer their view of the gameboard. Webclient sessions 
+        that draw the board themselves are sent a message with the move 
+        since the board they were last sent, or the whole board (see 
+        features/tripletriad_oob.py). Other sessions are sent the text 
+        board.
+
+        Args:
+            viewer (Character): Participant or spectator.
+            view (int): Seat of a participant, or 2 for spectators.
+            title (str, optional): Shown instead of whose turn it is.
+            shared (dict, optional): Boards, messages and redraws already 
+                                     built while showing the same board to 
+                                     other viewers.
+            sessions (list, optional): Sessions to send it to. Defaults to 
+                                       all of the viewer's sessions.
+        """
+        shared = {} if shared is None else shared
+        messages = shared.setdefault("messages", {})
+        text_sessions = []
+        for session in sessions or viewer.sessions.all():
+            if not session.protocol_flags.get(CLIENT_FLAG):
+                text_sessions.append(session)
+                continue
+            moved = (self.shown is not None and len(self.log) == self.shown[0] + 1
+                     and session.ndb.tripletriad_seen == (self.id, self.shown[0]))
+            key = "move" if moved else view
+            if key not in messages:
+                messages[key] = self.board_message(view, title, moved)
+            session.ndb.tripletriad_seen = (self.id, len(self.log))
+            viewer.msg(tripletriad=((), messages[key]), session=session)
+        if text_sessions:
+            if "boards" not in shared:
+                shared["boards"] = self.display_gameboards(title)
+            self.send_board(viewer, shared["boards"][view], text_sessions,
+                            shared.setdefault("diffs", {}))
+
+    def board_message(self, view, title=None, moved=False):
+        """
+        Returns the webclient message showing a view of the gameboard: the 
+        last move if moved, otherwise the whole board.
+        """
+        engine = self.engine
+        if moved:
+            card, cell = decode_move(self.log[-1])
+            flips = [other for other in range(CELLS) 
+                     if other != cell and self.shown[1][other] != engine.owner[other]]
+            return move_message(self.id, len(self.log), engine, card, cell, flips, title,
+                                reveal=title == "GAME OVER" and "Open" not in self.rules)
+        hidden = "Open" not in self.rules and title != "GAME OVER"
+        seat = view if view < 2 else None
+        return state_message(self.id, len(self.log), engine, seat,
+                             tuple(hidden and player != seat for player in (0, 1)),
+                             [participant.key for participant in self.participants],
+                             self.rules, title)
+
+    def send_board(self, viewer, frame, sessions=None, diffs=None):
+        """
+        Sends a view of the text gameboard to a viewer's sessions. Sessions
+        that can redraw the board (see redraw_height) are sent the whole 
+        board the first time, or when their screen has changed size, and 
+        after that only the changes since the board they were last sent.
+
+        Args:
+            viewer (Character): Participant or spectator.
+            frame (str): The view, from display_gameboards().
+            sessions (list, optional): Sessions to send it to. Defaults to 
+                                       all of the viewer's sessions.
+            diffs (dict, optional): Changes already worked out while sending
+                                    this frame, keyed (last frame, frame), 
+                                    so viewers in step share them.
+        """
+        if sessions is None:
+            sessions = viewer.sessions.all()
+        redraw = viewer.attributes.get(REDRAW_ATTRIBUTE)
+        diffs = {} if diffs is None else diffs
+        for session in sessions:
+            height = redraw_height(session, frame) if redraw else None
+            if height is None:
+                viewer.msg(frame, session=session)
+                continue
+            last = session.ndb.tripletriad_frame
+            if last is None or session.ndb.tripletriad_height != height:
+                text = redraw_full(frame, height)
             else:
-                form = form.replace("*", " ", 1)
-        return form
+                text = diffs.get((last, frame))
+                if text is None:
+                    text = diffs[(last, frame)] = redraw_diff(last, frame)
+            session.ndb.tripletriad_frame = frame
+            session.ndb.tripletriad_height = height
+            if text:
+                viewer.msg(text=(text, {"raw": True}), session=session)
+
+    def refresh_board(self, viewer):
+        """
+        Sends a participant or spectator their view of the gameboard in 
+        full, for when their screen no longer shows it as it was sent.
+        """
+        for session in viewer.sessions.all():
+            session.ndb.tripletriad_frame = None
+            session.ndb.tripletriad_seen = None
+        if viewer in self.participants:
+            self.show_viewer(viewer, self.participants.index(viewer))
+        elif viewer in self.spectators:
+            self.show_viewer(viewer, 2)
+
+    #########################
+    # Spectators
+    #########################
+
+    def add_spectator(self, spectator):
+        """
+        Lets a character watch the match, showing them the board.
+        """
+        if spectator not in self.spectators:
+            self.spectators.append(spectator)
+        spectator.ndb.tripletriad_watching = self.id
+        self.show_viewer(spectator, 2)
+
+    def remove_spectator(self, spectator):
+        """
+        Stops a character watching the match.
+        """
+        if spectator in self.spectators:
+            self.spectators.remove(spectator)
+        spectator.ndb.tripletriad_watching = None
+        end_board(spectator)
+
+    def prune_spectators(self):
+        """
+        Stops spectators who have left the room of every participant from 
+        watching.
+        """
+        locations = [participant.location for participant in self.participants]
+        for spectator in list(self.spectators):
+            if spectator.location not in locations:
+                self.remove_spectator(spectator)
+
+    def display_gameboard(self, participant, title=None):
+        """
+        Draws the gameboard as seen by one participant.
+        """
+        return self.display_gameboards(title)[self.participants.index(participant)]
 
     def current_player(self):
         """
-        Called just before the script is stopped/destroyed.
-        Conducts cleanup on each trainer connected to handler.
+        Returns the player whose turn it is.
         """
-        return self.db.turn_order[0]
+        return self.participants[self.engine.turn]
 
     def calculate_score(self, participant):
         """
-        Called just before the script is stopped/destroyed.
-        Conducts cleanup on each trainer connected to handler.
+        Returns the participant's score: cards in hand plus cards owned on the
+        board. Kept up to date by the engine as cards are played and captured.
         """
-        score = 0
-        gameboard = self.db.gameboard
-        current_hand = self.db.participants[participant]
-        for card in current_hand:
-            if card:
-                score+= 1
-        for position in gameboard:
-            if gameboard[position][1] == participant:
-                score+= 1
-        return score
+        return self.engine.scores[self.participants.index(participant)]
 
     def msg_all(self, message, exceptions=()):
         """
-        Send message to all participants
+        Send message to all participants and spectators
         """
-        for participant in self.db.participants:
+        for participant in self.participants + self.spectators:
             if participant not in exceptions:
                 participant.msg(message)
+
+##############################################################################
+#
+# Triple Triad Manager
+#
+##############################################################################
+
+# Process-wide registry of running matches, rebuilt by the manager when the
+# server starts.
+MATCHES = {}        # {match id: TripleTriadMatch}
+PLAYERS = {}        # {player id: TripleTriadMatch}
+# Heap of (deadline, match id). An entry is stale, and skipped, if the match
+# has ended or its deadline has moved on since the entry was pushed.
+DEADLINES = []
+
+MANAGER_KEY = "tripletriad_manager"
+LADDER_SAVE_INTERVAL = 60 * 5
+_MANAGER = []
+
+
+class TripleTriadManager(Script):
+    """
+    This is a Global Script. It hosts every Triple Triad match in the game
+    and times out players who miss their turn deadline.
+    
+    Each match is saved to its own Attribute on this script, in the 
+    `tripletriad_match` category, so a turn costs one database write however
+    many matches are running. When the server starts the matches are rebuilt
+    into the process-wide registry, where a player's match is found in one 
+    dictionary lookup.
+    
+    It also runs the rated match ladder: the matchmaking queue is checked 
+    every few seconds, and ratings are updated in memory after each rated
+    match and saved every LADDER_SAVE_INTERVAL seconds. The queue is saved
+    whenever a player joins or leaves it, so it survives a reload, and 
+    players who have gone offline are dropped from it before pairing.
+    
+    self.db.next_id [int] - Id of the next match created.
+    
+    self.db.ladder [dict] - Saved ratings. See features/tripletriad_ladder.py.
+    
+    self.db.queue [list] - (player, time joined) of each player waiting for 
+        a rated match, in join order.
+    
+    self.db.regions [dict] - Game Rules of each region as a bitmask. See 
+        features/tripletriad_regions.py.
+    """
+
+    def at_script_creation(self):
+        self.key = MANAGER_KEY
+        self.desc = "Hosts Triple Triad matches."
+        self.interval = TIMEOUT_CHECK
+        self.persistent = True  # Resume games after a restart.
+        self.db.next_id = 1
+        self.db.ladder = {}
+        self.db.queue = []
+        self.db.regions = starting_rules()
+
+    def at_start(self):
+        """
+        Called when the script starts, including after a reload or restart.
+        Rebuilds the registry from the saved matches.
+        """
+        self.seed_next_id()
+        for attribute in self.attributes.get(category=MATCH_CATEGORY, 
+                                             return_obj=True, return_list=True):
+            match_id = int(attribute.key.split("_")[-1])
+            if match_id in MATCHES:
+                continue
+            record = attribute.value
+            match = TripleTriadMatch(self, match_id, record["participants"], 
+                                     record["phase"], record["rules"], 
+                                     seed=record["seed"], rated=record["rated"],
+                                     trade=record["trade"], state=record["state"],
+                                     log=record["log"], origins=record.get("origins"))
+            self.register(match)
+            match.start_turn()
+
+    def seed_next_id(self):
+        """
+        Moves next_id past every match id in the match history and archive,
+        so a manager created again never reuses the id of a finished match.
+        """
+        try:
+            used = max(get_history().last_match(), get_archive().last_match())
+        except Exception:
+            logger.log_trace("Triple Triad match ids could not be checked.")
+            return
+        if used >= (self.db.next_id or 1):
+            self.db.next_id = used + 1
+
+    #########################
+    # Match Lifecycle
+    #########################
+
+    def create_match(self, participants, phase, rules=(), rated=False, 
+                     trade=DEFAULT_TRADE_RULE, seed=None):
+        """
+        Triggered by external code to start a new match.
+        
+        Each player is dealt the deck they have chosen with 'tt deck' if 
+        they still own it and the Random rule is not in play, five random 
+        cards from their collection otherwise, or five random cards if they
+        own fewer than five (see collection_hand).
+        
+        Everything random about the match, the turn order, the hands dealt,
+        the Elemental layout and the AI's choices, comes from its seed, so
+        a match can be started again from the same seed and collections and
+        play out identically.
+        
+        Args:
+            participants (list): The two players. [player1, player2]
+            phase (str): The phase to start the game in.
+            rules (list, optional): Game Rules in effect.
+            rated (bool, optional): Whether the result counts towards the 
+                                    ladder.
+            trade (str, optional): Trade rule, from TRADE_RULES. Defaults 
+                                   to the rule both players have opted in
+                                   to with 'tt trade', if any. There is no
+                                   trade unless both players are dealt 
+                                   from their own collections.
+            seed (int, optional): Seed of the match. Random if not given.
+            
+        Returns:
+            match (TripleTriadMatch): The new match.
+        """
+        match_id = self.db.next_id
+        self.db.next_id = match_id + 1
+        
+        if seed is None:
+            seed = random.getrandbits(32)
+        rng = random.Random(seed)
+        
+        # Randomise first turn order
+        seats = list(participants)
+        rng.shuffle(seats)
+        
+        hands, owned = [], True
+        for participant in seats:
+            hand = collection_hand(participant, rules, rng)
+            owned = owned and hand is not None
+            hands.append(hand or cards.random_hand(rng))
+        if trade is None:
+            trade = agreed_trade(seats)
+        if not owned:
+            trade = None
+        
+        match = TripleTriadMatch(self, match_id, seats, phase, rules, seed=seed, 
+                                 rated=rated, trade=trade)
+        self.register(match)
+        match.deal(hands)
+        match.start_turn()
+        return match
+
+    def register(self, match):
+        """
+        Adds a match to the registry.
+        """
+        MATCHES[match.id] = match
+        for participant in match.participants:
+            PLAYERS[participant.id] = match
+
+    def end_match(self, match):
+        """
+        Removes a match from the registry and deletes its saved state.
+        """
+        MATCHES.pop(match.id, None)
+        for participant in match.participants:
+            if PLAYERS.get(participant.id) is match:
+                del PLAYERS[participant.id]
+        match.deadline = None
+        self.attributes.remove(match.attribute_key, category=MATCH_CATEGORY)
+
+    #########################
+    # Ladder
+    #########################
+
+    @property
+    def ladder(self):
+        """
+        The live Ladder, loaded from the last save after a reload or restart.
+        """
+        ladder = self.ndb.ladder
+        if ladder is None:
+            ladder = self.ndb.ladder = Ladder(self.db.ladder)
+        return ladder
+
+    @property
+    def queue(self):
+        """
+        The live MatchmakingQueue, rebuilt from the saved queue after a 
+        reload or restart. The waiting players themselves are kept in 
+        self.ndb.queued, by player id.
+        """
+        queue = self.ndb.queue
+        if queue is None:
+            queue = self.ndb.queue = MatchmakingQueue()
+            self.ndb.queued = {}
+            for player, joined in self.db.queue or ():
+                if player is not None:
+                    queue.join(player.id, self.ladder.rating(player.id), joined)
+                    self.ndb.queued[player.id] = player
+        return queue
+
+    def save_queue(self):
+        """
+        Saves the matchmaking queue.
+        """
+        self.db.queue = [(self.ndb.queued[player_id], joined) 
+                         for player_id, (_, joined) in self.queue.waiting.items()]
+
+    def join_queue(self, player):
+        """
+        Adds a player to the matchmaking queue and starts any matches that
+        can be made.
+        """
+        self.queue.join(player.id, self.ladder.rating(player.id), time.time())
+        self.ndb.queued[player.id] = player
+        self.save_queue()
+        self.make_matches()
+
+    def leave_queue(self, player):
+        """
+        Removes a player from the matchmaking queue.
+        """
+        if player.id in self.queue:
+            self.queue.leave(player.id)
+            self.ndb.queued.pop(player.id, None)
+            self.save_queue()
+
+    def make_matches(self):
+        """
+        Drops waiting players who are no longer connected, then starts a 
+        rated match for each pair of waiting players close enough in 
+        rating.
+        """
+        queue, queued = self.queue, self.ndb.queued
+        changed = False
+        for player_id, player in list(queued.items()):
+            if not player.sessions.all():
+                queue.leave(player_id)
+                del queued[player_id]
+                changed = True
+        for pair in queue.pop_pairs(time.time()):
+            players = [queued.pop(player_id) for player_id in pair]
+            changed = True
+            self.create_match(players, "game", rated=True)
+        if changed:
+            self.save_queue()
+
+    def record_result(self, match, winner):
+        """
+        Adds a finished match to the match history, and updates the ladder 
+        after a rated match.
+        
+        Args:
+            match (TripleTriadMatch): The finished match.
+            winner (int or None): Seat of the winner, or None for a tie.
+        """
+        get_history().add(result_rows(match.id, [(participant.id, participant.key) 
+                                                 for participant in match.participants],
+                                      match.engine.scores, winner, rules_mask(match.rules),
+                                      match.rated))
+        if not match.rated:
+            return
+        score = 0.5 if winner is None else 1 - winner
+        changes = self.ladder.record([(participant.id, participant.key) 
+                                      for participant in match.participants], score)
+        for participant, change in zip(match.participants, changes):
+            participant.msg("Your rating changed by %+i to %i." 
+                            % (change, self.ladder.rating(participant.id)))
+
+    def save_ladder(self):
+        """
+        Saves the ladder, if it has changed since it was last saved.
+        """
+        ladder = self.ndb.ladder
+        if ladder is not None and ladder.dirty:
+            self.db.ladder = ladder.dump()
+            self.ndb.ladder_saved = time.time()
+
+    #########################
+    # Regions
+    #########################
+
+    def region_rules(self, challenger, participants):
+        """
+        Works out the Game Rules of a match the challenger starts in their
+        region, spreading or abolishing a rule as the challenger's carried
+        rules allow. The challenger then carries the region's rules.
+
+        Args:
+            challenger (Character): The player who started the match.
+            participants (iterable): Everyone in the match, told of the rules.
+
+        Returns:
+            rules (list): Game Rules of the match.
+        """
+        region = DEFAULT_REGION
+        if challenger.location:
+            region = challenger.location.attributes.get(REGION_ATTRIBUTE,
+                                                        default=DEFAULT_REGION)
+        regions = self.db.regions
+        if regions is None:
+            regions = starting_rules()
+        local = regions.get(region, 0)
+        carried = challenger.attributes.get(CARRIED_ATTRIBUTE, default=local)
+
+        local, played, change = start_match(local, carried)
+        if change:
+            regions[region] = local
+            self.db.regions = regions
+        if carried != local:
+            challenger.attributes.add(CARRIED_ATTRIBUTE, local)
+
+        rules = mask_rules(played)
+        messages = []
+        if change:
+            messages.append("The %s rule has %s in %s."
+                            % (change[1], "spread" if change[0] == "spread"
+                               else "been abolished", region))
+        messages.append("Rules of %s: %s." % (region, ", ".join(rules) or "None"))
+        for participant in participants:
+            participant.msg("\n".join(messages))
+        return rules
+
+    #########################
+    # Turn Timeouts
+    #########################
+
+    def schedule(self, match):
+        """
+        Gives the current player of a match TURN_TIMEOUT seconds to move.
+        """
+        match.deadline = time.time() + TURN_TIMEOUT
+        heapq.heappush(DEADLINES, (match.deadline, match.id))
+
+    def at_repeat(self):
+        """
+        Called every self.interval seconds. Times out every match whose
+        current player has missed their deadline, matches waiting players 
+        as their rating windows widen and saves the ladder now and then.
+        """
+        now = time.time()
+        while DEADLINES and DEADLINES[0][0] <= now:
+            deadline, match_id = heapq.heappop(DEADLINES)
+            match = MATCHES.get(match_id)
+            if match is not None and match.deadline == deadline:
+                match.timeout()
+        
+        if len(self.queue) > 1:
+            self.make_matches()
+        
+        if now - (self.ndb.ladder_saved or 0) > LADDER_SAVE_INTERVAL:
+            self.save_ladder()
+            self.ndb.ladder_saved = now
+
+    #########################
+    # Saving
+    #########################
+
+    def at_server_reload(self):
+        """
+        Called when the server reloads. Saves any unsaved game state.
+        """
+        for match in MATCHES.values():
+            match.checkpoint()
+        self.save_ladder()
+        get_history().flush(wait=True)
+
+    def at_server_shutdown(self):
+        """
+        Called when the server shuts down. Saves any unsaved game state.
+        """
+        for match in MATCHES.values():
+            match.checkpoint()
+        self.save_ladder()
+        get_history().flush(wait=True)
+
+
+def get_manager():
+    """
+    Returns the TripleTriadManager, creating it the first time it is needed.
+    """
+    if not _MANAGER:
+        manager = search_script(MANAGER_KEY).first()
+        if manager is None:
+            manager = create_script(TripleTriadManager, key=MANAGER_KEY)
+        _MANAGER.append(manager)
+    return _MANAGER[0]
+
+
+def get_match(player):
+    """
+    Returns the match a player is in, or None.
+    """
+    get_manager()
+    return PLAYERS.get(player.id)
+
+def games_line(game):
+    """
+    Returns a line describing a game from the match history, from the 
+    winner's side.
+    """
+    return "  #%-6i %s  %s %i-%i %s%s" % (
+        game["match"], time.strftime("%Y-%m-%d %H:%M", time.localtime(game["ended"])),
+        game["player_name"], game["score"], game["opponent_score"], game["opponent_name"],
+        " (rated)" if game["rated"] else "")
+
+
+def history_line(game):
+    """
+    Returns a line describing a game from the match history, from the 
+    player's side.
+    """
+    return "  #%-6i %s  %-4s %i-%i vs %s%s" % (
+        game["match"], time.strftime("%Y-%m-%d %H:%M", time.localtime(game["ended"])),
+        RESULT_NAMES[game["result"]], game["score"], game["opponent_score"],
+        game["opponent_name"], " (rated)" if game["rated"] else "")
+
+##############################################################################
+#
+# Board Redraw
+#
+##############################################################################
+
+def redraw_height(session, frame):
+    """
+    Returns the screen height of a session that can redraw the board in 
+    place, or None if the board should be sent as plain text. Redraw needs 
+    a telnet or SSH client with ANSI that has reported a screen with room 
+    for the board and a few lines below it.
+
+    Telnet ends every send with a line break, so each redraw also scrolls 
+    the lines below the board by one.
+    """
+    if session.protocol_key not in REDRAW_PROTOCOLS:
+        return None
+    flags = session.protocol_flags
+    if not flags.get("ANSI"):
+        return None
+    height = flags.get("SCREENHEIGHT", {}).get(0, 0)
+    return height if height >= frame_height(frame) + REDRAW_SCROLL else None
+
+
+def end_redraw(viewer):
+    """
+    Lets the whole screen of each of a viewer's sessions that had a board 
+    redrawn on it scroll again.
+    """
+    for session in viewer.sessions.all():
+        if session.ndb.tripletriad_frame is not None:
+            session.ndb.tripletriad_frame = None
+            viewer.msg(text=(REDRAW_RESET, {"raw": True}), session=session)
+
+
+def end_board(viewer):
+    """
+    Puts away the board of a match that has ended or that a viewer has 
+    stopped watching, on each of the viewer's sessions.
+    """
+    end_redraw(viewer)
+    for session in viewer.sessions.all():
+        seen = session.ndb.tripletriad_seen
+        if seen is not None:
+            session.ndb.tripletriad_seen = None
+            viewer.msg(tripletriad=((), end_message(seen[0])), session=session)
+
+##############################################################################
+#
+# Webclient
+#
+##############################################################################
+
+def start_webclient(session):
+    """
+    Called by the tripletriad_client inputfunc when the webclient plugin 
+    has loaded, or has missed a message. From then on the session is sent 
+    board messages instead of the text board, starting with the whole board
+    of any match its character is playing or watching. The flag is kept 
+    with the session's protocol flags so it lasts through a reload.
+    """
+    if not session.protocol_flags.get(CLIENT_FLAG):
+        session.update_flags(**{CLIENT_FLAG: True})
+    session.ndb.tripletriad_seen = None
+    character = session.puppet
+    if character:
+        match = get_match(character) or MATCHES.get(character.ndb.tripletriad_watching)
+        if match:
+            view = (match.participants.index(character) 
+                    if character in match.participants else 2)
+            match.show_viewer(character, view, sessions=[session])
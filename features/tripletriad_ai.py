@@ -0,0 +1,746 @@
+"""
+Triple Triad AI
+
+Opponent engine for NPC players of Triple Triad. Moves are chosen by an
+iterative-deepening alpha-beta (negamax) search over the TripleTriadEngine
+in features/tripletriad_engine.py:
+
+    - The search deepens one ply at a time until it reaches the depth of
+      the chosen difficulty, the end of the game, or its time budget. The
+      best move of the last completed depth is played.
+    - Positions are cached in a transposition table keyed on the engine's
+      64-bit position key. The table is kept between moves, so a searcher
+      that is reused for a whole match starts each move with the results of
+      the last one.
+    - Moves are ordered with the transposition table's best move first,
+      then by the number of cards they capture outright.
+    - Identical cards in a hand are only searched once, and at the root any
+      move whose mirror or rotation is equivalent in the current position
+      is skipped (see `stabilisers`).
+    - Given an endgame tablebase (features/tripletriad_tablebase.py), any
+      position it covers is looked up instead of searched, and a late 
+      enough root position is solved exactly and played from it.
+    - Positions where the search stops are scored by their score
+      difference, or by a fitted evaluator if one is given (see
+      features/tripletriad_eval.py).
+
+Usage:
+    searcher = AlphaBetaSearch("hard")
+    card, cell = searcher.choose_move(engine)
+
+A MatchAI keeps one AI seat's searcher for a whole match, so the
+transposition table, or the Monte Carlo tree, carries over from move to
+move. decide() makes the decisions of the AI worker processes (see
+features/tripletriad_workers.py) with a MatchAI per match and seat.
+A MatchAI's searches are bounded by nodes or simulations, never by the
+clock, and are seeded from the match log, so every decision of a match can
+be made again exactly from its log (see rerun() in 
+features/tripletriad_benchmark.py).
+
+hint() scores every legal move of the player to move in one batch, sharing
+a transposition table across the moves, for the `tt hint` command, which 
+asks the match's AI worker for it. Hints are memoized by position, so 
+asking again costs a dictionary lookup.
+
+The difficulty decides the search depth and the default time and node
+budgets, which are kept small enough that choosing a move costs a few
+milliseconds on an ordinary server. The node budgets take about as long
+as the time budgets, at some 300,000 nodes a second.
+"""
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+from features.tripletriad_engine import (TripleTriadEngine, CELLS, HAND_SIZE, EMPTY, 
+                                         NEIGHBOURS, POPCOUNT, UP, RIGHT, DOWN, LEFT,
+                                         decision_seed)
+from features.tripletriad_mcts import MonteCarloSearch
+from features.tripletriad_mcts import DIFFICULTIES as MCTS_DIFFICULTIES
+from features.tripletriad_tablebase import get_tablebase
+from features.tripletriad_eval import get_evaluator
+from features.tripletriad_log import Replay, positions
+
+# Search depth in plies, the default time budget per move in seconds, the
+# default node budget per move and whether the endgame tablebase is 
+# consulted.
+DIFFICULTIES = {
+    "random": {"depth": 0, "time": 0.0, "nodes": 0, "tablebase": False},
+    "easy": {"depth": 1, "time": 0.005, "nodes": 1500, "tablebase": False},
+    "normal": {"depth": 3, "time": 0.02, "nodes": 6000, "tablebase": False},
+    "hard": {"depth": 5, "time": 0.05, "nodes": 15000, "tablebase": True},
+    "expert": {"depth": CELLS, "time": 0.1, "nodes": 30000, "tablebase": True},
+}
+DEFAULT_DIFFICULTY = "normal"
+
+# Transposition table entry bounds.
+EXACT, LOWER, UPPER = range(3)
+# The table is cleared when it grows past this many entries.
+TABLE_SIZE = 200000
+# The clock is only consulted every this many nodes.
+CLOCK_INTERVAL = 256
+WIN = 100
+INFINITY = WIN * 20
+
+# Search depth and time budget of a hint, and how many hints are memoized
+# before the memo is cleared.
+HINT_DEPTH = 3
+HINT_TIME = 0.1
+HINT_TABLE_SIZE = 10000
+# Matches a worker process keeps a MatchAI for before forgetting the one
+# used least recently.
+MATCH_AI_LIMIT = 256
+
+
+##############################################################################
+#
+# Board Symmetries
+#
+##############################################################################
+
+def _symmetry(transform):
+    """
+    Builds the cell permutation and side permutation of a board symmetry,
+    given a function mapping (row, column) to its image.
+    """
+    cells = [0] * CELLS
+    for cell in range(CELLS):
+        row, column = transform(*divmod(cell, 3))
+        cells[cell] = row * 3 + column
+    # A side maps to wherever the neighbour in that direction of the centre
+    # cell ends up.
+    sides = [0] * 4
+    for adjacent, side, _ in NEIGHBOURS[4]:
+        for image_adjacent, image_side, _ in NEIGHBOURS[4]:
+            if cells[adjacent] == image_adjacent:
+                sides[side] = image_side
+    return tuple(cells), tuple(sides)
+
+
+# The seven symmetries of the board other than the identity.
+SYMMETRIES = tuple(_symmetry(transform) for transform in (
+    lambda row, column: (column, 2 - row),      # rotate 90
+    lambda row, column: (2 - row, 2 - column),  # rotate 180
+    lambda row, column: (2 - column, row),      # rotate 270
+    lambda row, column: (row, 2 - column),      # mirror left-right
+    lambda row, column: (2 - row, column),      # mirror up-down
+    lambda row, column: (column, row),          # main diagonal
+    lambda row, column: (2 - column, 2 - row),  # anti diagonal
+))
+
+
+def _transformed(engine, slot, sides):
+    """
+    Returns the ranks and element of a card slot after a symmetry.
+    """
+    ranks = engine.card_ranks(slot)
+    image = [0] * 4
+    for side in (UP, RIGHT, DOWN, LEFT):
+        image[sides[side]] = ranks[side]
+    return tuple(image), engine.elements[slot]
+
+
+def stabilisers(engine):
+    """
+    Returns the symmetries that leave the current position unchanged.
+
+    Cards keep their orientation when placed, so a symmetry only leaves a
+    position unchanged if it also maps every card in play onto an identical
+    card: the board must be symmetric and each hand must be made of cards
+    that are symmetric themselves or come in mirrored pairs. This is common
+    on an empty board with symmetric decks and rare afterwards.
+
+    Returns:
+        symmetries (list): (cell permutation, hand slot permutation) pairs.
+    """
+    found = []
+    for cells, sides in SYMMETRIES:
+        # Board, and any Elemental layout, must map onto itself.
+        for cell in range(CELLS):
+            slot = engine.board[cell]
+            image = engine.board[cells[cell]]
+            if (slot == EMPTY) != (image == EMPTY):
+                break
+            if engine.cell_elements[cell] != engine.cell_elements[cells[cell]]:
+                break
+            if slot != EMPTY and (
+                    engine.owner[cell] != engine.owner[cells[cell]]
+                    or _transformed(engine, slot, sides)
+                    != (engine.card_ranks(image), engine.elements[image])):
+                break
+        else:
+            # Each hand must map onto itself.
+            slots = {}
+            for player in (0, 1):
+                remaining = [player * HAND_SIZE + card for card in range(HAND_SIZE)
+                             if engine.hand[player * HAND_SIZE + card]]
+                for slot in list(remaining):
+                    image = _transformed(engine, slot, sides)
+                    match = [other for other in remaining
+                             if (engine.card_ranks(other), engine.elements[other]) == image]
+                    if not match:
+                        break
+                    remaining.remove(match[0])
+                    slots[slot] = match[0]
+                else:
+                    continue
+                break
+            else:
+                found.append((cells, slots))
+    return found
+
+
+##############################################################################
+#
+# Search
+#
+##############################################################################
+
+class _Timeout(Exception):
+    """
+    Raised inside the search when the time or node budget runs out.
+    """
+    pass
+
+
+class AlphaBetaSearch:
+    """
+    Iterative-deepening alpha-beta search with a transposition table.
+
+    Args:
+        difficulty (str): One of DIFFICULTIES.
+        time_budget (float, optional): Seconds allowed per move. Defaults to
+                                       the difficulty's budget.
+        node_budget (int, optional): Nodes allowed per move by 
+                                     choose_move. Defaults to the 
+                                     difficulty's budget. Unlike the time
+                                     budget, it stops the search at the
+                                     same point on any machine.
+        rng (random.Random, optional): Source of randomness for tie breaks.
+        tablebase (Tablebase, optional): Endgame tablebase, used if the 
+                                         difficulty allows it.
+        evaluator (LinearEvaluator, optional): Scores a position for the
+                                               player to move where the
+                                               search stops. Bound to the
+                                               root position of each search.
+                                               Defaults to the score 
+                                               difference.
+    """
+
+    def __init__(self, difficulty=DEFAULT_DIFFICULTY, time_budget=None, rng=None,
+                 tablebase=None, evaluator=None, node_budget=None):
+        settings = DIFFICULTIES[difficulty]
+        self.difficulty = difficulty
+        self.max_depth = settings["depth"]
+        self.time_budget = settings["time"] if time_budget is None else time_budget
+        self.node_budget = settings["nodes"] if node_budget is None else node_budget
+        self.rng = rng or random.Random()
+        self.tablebase = tablebase if settings["tablebase"] else None
+        self.evaluator = evaluator
+        self._evaluate = None
+        self.table = {}
+        self.nodes = 0
+        self.depth_reached = 0
+        self._deadline = 0.0
+        self._node_limit = math.inf
+        self._duplicates = None
+
+    #########################
+    # Public
+    #########################
+
+    def choose_move(self, engine):
+        """
+        Picks a move for the player whose turn it is.
+
+        Args:
+            engine (TripleTriadEngine): The match. Restored to its original
+                                        state before returning.
+
+        Returns:
+            move (tuple): (hand position, cell) to play.
+        """
+        cards = engine.available_cards()
+        cells = engine.available_cells()
+        if self.max_depth == 0:
+            return self.rng.choice(cards), self.rng.choice(cells)
+        if self.tablebase is not None:
+            move = self.tablebase.best_move(engine)
+            if move is not None:
+                return move
+
+        self.nodes = 0
+        self.depth_reached = 0
+        self._deadline = time.perf_counter() + self.time_budget
+        self._node_limit = self.node_budget
+        self._duplicates = self._find_duplicates(engine)
+        self._evaluate = self.evaluator.bind(engine) if self.evaluator is not None else None
+        if len(self.table) > TABLE_SIZE:
+            self.table.clear()
+
+        moves = self._root_moves(engine)
+        best = moves[0]
+        for depth in range(1, min(self.max_depth, engine.empty) + 1):
+            try:
+                value, move = self._root(engine, moves, depth)
+            except _Timeout:
+                break
+            best = move
+            self.depth_reached = depth
+            # Search the best move first at the next depth.
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(value) >= WIN:
+                break
+        return best
+
+    def score_moves(self, engine, depth=None):
+        """
+        Scores every legal move of the player whose turn it is, deepening
+        the whole batch one ply at a time until depth or the time budget is
+        reached. Unlike choose_move, no move is skipped by symmetry and each
+        is searched with a full window, so every score is exact at the 
+        depth reached. Identical cards in hand are only scored once, at 
+        the first hand position holding one.
+
+        Args:
+            engine (TripleTriadEngine): The match. Restored to its original
+                                        state before returning.
+            depth (int, optional): Plies to search. Defaults to the 
+                                   difficulty's depth.
+
+        Returns:
+            scores (list): (value, cards captured, hand position, cell) of 
+                           each move, best first. Values are from the 
+                           player's point of view, as a score lead, times 
+                           WIN if the end of the game was reached.
+        """
+        depth = self.max_depth if depth is None else depth
+        player = engine.turn
+        first = player * HAND_SIZE
+        cards, seen = [], set()
+        for card in engine.available_cards():
+            if engine.hand_keys[first + card] not in seen:
+                seen.add(engine.hand_keys[first + card])
+                cards.append(card)
+        moves = [(card, cell) for cell in engine.available_cells() for card in cards]
+
+        self.nodes = 0
+        self.depth_reached = 0
+        self._deadline = time.perf_counter() + self.time_budget
+        self._node_limit = math.inf
+        self._duplicates = self._find_duplicates(engine)
+        self._evaluate = self.evaluator.bind(engine) if self.evaluator is not None else None
+        if len(self.table) > TABLE_SIZE:
+            self.table.clear()
+
+        # Depth 1 comes from making the moves, so is always complete.
+        captures, values = [], []
+        for card, cell in moves:
+            captured = engine.play(card, cell)
+            captures.append(POPCOUNT[captured])
+            lead = engine.scores[player] - engine.scores[1 - player]
+            values.append(lead * WIN if engine.empty == 0 else lead)
+            engine.undo(card, cell, captured)
+        self.depth_reached = 1
+
+        for ply in range(2, min(depth, engine.empty) + 1):
+            current = []
+            try:
+                for card, cell in moves:
+                    captured = engine.play(card, cell)
+                    try:
+                        current.append(-self._negamax(engine, ply - 1, -INFINITY, INFINITY))
+                    finally:
+                        engine.undo(card, cell, captured)
+            except _Timeout:
+                break
+            values = current
+            self.depth_reached = ply
+
+        scores = [(value, captured, card, cell)
+                  for value, captured, (card, cell) in zip(values, captures, moves)]
+        scores.sort(key=lambda score: (-score[0], -score[1], score[3], score[2]))
+        return scores
+
+    #########################
+    # Internals
+    #########################
+
+    def _find_duplicates(self, engine):
+        """
+        Maps each hand slot to an earlier slot in the same hand holding an
+        identical card, or EMPTY.
+        """
+        duplicates = [EMPTY] * (HAND_SIZE * 2)
+        for slot in range(HAND_SIZE * 2):
+            first = slot - slot % HAND_SIZE
+            for other in range(first, slot):
+                if engine.hand_keys[other] == engine.hand_keys[slot]:
+                    duplicates[slot] = other
+                    break
+        return duplicates
+
+    def _root_moves(self, engine):
+        """
+        Returns the root moves in search order, without moves that are
+        equivalent by symmetry or by identical cards.
+        """
+        moves = self._moves(engine, None)
+        symmetries = stabilisers(engine)
+        if not symmetries:
+            return moves
+        first = engine.turn * HAND_SIZE
+        kept, seen = [], set()
+        for card, cell in moves:
+            if (card, cell) in seen:
+                continue
+            kept.append((card, cell))
+            for cells, slots in symmetries:
+                seen.add((slots[first + card] - first, cells[cell]))
+        return kept
+
+    def _moves(self, engine, table_move):
+        """
+        Returns the legal moves of the current player, best guesses first.
+        """
+        player = engine.turn
+        first = player * HAND_SIZE
+        hand = engine.hand
+        board = engine.board
+        owner = engine.owner
+        ranks = engine.ranks
+        duplicates = self._duplicates
+
+        slots = [slot for slot in range(first, first + HAND_SIZE)
+                 if hand[slot] and not (duplicates[slot] != EMPTY and hand[duplicates[slot]])]
+        scored = []
+        for cell in range(CELLS):
+            if board[cell] != EMPTY:
+                continue
+            for slot in slots:
+                # Count the captures this move would make outright.
+                gain = 0
+                base = slot * 4
+                for adjacent, side, opposite in NEIGHBOURS[cell]:
+                    other = board[adjacent]
+                    if (other != EMPTY and owner[adjacent] != player
+                            and ranks[base + side] > ranks[other * 4 + opposite]):
+                        gain += 1
+                scored.append((gain, slot - first, cell))
+        scored.sort(reverse=True)
+        moves = [(card, cell) for _, card, cell in scored]
+        if table_move in moves:
+            moves.remove(table_move)
+            moves.insert(0, table_move)
+        return moves
+
+    def _root(self, engine, moves, depth):
+        """
+        Searches each root move to depth and returns (value, best move).
+        """
+        alpha, beta = -INFINITY, INFINITY
+        best_value, best_moves = None, []
+        for card, cell in moves:
+            captured = engine.play(card, cell)
+            try:
+                value = -self._negamax(engine, depth - 1, -beta, -alpha)
+            finally:
+                engine.undo(card, cell, captured)
+            if best_value is None or value > best_value:
+                best_value, best_moves = value, [(card, cell)]
+            elif value == best_value:
+                best_moves.append((card, cell))
+            # Keep equal moves in the window so ties can be broken at random.
+            alpha = max(alpha, value - 1)
+        return best_value, self.rng.choice(best_moves)
+
+    def _negamax(self, engine, depth, alpha, beta):
+        """
+        Returns the value of the position for the player to move.
+        """
+        self.nodes += 1
+        if self.nodes > self._node_limit:
+            raise _Timeout()
+        if self.nodes % CLOCK_INTERVAL == 0 and time.perf_counter() > self._deadline:
+            raise _Timeout()
+
+        player = engine.turn
+        if engine.empty == 0:
+            difference = engine.scores[player] - engine.scores[1 - player]
+            return difference * WIN
+        if self.tablebase is not None:
+            # Only the file: the solved positions would make the search
+            # depend on other matches.
+            result = self.tablebase.probe(engine, solved=False)
+            if result is not None:
+                return result[0] * WIN
+        if depth == 0:
+            if self._evaluate is not None:
+                return self._evaluate(engine)
+            return engine.scores[player] - engine.scores[1 - player]
+
+        original_alpha = alpha
+        entry = self.table.get(engine.key)
+        table_move = None
+        if entry:
+            entry_depth, entry_value, entry_bound, table_move = entry
+            if entry_depth >= depth:
+                if entry_bound == EXACT:
+                    return entry_value
+                if entry_bound == LOWER:
+                    alpha = max(alpha, entry_value)
+                else:
+                    beta = min(beta, entry_value)
+                if alpha >= beta:
+                    return entry_value
+
+        best_value = -INFINITY
+        best_move = None
+        for card, cell in self._moves(engine, table_move):
+            captured = engine.play(card, cell)
+            try:
+                value = -self._negamax(engine, depth - 1, -beta, -alpha)
+            finally:
+                engine.undo(card, cell, captured)
+            if value > best_value:
+                best_value, best_move = value, (card, cell)
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+
+        if best_value <= original_alpha:
+            bound = UPPER
+        elif best_value >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table[engine.key] = (depth, best_value, bound, best_move)
+        return best_value
+
+
+_HINTS = {}
+
+
+def hint(engine, depth=HINT_DEPTH):
+    """
+    Scores every legal move of the player to move, memoized by position.
+
+    The memo is keyed on the engine's position key, which does not depend
+    on the order of the cards in hand, together with the rules and element
+    layout. Cards are remembered by their hand key, so a hint found in one
+    match is returned with the right hand positions in any other.
+
+    A search cut short by HINT_TIME, as on a busy worker, is returned but
+    not memoized, so its shallower scores are never served again.
+
+    Args:
+        engine (TripleTriadEngine): The match. Not modified.
+        depth (int, optional): Plies to search. Use 1 when the opponent's
+                               hand is hidden, so hints do not give it away.
+
+    Returns:
+        scores (list): (value, cards captured, hand position, cell) of each
+                       move, best first. See AlphaBetaSearch.score_moves.
+    """
+    key = (engine.key, engine.rules, tuple(engine.cell_elements), depth)
+    found = _HINTS.get(key)
+    if found is None:
+        searcher = AlphaBetaSearch("expert", time_budget=HINT_TIME)
+        scores = searcher.score_moves(engine.copy(), depth)
+        first = engine.turn * HAND_SIZE
+        found = [(value, captured, engine.hand_keys[first + card], cell)
+                 for value, captured, card, cell in scores]
+        if searcher.depth_reached == min(depth, engine.empty):
+            if len(_HINTS) > HINT_TABLE_SIZE:
+                _HINTS.clear()
+            _HINTS[key] = found
+
+    positions = {}
+    first = engine.turn * HAND_SIZE
+    for card in reversed(range(HAND_SIZE)):
+        if engine.hand[first + card]:
+            positions[engine.hand_keys[first + card]] = card
+    return [(value, captured, positions[hand_key], cell)
+            for value, captured, hand_key, cell in found]
+
+
+def hint_state(state, depth=HINT_DEPTH):
+    """
+    Runs hint() on a packed position (see TripleTriadEngine.pack). Runs in 
+    an AI worker process.
+    """
+    return hint(TripleTriadEngine.unpack(state), depth)
+
+
+def greedy_move(engine, rng=None):
+    """
+    Returns the move capturing the most cards outright. Ties are broken at
+    random with rng, or go to the first move found without one.
+    """
+    best, best_count = [], -1
+    for cell in engine.available_cells():
+        for card in engine.available_cards():
+            captured = engine.play(card, cell)
+            engine.undo(card, cell, captured)
+            count = POPCOUNT[captured]
+            if count > best_count:
+                best, best_count = [(card, cell)], count
+            elif count == best_count and rng is not None:
+                best.append((card, cell))
+    return rng.choice(best) if rng is not None else best[0]
+
+
+##############################################################################
+#
+# Match AI
+#
+##############################################################################
+
+class MatchAI:
+    """
+    The searcher of one AI seat, kept for a whole match. Hidden hands are
+    searched with a MonteCarloSearch where the difficulty allows, whose 
+    tree is reused from move to move; otherwise an AlphaBetaSearch, whose 
+    transposition table is.
+
+    Searches are bounded by the difficulty's depth and node budget, or its
+    simulations, and not by time, and each decision is seeded from the
+    match's seed and the log length, so the same MatchAI shown the same
+    match makes the same decisions.
+
+    Args:
+        seat (int): The AI's seat, 0 or 1.
+        difficulty (str): One of DIFFICULTIES.
+        hidden (bool): Whether the opponent's hand is hidden.
+        tablebase (Tablebase, optional): Endgame tablebase.
+        evaluator (callable, optional): Position evaluator.
+
+    Attributes:
+        seed (int or None): Seed of the match the AI is playing.
+        decided (int): Log length at the last decision, or -1.
+    """
+
+    def __init__(self, seat, difficulty, hidden, tablebase=None, evaluator=None):
+        self.seat = seat
+        self.difficulty = difficulty
+        self.hidden = hidden and difficulty in MCTS_DIFFICULTIES
+        self.seed = None
+        self.decided = -1
+        if self.hidden:
+            self.searcher = MonteCarloSearch(iterations=MCTS_DIFFICULTIES[difficulty],
+                                             time_budget=math.inf)
+        else:
+            self.searcher = AlphaBetaSearch(difficulty, time_budget=math.inf, 
+                                            tablebase=tablebase, evaluator=evaluator)
+
+    def choose_move(self, engine, seed, offset):
+        """
+        Picks a move for the player whose turn it is.
+
+        Args:
+            engine (TripleTriadEngine): The match.
+            seed (int): The match's seed.
+            offset (int): Length of the match log before the move.
+
+        Returns:
+            move (tuple): (hand position, cell) to play.
+        """
+        self.seed = seed
+        self.decided = offset
+        self.searcher.rng = random.Random(decision_seed(seed, offset))
+        if self.hidden:
+            return self.searcher.choose_move(engine, hidden=True)
+        return self.searcher.choose_move(engine)
+
+    def work(self):
+        """
+        Returns the search effort of the last decision, as a dict.
+        """
+        if self.hidden:
+            return {"simulations": self.searcher.simulations}
+        return {"nodes": self.searcher.nodes, "depth": self.searcher.depth_reached}
+
+    def follows(self, log):
+        """
+        Returns True if log is the match this AI has been playing, as far
+        as it has played it.
+        """
+        return self.decided < len(log) and self.seed in (None, Replay(log).seed)
+
+    def move(self, log):
+        """
+        Picks the move at the end of a match log. Positions of the AI's 
+        seat it has not yet decided at, for instance after its worker was
+        restarted, are decided first, so its searcher is left as though it
+        had played the whole match.
+
+        Args:
+            log (bytes): The match log, see features/tripletriad_log.py.
+
+        Returns:
+            move (tuple): (hand position, cell) to play.
+        """
+        seed = Replay(log).seed
+        for offset, engine, logged in positions(log):
+            if logged is None:
+                return self.choose_move(engine, seed, offset)
+            if engine.turn == self.seat and offset > self.decided:
+                self.choose_move(engine, seed, offset)
+
+
+# MatchAIs of the worker process, by (match id, seat), least recently used
+# first.
+_MATCH_AIS = OrderedDict()
+
+
+def decide(requests):
+    """
+    Chooses the moves of a batch of decisions. Runs in an AI worker 
+    process, which is sent every decision of a match, so each match's 
+    MatchAI is kept here between its moves.
+
+    Args:
+        requests (list): (match id, seat, match log, difficulty, hidden) of
+                         each decision.
+
+    Returns:
+        moves (list): (hand position, cell) of each decision.
+    """
+    moves = []
+    for match_id, seat, log, difficulty, hidden in requests:
+        key = (match_id, seat)
+        match_ai = _MATCH_AIS.pop(key, None)
+        if (match_ai is None or match_ai.difficulty != difficulty 
+                or match_ai.hidden != (hidden and difficulty in MCTS_DIFFICULTIES)
+                or not match_ai.follows(log)):
+            match_ai = MatchAI(seat, difficulty, hidden, get_tablebase(), get_evaluator())
+        _MATCH_AIS[key] = match_ai
+        if len(_MATCH_AIS) > MATCH_AI_LIMIT:
+            _MATCH_AIS.popitem(last=False)
+        moves.append(match_ai.move(log))
+    return moves
+
+
+def warm_up():
+    """
+    Loads the endgame tablebase and evaluator of a new worker process, so 
+    its first decision is as quick as any other.
+
+    Returns:
+        pid (int): The worker's process id.
+    """
+    get_tablebase()
+    get_evaluator()
+    return os.getpid()
+
+
+def choose_move(engine, difficulty=DEFAULT_DIFFICULTY, time_budget=None):
+    """
+    Picks a move for the current player with a one-off AlphaBetaSearch.
+
+    Returns:
+        move (tuple): (hand position, cell) to play.
+    """
+    return AlphaBetaSearch(difficulty, time_budget).choose_move(engine)
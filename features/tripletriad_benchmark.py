@@ -0,0 +1,327 @@
+"""
+Triple Triad Benchmarks
+
+Times the hot paths behind each TripleTriadMatch in features/tripletriad.py
+without a running Evennia server, so that a slowdown between releases shows
+up as a change in numbers rather than as lag on the game:
+
+    moves     Moves resolved per second by TripleTriadEngine.play.
+    games     Full random games per second, dealing included.
+    ai        Nodes searched per second by the AlphaBetaSearch and playouts
+              per second by the MonteCarloSearch at each difficulty.
+    render    Time to draw both players' gameboards.
+    storage   Bytes pickled for each saved match, as the match checkpoint
+              writes it to its Attribute.
+
+Every benchmark is seeded, so runs on the same machine play the same games
+and search the same positions.
+
+A finished match can also be re-run from the match archive: every position
+of the match is searched again at a difficulty by a MatchAI for each seat,
+with the endgame tablebase and evaluator the server uses. Live decisions
+are bounded by nodes or simulations and seeded from the log, so the AI's
+seat makes exactly the decisions it made live, and each one is timed.
+This is how a match reported as slow or buggy is profiled. Where the live
+AI missed its deadline the log flags the fallback move it played instead,
+and the re-run checks that move against the fallback and flags the turn.
+
+Usage:
+    python -m features.tripletriad_benchmark
+    python -m features.tripletriad_benchmark --only ai render --output bench.json
+    python -m features.tripletriad_benchmark --rerun 42 --difficulty hard
+    python -m features.tripletriad_benchmark --rerun 42 --difficulty hard --time 0.5
+
+The results are written as JSON.
+"""
+import argparse
+import json
+import pickle
+import platform
+import random
+import sys
+import time
+from features.tripletriad_engine import TripleTriadEngine, CELLS
+from features.tripletriad_cards import random_hand
+from features.tripletriad_ai import AlphaBetaSearch, MatchAI, DIFFICULTIES, greedy_move
+from features.tripletriad_mcts import MonteCarloSearch
+from features.tripletriad_mcts import DIFFICULTIES as MCTS_DIFFICULTIES
+from features.tripletriad_render import render_frames
+from features.tripletriad_log import (Replay, new_log, encode_move, positions, get_archive, 
+                                      FALLBACK, DEFAULT_PATH as ARCHIVE_PATH)
+from features.tripletriad_tablebase import get_tablebase
+from features.tripletriad_eval import get_evaluator
+
+BENCHMARKS = ("moves", "games", "ai", "render", "storage")
+# Evennia pickles Attributes with this protocol.
+PICKLE_PROTOCOL = 2
+
+
+##############################################################################
+#
+# Positions
+#
+##############################################################################
+
+def deal(rng):
+    """
+    Returns a freshly dealt engine.
+    """
+    engine = TripleTriadEngine()
+    engine.deal(0, random_hand(rng))
+    engine.deal(1, random_hand(rng))
+    return engine
+
+
+def random_position(rng, filled):
+    """
+    Returns a dealt engine with `filled` random moves played.
+    """
+    engine = deal(rng)
+    for _ in range(filled):
+        engine.play(rng.choice(engine.available_cards()), rng.choice(engine.available_cells()))
+    return engine
+
+
+def play_out(engine, rng, log=None):
+    """
+    Plays random moves until the game is over.
+    """
+    while not engine.is_over():
+        card = rng.choice(engine.available_cards())
+        cell = rng.choice(engine.available_cells())
+        engine.play(card, cell)
+        if log is not None:
+            log.append(encode_move(card, cell))
+
+
+##############################################################################
+#
+# Benchmarks
+#
+##############################################################################
+
+def bench_moves(rng, games):
+    """
+    Moves resolved per second, not counting move choice or dealing.
+    """
+    # Choose the moves up front so only play() is timed.
+    matches = []
+    for _ in range(games):
+        engine = deal(rng)
+        moves = []
+        replay = engine.copy()
+        while not replay.is_over():
+            move = rng.choice(replay.available_cards()), rng.choice(replay.available_cells())
+            replay.play(*move)
+            moves.append(move)
+        matches.append((engine, moves))
+
+    start = time.perf_counter()
+    for engine, moves in matches:
+        play = engine.play
+        for card, cell in moves:
+            play(card, cell)
+    elapsed = time.perf_counter() - start
+    return {"moves": games * CELLS, "seconds": elapsed,
+            "moves_per_second": games * CELLS / elapsed}
+
+
+def bench_games(rng, games):
+    """
+    Full random games per second, including dealing and move choice.
+    """
+    start = time.perf_counter()
+    for _ in range(games):
+        play_out(deal(rng), rng)
+    elapsed = time.perf_counter() - start
+    return {"games": games, "seconds": elapsed, "games_per_second": games / elapsed}
+
+
+def bench_ai(rng, positions):
+    """
+    Search speed at every difficulty, over the same opening and middle game
+    positions.
+    """
+    boards = [random_position(rng, filled) for filled in (0, 2, 4) for _ in range(positions)]
+    results = {}
+    for difficulty in DIFFICULTIES:
+        nodes, elapsed = 0, 0.0
+        for engine in boards:
+            searcher = AlphaBetaSearch(difficulty, rng=random.Random(0))
+            start = time.perf_counter()
+            searcher.choose_move(engine)
+            elapsed += time.perf_counter() - start
+            nodes += searcher.nodes
+        results["alphabeta_" + difficulty] = {
+            "positions": len(boards), "nodes": nodes, "seconds": elapsed,
+            "nodes_per_second": nodes / elapsed if elapsed else 0.0,
+            "seconds_per_move": elapsed / len(boards)}
+
+    for difficulty, iterations in MCTS_DIFFICULTIES.items():
+        simulations, elapsed = 0, 0.0
+        for engine in boards:
+            searcher = MonteCarloSearch(iterations=iterations, rng=random.Random(0))
+            start = time.perf_counter()
+            searcher.choose_move(engine)
+            elapsed += time.perf_counter() - start
+            simulations += searcher.simulations
+        results["mcts_" + difficulty] = {
+            "positions": len(boards), "simulations": simulations, "seconds": elapsed,
+            "simulations_per_second": simulations / elapsed if elapsed else 0.0,
+            "seconds_per_move": elapsed / len(boards)}
+    return results
+
+
+def bench_render(rng, renders):
+    """
+    Time to draw both players' gameboards, over positions from every turn.
+    """
+    boards = [random_position(rng, filled % (CELLS + 1)) for filled in range(CELLS + 1)]
+    start = time.perf_counter()
+    for index in range(renders):
+        render_frames(boards[index % len(boards)], hidden=(True, True))
+    elapsed = time.perf_counter() - start
+    return {"renders": renders, "seconds": elapsed,
+            "microseconds_per_render": elapsed / renders * 1e6}
+
+
+def bench_storage(rng, games):
+    """
+    Bytes pickled per saved match, at the start and end of a game. The two
+    participants are stored by Evennia as references and not counted.
+    """
+    sizes = {"start": [], "end": []}
+    for _ in range(games):
+        engine = deal(rng)
+        log = new_log(engine, seed=rng.getrandbits(32))
+        for moment in ("start", "end"):
+            if moment == "end":
+                play_out(engine, rng, log)
+            record = {"phase": "game", "rules": [], "seed": 0,
+                      "state": engine.pack(), "log": bytes(log)}
+            sizes[moment].append(len(pickle.dumps(record, protocol=PICKLE_PROTOCOL)))
+    return {"state_bytes": len(engine.pack()),
+            "pickled_bytes_start": sum(sizes["start"]) / games,
+            "pickled_bytes_end": sum(sizes["end"]) / games}
+
+
+def rerun(log, difficulty, time_budget=None):
+    """
+    Searches every position of a logged match again, as the AI of the live
+    match would have. A move logged as a fallback is compared with the
+    fallback move rather than the search's choice, though the position is
+    still searched, as the live worker went on to search it too.
+
+    Args:
+        log (bytes): The match log.
+        difficulty (str): AI difficulty, from DIFFICULTIES.
+        time_budget (float, optional): Seconds per move, instead of the 
+                                       live node or simulation budget. The
+                                       decisions are then no longer those
+                                       of the live match.
+
+    Returns:
+        report (dict): Time, nodes or simulations and move chosen at each
+                       turn, whether the logged move was a fallback and 
+                       whether the move expected, the fallback move or the
+                       one chosen, is the move logged.
+    """
+    replay = Replay(log)
+    hidden = "Open" not in replay.rules
+    players = [MatchAI(seat, difficulty, hidden, get_tablebase(), get_evaluator())
+               for seat in (0, 1)]
+    if time_budget is not None:
+        for player in players:
+            player.searcher.time_budget = time_budget
+            if not player.hidden:
+                player.searcher.node_budget = float("inf")
+    decisions = []
+    for turn, (offset, engine, logged) in enumerate(positions(log)):
+        if logged is None:
+            break
+        fallback = bool(log[offset] & FALLBACK)
+        start = time.perf_counter()
+        player = players[engine.turn]
+        chosen = player.choose_move(engine, replay.seed, offset)
+        elapsed = time.perf_counter() - start
+        expected = greedy_move(engine) if fallback else tuple(chosen)
+        decisions.append(dict(turn=turn, seat=engine.turn, seconds=elapsed, move=list(chosen),
+                              logged=list(logged), fallback=fallback, same=expected == logged,
+                              **player.work()))
+    return {"difficulty": difficulty, "rules": replay.rules, "seed": replay.seed,
+            "turns": len(decisions), 
+            "fallbacks": [decision["turn"] for decision in decisions if decision["fallback"]],
+            "seconds": sum(decision["seconds"] for decision in decisions),
+            "slowest_turn": max(decisions, key=lambda decision: decision["seconds"])["turn"]
+            if decisions else None,
+            "decisions": decisions}
+
+
+##############################################################################
+#
+# Command Line
+#
+##############################################################################
+
+def run(only=BENCHMARKS, games=2000, positions=10, renders=5000, seed=0):
+    """
+    Runs the benchmarks.
+
+    Args:
+        only (list, optional): Names of the benchmarks to run.
+        games (int, optional): Games played by the move, game and storage
+                               benchmarks.
+        positions (int, optional): Positions per stage of the game searched
+                                   at each AI difficulty.
+        renders (int, optional): Boards drawn by the render benchmark.
+        seed (int, optional): Seed for deals and moves.
+
+    Returns:
+        report (dict): Results of each benchmark.
+    """
+    report = {"python": platform.python_version(), "seed": seed}
+    arguments = {"moves": games, "games": games, "ai": positions,
+                 "render": renders, "storage": games}
+    functions = {"moves": bench_moves, "games": bench_games, "ai": bench_ai,
+                 "render": bench_render, "storage": bench_storage}
+    for name in only:
+        report[name] = functions[name](random.Random(seed), arguments[name])
+    return report
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the Triple Triad engine.")
+    parser.add_argument("--only", nargs="*", default=list(BENCHMARKS), choices=BENCHMARKS)
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--positions", type=int, default=10)
+    parser.add_argument("--renders", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the results to this file.")
+    parser.add_argument("--rerun", type=int, default=None, metavar="MATCH_ID",
+                        help="Re-run the AI over a finished match instead.")
+    parser.add_argument("--difficulty", default="normal", choices=list(DIFFICULTIES))
+    parser.add_argument("--time", type=float, default=None,
+                        help="Seconds per AI move when re-running a match, instead of "
+                             "the live node budget.")
+    parser.add_argument("--archive", default=ARCHIVE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.rerun is not None:
+        log = get_archive(args.archive).get(args.rerun)
+        if log is None:
+            parser.error("Match %i is not in %s." % (args.rerun, args.archive))
+        report = rerun(log, args.difficulty, args.time)
+    else:
+        report = run(args.only, args.games, args.positions, args.renders, args.seed)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
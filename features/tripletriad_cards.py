@@ -0,0 +1,194 @@
+"""
+Triple Triad Card List
+
+The 110 cards of Final Fantasy VIII's Triple Triad, addressed by a small
+integer card id (0 for Geezard to 109 for Squall).
+
+Cards are stored as parallel, immutable tuples rather than one object per
+card, so a hand or board only needs to hold card ids:
+
+    NAMES     - interned card names.
+    RANKS     - flat tuple of ranks, RANKS[card_id * 4 + side], in the side
+                order of features/tripletriad_engine.py (up, right, down,
+                left). A rank of 10 is shown as "A".
+    ELEMENTS  - element name, or None.
+    LEVELS    - level, 1 to 10.
+    TYPES     - "Monster", "Boss", "GF" or "Player".
+
+Indexes:
+    BY_NAME    - {lowercase name: card_id}
+    BY_LEVEL   - {level: (card_id, ...)}
+    BY_ELEMENT - {element: (card_id, ...)}
+"""
+import random
+import sys
+
+ELEMENT_NAMES = ("Fire", "Ice", "Thunder", "Earth", "Poison", "Wind", "Water", "Holy")
+# Single character shown on a card for its element.
+ELEMENT_GLYPHS = {None: " ", "Fire": "F", "Ice": "I", "Thunder": "T", "Earth": "E",
+                  "Poison": "P", "Wind": "W", "Water": "~", "Holy": "H"}
+RANK_GLYPHS = ("0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "A")
+TYPE_BY_LEVEL = {1: "Monster", 2: "Monster", 3: "Monster", 4: "Monster", 5: "Monster",
+                 6: "Boss", 7: "Boss", 8: "GF", 9: "GF", 10: "Player"}
+CARDS_PER_LEVEL = 11
+
+# Name, up, right, down, left, element. Eleven cards per level, in order.
+_CARD_TABLE = (
+    # Level 1
+    ("Geezard", 1, 4, 1, 5, None),
+    ("Funguar", 5, 1, 1, 3, None),
+    ("Bite Bug", 1, 3, 3, 5, None),
+    ("Red Bat", 6, 1, 1, 2, None),
+    ("Blobra", 2, 3, 1, 5, None),
+    ("Gayla", 2, 1, 4, 4, "Thunder"),
+    ("Gesper", 1, 5, 4, 1, None),
+    ("Fastitocalon-F", 3, 5, 2, 1, "Earth"),
+    ("Blood Soul", 2, 1, 6, 1, None),
+    ("Caterchipillar", 4, 2, 4, 3, None),
+    ("Cockatrice", 2, 1, 2, 6, "Thunder"),
+    # Level 2
+    ("Grat", 7, 1, 3, 1, None),
+    ("Buel", 6, 2, 2, 3, None),
+    ("Mesmerize", 5, 3, 3, 4, None),
+    ("Glacial Eye", 6, 1, 4, 3, "Ice"),
+    ("Belhelmel", 3, 4, 5, 3, None),
+    ("Thrustaevis", 5, 3, 2, 5, "Wind"),
+    ("Anacondaur", 5, 1, 3, 5, "Poison"),
+    ("Creeps", 5, 2, 5, 2, "Thunder"),
+    ("Grendel", 4, 4, 5, 2, "Thunder"),
+    ("Jelleye", 3, 2, 1, 7, None),
+    ("Grand Mantis", 5, 2, 5, 3, None),
+    # Level 3
+    ("Forbidden", 6, 6, 3, 2, None),
+    ("Armadodo", 6, 3, 1, 6, "Earth"),
+    ("Tri-Face", 3, 5, 5, 5, "Poison"),
+    ("Fastitocalon", 7, 5, 1, 3, "Earth"),
+    ("Snow Lion", 7, 1, 5, 3, "Ice"),
+    ("Ochu", 5, 6, 3, 3, None),
+    ("SAM08G", 5, 6, 2, 4, "Fire"),
+    ("Death Claw", 4, 4, 7, 2, "Fire"),
+    ("Cactuar", 6, 2, 6, 3, None),
+    ("Tonberry", 3, 6, 4, 4, None),
+    ("Abyss Worm", 7, 2, 3, 5, "Earth"),
+    # Level 4
+    ("Turtapod", 2, 3, 6, 7, None),
+    ("Vysage", 6, 5, 4, 5, None),
+    ("T-Rexaur", 4, 6, 2, 7, None),
+    ("Bomb", 2, 7, 6, 3, "Fire"),
+    ("Blitz", 1, 6, 4, 7, "Thunder"),
+    ("Wendigo", 7, 3, 1, 6, None),
+    ("Torama", 7, 4, 4, 4, None),
+    ("Imp", 3, 7, 3, 6, None),
+    ("Blue Dragon", 6, 2, 7, 3, "Poison"),
+    ("Adamantoise", 4, 5, 5, 6, "Earth"),
+    ("Hexadragon", 7, 5, 4, 3, "Fire"),
+    # Level 5
+    ("Iron Giant", 6, 5, 6, 5, None),
+    ("Behemoth", 3, 6, 5, 7, None),
+    ("Chimera", 7, 6, 5, 3, "Water"),
+    ("PuPu", 3, 10, 2, 1, None),
+    ("Elastoid", 6, 2, 6, 7, None),
+    ("GIM47N", 5, 5, 7, 4, None),
+    ("Malboro", 7, 7, 4, 2, "Poison"),
+    ("Ruby Dragon", 7, 2, 7, 4, "Fire"),
+    ("Elnoyle", 5, 3, 7, 6, None),
+    ("Tonberry King", 4, 6, 7, 4, None),
+    ("Wedge, Biggs", 6, 6, 2, 7, None),
+    # Level 6
+    ("Fujin, Raijin", 2, 8, 8, 4, None),
+    ("Elvoret", 7, 8, 3, 4, "Wind"),
+    ("X-ATM092", 4, 8, 7, 3, None),
+    ("Granaldo", 7, 2, 8, 5, None),
+    ("Gerogero", 1, 8, 8, 3, "Poison"),
+    ("Iguion", 8, 2, 8, 2, None),
+    ("Abadon", 6, 8, 4, 5, None),
+    ("Trauma", 4, 8, 5, 6, None),
+    ("Oilboyle", 1, 8, 4, 8, None),
+    ("Shumi Tribe", 6, 5, 8, 4, None),
+    ("Krysta", 7, 5, 8, 1, None),
+    # Level 7
+    ("Propagator", 8, 4, 4, 8, None),
+    ("Jumbo Cactuar", 8, 8, 4, 4, None),
+    ("Tri-Point", 8, 5, 2, 8, "Thunder"),
+    ("Gargantua", 5, 6, 6, 8, None),
+    ("Mobile Type 8", 8, 6, 7, 3, None),
+    ("Sphinxara", 8, 3, 5, 8, None),
+    ("Tiamat", 8, 8, 5, 4, None),
+    ("BGH251F2", 5, 7, 8, 5, None),
+    ("Red Giant", 6, 8, 4, 7, None),
+    ("Catoblepas", 1, 8, 7, 7, None),
+    ("Ultima Weapon", 7, 7, 2, 8, None),
+    # Level 8
+    ("Chubby Chocobo", 4, 4, 8, 9, None),
+    ("Angelo", 9, 6, 7, 3, None),
+    ("Gilgamesh", 3, 7, 9, 6, None),
+    ("MiniMog", 9, 3, 9, 2, None),
+    ("Chicobo", 9, 4, 8, 4, None),
+    ("Quezacotl", 2, 9, 9, 4, "Thunder"),
+    ("Shiva", 6, 7, 4, 9, "Ice"),
+    ("Ifrit", 9, 6, 2, 8, "Fire"),
+    ("Siren", 8, 9, 6, 2, None),
+    ("Sacred", 5, 1, 9, 9, "Earth"),
+    ("Minotaur", 9, 5, 2, 9, "Earth"),
+    # Level 9
+    ("Carbuncle", 8, 4, 10, 4, None),
+    ("Diablos", 5, 10, 8, 3, None),
+    ("Leviathan", 7, 10, 1, 7, "Water"),
+    ("Odin", 8, 10, 3, 5, None),
+    ("Pandemona", 10, 1, 7, 7, "Wind"),
+    ("Cerberus", 7, 4, 6, 10, None),
+    ("Alexander", 9, 10, 4, 2, "Holy"),
+    ("Phoenix", 7, 2, 7, 10, "Fire"),
+    ("Bahamut", 10, 8, 2, 6, None),
+    ("Doomtrain", 3, 1, 10, 10, "Poison"),
+    ("Eden", 4, 4, 9, 10, None),
+    # Level 10
+    ("Ward", 10, 7, 2, 8, None),
+    ("Kiros", 6, 7, 6, 10, None),
+    ("Laguna", 5, 10, 3, 9, None),
+    ("Selphie", 10, 8, 6, 4, None),
+    ("Quistis", 9, 6, 10, 2, None),
+    ("Irvine", 2, 6, 9, 10, None),
+    ("Zell", 8, 5, 10, 6, None),
+    ("Rinoa", 4, 10, 2, 10, None),
+    ("Edea", 10, 10, 3, 3, None),
+    ("Seifer", 6, 9, 10, 4, None),
+    ("Squall", 10, 4, 6, 9, None),
+)
+
+CARD_COUNT = len(_CARD_TABLE)
+
+NAMES = tuple(sys.intern(row[0]) for row in _CARD_TABLE)
+RANKS = tuple(rank for row in _CARD_TABLE for rank in row[1:5])
+ELEMENTS = tuple(row[5] for row in _CARD_TABLE)
+LEVELS = tuple(1 + card_id // CARDS_PER_LEVEL for card_id in range(CARD_COUNT))
+TYPES = tuple(TYPE_BY_LEVEL[level] for level in LEVELS)
+
+BY_NAME = {name.lower(): card_id for card_id, name in enumerate(NAMES)}
+BY_LEVEL = {level: tuple(card_id for card_id in range(CARD_COUNT) if LEVELS[card_id] == level)
+            for level in TYPE_BY_LEVEL}
+BY_ELEMENT = {element: tuple(card_id for card_id in range(CARD_COUNT) if ELEMENTS[card_id] == element)
+              for element in (None,) + ELEMENT_NAMES}
+
+
+def find(name):
+    """
+    Returns the card id of a card name, ignoring case, or None.
+    """
+    return BY_NAME.get(name.strip().lower())
+
+
+def card_ranks(card_id):
+    """
+    Returns the (up, right, down, left) ranks of a card.
+    """
+    base = card_id * 4
+    return RANKS[base:base + 4]
+
+
+def random_hand(rng=random, levels=(1, 2, 3, 4, 5), size=5):
+    """
+    Returns the card ids of a hand drawn at random from the given levels.
+    """
+    pool = [card_id for level in levels for card_id in BY_LEVEL[level]]
+    return [rng.choice(pool) for _ in range(size)]
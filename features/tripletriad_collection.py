@@ -0,0 +1,267 @@
+"""
+Triple Triad Card Collection
+
+The cards a character owns, for dealing hands and paying out the trade
+rules (see features/tripletriad.py).
+
+A collection is a fixed-length vector holding the number of copies owned of
+each of the 110 card ids in features/tripletriad_cards.py, stored as 110
+bytes in a single Attribute, however many cards are owned:
+
+    collection = character.card_collection
+    collection.add(cards.find("Geezard"))
+    collection.count(cards.find("Geezard"))     # 1
+    character.save_card_collection()
+
+Adding and removing a card are single index operations and drawing a hand
+only looks at the 110 counts, never at each copy.
+
+A character may also pick a deck, five card ids saved in another Attribute,
+which they are dealt while they still own every card in it, unless the
+Random rule is in play.
+
+A new character starts with one copy of each level 1 card (STARTER_CARDS),
+enough for a deck and for the trade rules to have something to move.
+
+Trade Rules:
+    One     Winner takes one card from the loser.
+    Diff    Winner takes one card per point of score difference.
+    Direct  Players take the opponent's cards that are their color at the
+            end of the game, whoever won.
+    All     Winner takes all five of the loser's cards.
+Under One, Diff and All the winner does not choose: they are given the
+loser's highest level cards automatically.
+
+Cards are only traded when both players have opted in to the same trade
+rule (see agreed_trade) and both were dealt their hand from their own
+collection. A card the taker already holds MAX_COPIES of stays with its
+owner.
+"""
+import random
+from features.tripletriad_cards import CARD_COUNT, LEVELS, BY_LEVEL
+from features.tripletriad_engine import CELLS, HAND_SIZE, SLOTS, EMPTY
+
+COLLECTION_ATTRIBUTE = "tripletriad_cards"
+# Trade rule a character has opted in to, or None.
+TRADE_ATTRIBUTE = "tripletriad_trade"
+# Card ids of the hand a character has chosen, or None.
+DECK_ATTRIBUTE = "tripletriad_deck"
+MAX_COPIES = 100
+TRADE_RULES = ("One", "Diff", "Direct", "All")
+DEFAULT_TRADE_RULE = None
+# Cards a new character owns, one copy each.
+STARTER_CARDS = BY_LEVEL[1]
+
+
+class CardCollection:
+    """
+    Number of copies owned of each card id.
+
+    Args:
+        data (bytes, optional): Saved collection, from pack().
+    """
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self, data=None):
+        self.counts = bytearray(data) if data else bytearray(CARD_COUNT)
+        self.total = sum(self.counts)
+
+    def __len__(self):
+        return self.total
+
+    def count(self, card_id):
+        """
+        Returns the number of copies owned of a card.
+        """
+        return self.counts[card_id]
+
+    def add(self, card_id, copies=1):
+        """
+        Adds copies of a card, up to MAX_COPIES.
+
+        Returns:
+            added (int): Copies actually added.
+        """
+        copies = max(0, min(copies, MAX_COPIES - self.counts[card_id]))
+        self.counts[card_id] += copies
+        self.total += copies
+        return copies
+
+    def remove(self, card_id, copies=1):
+        """
+        Removes copies of a card.
+
+        Returns:
+            removed (bool): False, and nothing removed, if not enough copies
+                            are owned.
+        """
+        if self.counts[card_id] < copies:
+            return False
+        self.counts[card_id] -= copies
+        self.total -= copies
+        return True
+
+    def apply(self, changes):
+        """
+        Adds or removes several cards at once. Either every change is made
+        or, if a card to be removed is not owned or a card added would go
+        past MAX_COPIES, none are.
+
+        Args:
+            changes (dict): {card id: copies to add, negative to remove}
+
+        Returns:
+            applied (bool): Whether the changes were made.
+        """
+        if any(not 0 <= self.counts[card_id] + copies <= MAX_COPIES 
+               for card_id, copies in changes.items()):
+            return False
+        for card_id, copies in changes.items():
+            if copies < 0:
+                self.remove(card_id, -copies)
+            else:
+                self.add(card_id, copies)
+        return True
+
+    def owns(self, card_ids):
+        """
+        Returns True if the collection holds every card listed, counting 
+        cards listed more than once.
+        """
+        needed = {}
+        for card_id in card_ids:
+            needed[card_id] = needed.get(card_id, 0) + 1
+        return all(self.counts[card_id] >= copies for card_id, copies in needed.items())
+
+    def random_hand(self, rng=random, size=HAND_SIZE):
+        """
+        Draws a hand for the Random rule. Each copy owned is equally likely
+        to be drawn and no copy is drawn twice.
+
+        Returns:
+            hand (list or None): Card ids, or None if too few cards are
+                                 owned.
+        """
+        if self.total < size:
+            return None
+        weights = list(self.counts)
+        hand = []
+        for _ in range(size):
+            card_id = rng.choices(range(CARD_COUNT), weights)[0]
+            weights[card_id] -= 1
+            hand.append(card_id)
+        return hand
+
+    def pack(self):
+        """
+        Returns the collection as bytes for saving.
+        """
+        return bytes(self.counts)
+
+
+def starter_collection():
+    """
+    Returns the CardCollection a new character starts with.
+    """
+    collection = CardCollection()
+    for card_id in STARTER_CARDS:
+        collection.add(card_id)
+    return collection
+
+
+def agreed_trade(players):
+    """
+    Returns the trade rule every player has opted in to, or None if they
+    have not all chosen the same one.
+    """
+    rules = {player.attributes.get(TRADE_ATTRIBUTE) for player in players}
+    rule = rules.pop() if len(rules) == 1 else None
+    return rule if rule in TRADE_RULES else None
+
+
+def trade_cards(engine, rule, winner, origins=None):
+    """
+    Works out which cards change hands at the end of a match.
+
+    Args:
+        engine (TripleTriadEngine): The finished match.
+        rule (str): Trade rule, from TRADE_RULES.
+        winner (int or None): Seat of the winner, or None for a tie.
+        origins (list, optional): Seat each card slot was first dealt to, if
+                                  Sudden Death has redealt the cards. By
+                                  default, the seat holding the slot.
+
+    Returns:
+        trades (list): (seat giving, seat taking, card id) of each card.
+    """
+    if origins is None:
+        origins = [slot // HAND_SIZE for slot in range(SLOTS)]
+    if rule == "Direct":
+        trades = []
+        for cell in range(CELLS):
+            slot = engine.board[cell]
+            if slot != EMPTY and engine.owner[cell] != origins[slot]:
+                trades.append((origins[slot], engine.owner[cell], engine.cards[slot]))
+        return trades
+    if winner is None:
+        return []
+
+    loser = 1 - winner
+    if rule == "One":
+        number = 1
+    elif rule == "Diff":
+        number = engine.scores[winner] - engine.scores[loser]
+    else:
+        number = HAND_SIZE
+    taken = sorted((engine.cards[slot] for slot in range(SLOTS) if origins[slot] == loser),
+                   key=LEVELS.__getitem__, reverse=True)
+    return [(loser, winner, card_id) for card_id in taken[:number]]
+
+
+##############################################################################
+#
+# Character Mixin
+#
+##############################################################################
+
+class CardCollectionMixin:
+    """
+    Gives a character a Triple Triad card collection.
+
+    Adds Database Attributes:
+        tripletriad_cards (bytes): The packed CardCollection.
+
+    CardCollectionMixin - Overwrites:
+        (super) at_object_creation
+    """
+
+    def at_object_creation(self):
+        """
+        Called at initial creation. Gives the starter collection.
+        """
+        super().at_object_creation()
+        self.attributes.add(COLLECTION_ATTRIBUTE, starter_collection().pack())
+
+    @property
+    def card_collection(self):
+        """
+        The character's CardCollection, loaded on first use. A character
+        created before collections existed is given the starter collection.
+        """
+        collection = self.ndb.card_collection
+        if collection is None:
+            data = self.attributes.get(COLLECTION_ATTRIBUTE)
+            if data is None:
+                collection = starter_collection()
+                self.attributes.add(COLLECTION_ATTRIBUTE, collection.pack())
+            else:
+                collection = CardCollection(data)
+            self.ndb.card_collection = collection
+        return collection
+
+    def save_card_collection(self):
+        """
+        Saves the collection in a single write.
+        """
+        self.attributes.add(COLLECTION_ATTRIBUTE, self.card_collection.pack())
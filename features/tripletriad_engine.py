@@ -0,0 +1,722 @@
+"""
+Triple Triad Engine
+
+A compact representation of a single Triple Triad match, used by each
+TripleTriadMatch in features/tripletriad.py.
+
+The match is held in a handful of fixed-size lists which are allocated once
+when the engine is created and then only ever written in place:
+
+    cards    - card id in each of the 10 card slots, from the card list in
+               features/tripletriad_cards.py.
+    ranks    - 4 ranks for each card slot (slot * 4 + side).
+    elements - element of each card slot.
+    hand     - whether each card slot is still in its owner's hand.
+    board    - card slot placed on each of the 9 cells (EMPTY if none).
+    owner    - player owning each of the 9 cells (EMPTY if none).
+    scores   - running score of both players.
+
+Card slots 0-4 belong to player 0 and 5-9 to player 1. Cells are numbered
+row by row, so "a1" is cell 0, "b1" cell 1 and "c3" cell 8.
+
+Placing a card only looks at the (at most four) precomputed neighbours of
+the target cell and updates the score counters as cards change hands, so a
+move and the score after it never walk the whole board. Every move can be
+taken back with undo(), which is what the AI search uses to walk the game
+tree without copying the engine.
+
+The engine also keeps a 64-bit position key, updated with each move. Like a
+Zobrist key it is a sum of fixed random terms (one per card in hand, card on
+cell, owned cell and side to move), but the terms are derived from the card
+ranks rather than slot numbers so that identical positions reached in
+different games or with the cards in a different hand order share a key.
+The terms are added rather than XORed so that two identical cards in one
+hand do not cancel out.
+
+Captures follow the Game Rules set with set_rules(). The basic rule is
+resolved inline; any other combination of Same, Same Wall, Plus (each with
+Combo) and Elemental is resolved by a capture step compiled once for that
+combination (see capture_pipeline()). Under Elemental the modified rank of
+every card on every cell is worked out when the cards and element layout
+are set, so a move only ever looks ranks up.
+
+The whole state can be packed into a few bytes with pack() and restored
+with TripleTriadEngine.unpack(), everything else being derived from the
+card ids. This is what a TripleTriadMatch saves to the database.
+
+The engine has no dependency on Evennia and can be driven headless.
+"""
+import random
+import struct
+from itertools import combinations
+from features.tripletriad_cards import RANKS, ELEMENTS, ELEMENT_NAMES
+
+# Sides of a card, in the order ranks are stored.
+UP, RIGHT, DOWN, LEFT = range(4)
+SIDES = ("up", "right", "down", "left")
+
+# Board positions as used by the Triple Triad Command, in cell order.
+POSITIONS = ("a1", "b1", "c1", "a2", "b2", "c2", "a3", "b3", "c3")
+CELL_INDEX = {position: cell for cell, position in enumerate(POSITIONS)}
+
+CELLS = 9
+HAND_SIZE = 5
+PLAYERS = 2
+SLOTS = HAND_SIZE * PLAYERS
+EMPTY = -1
+
+# Game Rules, as described in features/tripletriad.py. A set of rules is
+# stored as a bitmask with bit n set for RULES[n].
+RULES = ("Open", "Same", "Same Wall", "Sudden Death", "Random", "Plus",
+         "Combo", "Elemental")
+RULE_BITS = {rule: 1 << bit for bit, rule in enumerate(RULES)}
+
+
+def rules_mask(rules):
+    """
+    Returns the bitmask of a list of rule names.
+    """
+    mask = 0
+    for rule in rules:
+        mask |= RULE_BITS[rule]
+    return mask
+
+
+def mask_rules(mask):
+    """
+    Returns the list of rule names in a bitmask.
+    """
+    return [rule for rule in RULES if mask & RULE_BITS[rule]]
+
+
+def _build_neighbours(cell):
+    """
+    Returns the cells touching cell as (adjacent cell, side of the placed
+    card, side of the adjacent card) tuples.
+    """
+    row, column = divmod(cell, 3)
+    neighbours = []
+    if row > 0:
+        neighbours.append((cell - 3, UP, DOWN))
+    if column < 2:
+        neighbours.append((cell + 1, RIGHT, LEFT))
+    if row < 2:
+        neighbours.append((cell + 3, DOWN, UP))
+    if column > 0:
+        neighbours.append((cell - 1, LEFT, RIGHT))
+    return tuple(neighbours)
+
+
+NEIGHBOURS = tuple(_build_neighbours(cell) for cell in range(CELLS))
+CELL_BITS = tuple(1 << cell for cell in range(CELLS))
+
+# Packed state: card id per slot, card slot per cell (255 for none), bitmask
+# of cells owned by player 1, the player to move, the rules bitmask and the 
+# element of each cell (0 for none, else 1 + index in ELEMENT_NAMES).
+PACKED_STATE = struct.Struct("<10s9sHBH9s")
+_PACKED_EMPTY = 255
+
+# Position key terms.
+MASK64 = (1 << 64) - 1
+
+
+def mix64(value):
+    """
+    Scrambles an integer into a well distributed 64-bit value (splitmix64).
+    """
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def _element_code(element):
+    """
+    Returns a stable small integer for a card or cell element.
+    """
+    if not element:
+        return 0
+    return 1 + sum(ord(letter) for letter in str(element)) % 251
+
+
+_HAND_SALT = 0x48414E44
+_CELL_SALT = 0x43454C4C
+TURN_KEY = mix64(0x5455524E)
+OWNER_KEYS = tuple(mix64(0x4F574E00 + cell) for cell in range(CELLS))
+# Key change when `player` places a card on a cell, and when `player`
+# captures a cell, indexed [player][cell].
+_PLACE_DELTA = ((0,) * CELLS, OWNER_KEYS)
+_CAPTURE_DELTA = (tuple(-key & MASK64 for key in OWNER_KEYS), OWNER_KEYS)
+# Key change when `player` passes the turn.
+_TURN_DELTA = (TURN_KEY, -TURN_KEY & MASK64)
+# Key change when `player` captures every cell in a bitmask, [player][mask].
+_CAPTURE_MASK_DELTA = tuple(
+    tuple(sum(deltas[cell] for cell in range(CELLS) if mask & CELL_BITS[cell]) & MASK64
+          for mask in range(1 << CELLS))
+    for deltas in _CAPTURE_DELTA)
+POPCOUNT = tuple(bin(mask).count("1") for mask in range(1 << CELLS))
+
+
+##############################################################################
+#
+# Capture Rules
+#
+##############################################################################
+
+# Rules which change how cards are captured. The others (Open, Random, 
+# Sudden Death) are handled by the match.
+CAPTURE_RULES = (RULE_BITS["Same"] | RULE_BITS["Same Wall"] | RULE_BITS["Plus"]
+                 | RULE_BITS["Elemental"])
+# Chance of each cell being given an element under the Elemental rule.
+ELEMENT_CHANCE = 0.2
+# Rank of the edge of the board under Same Wall.
+WALL_RANK = 10
+
+# Sides of each cell facing the edge of the board.
+WALLS = tuple(tuple(side for side in range(4)
+                    if side not in [neighbour[1] for neighbour in NEIGHBOURS[cell]])
+              for cell in range(CELLS))
+# Every pair of neighbours of each cell, for Plus, as (index into 
+# NEIGHBOURS[cell], index, bitmask of both cells).
+NEIGHBOUR_PAIRS = tuple(
+    tuple((first, second, CELL_BITS[NEIGHBOURS[cell][first][0]] | CELL_BITS[NEIGHBOURS[cell][second][0]])
+          for first, second in combinations(range(len(NEIGHBOURS[cell])), 2))
+    for cell in range(CELLS))
+
+
+def random_elements(rng=random, chance=ELEMENT_CHANCE):
+    """
+    Returns an element layout for the Elemental rule: the element of each 
+    cell, or None.
+    """
+    return [rng.choice(ELEMENT_NAMES) if rng.random() < chance else None
+            for _ in range(CELLS)]
+
+
+def element_layout(rules, seed):
+    """
+    Returns the element layout of a match from its seed, so a logged match
+    can be replayed on the same layout. All None without Elemental.
+    """
+    if not rules & RULE_BITS["Elemental"]:
+        return [None] * CELLS
+    return random_elements(random.Random(seed))
+
+
+def decision_seed(seed, moves):
+    """
+    Returns the seed of an AI decision in a match, from the match's seed and
+    the number of moves logged before it, so a match can be re-run with the
+    AI making the same choices.
+    """
+    return mix64(seed ^ (moves + 1) << 40) & 0xFFFFFFFF
+
+
+def _compile_capture(rules):
+    """
+    Builds the capture step of TripleTriadEngine.play for one combination
+    of capture rules.
+
+    Captures follow the Game Rules in features/tripletriad.py, as in 
+    features/tripletriad_simulate.py:
+        Basic      An adjacent opponent card is captured if the placed card's
+                   rank facing it is higher.
+        Same       If two or more adjacent cards (or, with Same Wall, edges of
+                   the board facing a rank of A) have the same rank as the 
+                   placed card's rank facing them, the opponent's are captured.
+        Plus       If the facing ranks of two or more adjacent cards add up to
+                   the same sum, the opponent's are captured.
+        Combo      Cards captured by Same or Plus capture weaker adjacent 
+                   opponent cards as if just placed, and so on.
+        Elemental  Basic and Combo captures use the ranks baked for each card
+                   on each cell; Same and Plus use the printed ranks.
+
+    Args:
+        rules (int): Rules bitmask.
+
+    Returns:
+        capture (function): capture(engine, slot, cell, player), which sets 
+                            the owner of every cell captured by placing slot 
+                            on cell and returns their bitmask.
+    """
+    same = bool(rules & RULE_BITS["Same"])
+    wall = same and bool(rules & RULE_BITS["Same Wall"])
+    plus = bool(rules & RULE_BITS["Plus"])
+    elemental = bool(rules & RULE_BITS["Elemental"])
+    # Combo only ever starts from a Same or Plus capture.
+    combo = same or plus
+    # Ranks of a card slot on a cell start at slot * stride + cell * offset,
+    # in engine.effective under Elemental and engine.ranks otherwise.
+    stride = CELLS * 4 if elemental else 4
+    offset = 4 if elemental else 0
+    # Scratch space reused by every move: the sum of each pair of facing 
+    # ranks for Plus (distinct negative numbers where there is no card) and
+    # a bounded queue for Combo, as each cell is captured at most once.
+    sums = [0] * 4
+    queue = [0] * CELLS
+
+    def capture(engine, slot, cell, player):
+        ranks = engine.ranks
+        board = engine.board
+        owner = engine.owner
+        table = engine.effective if elemental else ranks
+        base = slot * stride + cell * offset
+        raw = slot * 4
+        neighbours = NEIGHBOURS[cell]
+
+        captured = 0
+        enemy = 0
+        matched = 0
+        count = 0
+        for index, (adjacent, side, opposite) in enumerate(neighbours):
+            other = board[adjacent]
+            if other == EMPTY:
+                sums[index] = -1 - index
+                continue
+            bit = CELL_BITS[adjacent]
+            if owner[adjacent] != player:
+                enemy |= bit
+                if table[base + side] > table[other * stride + adjacent * offset + opposite]:
+                    captured |= bit
+            placed = ranks[raw + side]
+            facing = ranks[other * 4 + opposite]
+            if placed == facing:
+                matched |= bit
+                count += 1
+            sums[index] = placed + facing
+
+        special = 0
+        if same:
+            if wall:
+                for side in WALLS[cell]:
+                    if ranks[raw + side] == WALL_RANK:
+                        count += 1
+            if count >= 2:
+                special = matched
+        if plus:
+            for first, second, bits in NEIGHBOUR_PAIRS[cell]:
+                if sums[first] == sums[second]:
+                    special |= bits
+        # Only the opponent's cards are captured.
+        special &= enemy
+        captured |= special
+        if not captured:
+            return 0
+        for adjacent, _, _ in neighbours:
+            if captured & CELL_BITS[adjacent]:
+                owner[adjacent] = player
+        if not (combo and special):
+            return captured
+
+        # Combo: spread from the Same and Plus captures, breadth first.
+        head, tail = 0, 0
+        for adjacent, _, _ in neighbours:
+            if special & CELL_BITS[adjacent]:
+                queue[tail] = adjacent
+                tail += 1
+        while head < tail:
+            source = queue[head]
+            head += 1
+            source_base = board[source] * stride + source * offset
+            for adjacent, side, opposite in NEIGHBOURS[source]:
+                other = board[adjacent]
+                if other == EMPTY or owner[adjacent] == player:
+                    continue
+                if table[source_base + side] > table[other * stride + adjacent * offset + opposite]:
+                    owner[adjacent] = player
+                    captured |= CELL_BITS[adjacent]
+                    queue[tail] = adjacent
+                    tail += 1
+        return captured
+
+    return capture
+
+
+# Compiled capture steps, by capture rules bitmask. None for the basic 
+# rules, which play() handles inline.
+_PIPELINES = {0: None}
+
+
+def capture_pipeline(rules):
+    """
+    Returns the compiled capture step for a rules bitmask, compiling it on 
+    first use.
+    """
+    rules &= CAPTURE_RULES
+    if rules & RULE_BITS["Same Wall"] and not rules & RULE_BITS["Same"]:
+        # Same Wall has no effect without Same.
+        rules ^= RULE_BITS["Same Wall"]
+    if rules not in _PIPELINES:
+        _PIPELINES[rules] = _compile_capture(rules)
+    return _PIPELINES[rules]
+
+
+class TripleTriadEngine:
+    """
+    Game state and move resolution for one match between two players.
+
+    Players are referred to by seat: 0 or 1. Seat 0 moves first.
+    """
+
+    __slots__ = ("cards", "ranks", "elements", "hand", "board", "owner", "scores",
+                 "turn", "empty", "key", "hand_keys", "cell_keys", "rules",
+                 "cell_elements", "effective", "_capture")
+
+    def __init__(self):
+        self.cards = [EMPTY] * SLOTS
+        self.ranks = [0] * (SLOTS * 4)
+        self.elements = [None] * SLOTS
+        self.hand = [False] * SLOTS
+        self.board = [EMPTY] * CELLS
+        self.owner = [EMPTY] * CELLS
+        self.scores = [0, 0]
+        self.turn = 0
+        self.empty = CELLS
+        self.key = 0
+        self.hand_keys = [0] * SLOTS
+        self.cell_keys = [0] * (SLOTS * CELLS)
+        self.rules = 0
+        self.cell_elements = [None] * CELLS
+        # Under Elemental, ranks of each card slot on each cell 
+        # ((slot * CELLS + cell) * 4 + side). Otherwise empty.
+        self.effective = []
+        self._capture = None
+
+    #########################
+    # Set Up
+    #########################
+
+    def set_rules(self, rules, elements=None):
+        """
+        Sets the Game Rules in effect. Call before any card is placed on the
+        board.
+
+        Args:
+            rules (int): Rules bitmask, see rules_mask().
+            elements (list, optional): Under Elemental, the element of each 
+                                       cell or None, e.g. from 
+                                       random_elements().
+        """
+        self.rules = rules
+        elemental = rules & RULE_BITS["Elemental"]
+        self.cell_elements[:] = elements if elemental and elements else [None] * CELLS
+        self._capture = capture_pipeline(rules)
+        if elemental:
+            self.effective = [0] * (SLOTS * CELLS * 4)
+            for slot in range(SLOTS):
+                if self.cards[slot] != EMPTY:
+                    self._bake_ranks(slot)
+        else:
+            self.effective = []
+
+    def deal(self, player, cards):
+        """
+        Places up to five cards in a player's hand.
+
+        Args:
+            player (int): Seat receiving the cards.
+            cards (list): Card ids.
+        """
+        for index, card in enumerate(cards):
+            slot = player * HAND_SIZE + index
+            self.hand[slot] = True
+            self.set_card(slot, card)
+        self.scores[player] = len(cards)
+
+    def redeal(self):
+        """
+        Starts a Sudden Death round in place after a tied game: each player
+        is dealt the five cards they own, on the board or still in hand, and
+        the board is cleared. The rules and cell elements are kept.
+
+        Returns:
+            order (list): The card slot each new card slot was dealt from.
+        """
+        hands = ([], [])
+        for cell in range(CELLS):
+            hands[self.owner[cell]].append(self.board[cell])
+        for slot in range(SLOTS):
+            if self.hand[slot]:
+                hands[slot // HAND_SIZE].append(slot)
+        order = hands[0] + hands[1]
+        cards = [self.cards[slot] for slot in order]
+
+        self.board[:] = [EMPTY] * CELLS
+        self.owner[:] = [EMPTY] * CELLS
+        self.hand[:] = [False] * SLOTS
+        self.hand_keys[:] = [0] * SLOTS
+        self.scores[:] = [0, 0]
+        self.turn = 0
+        self.empty = CELLS
+        self.key = 0
+        self.deal(0, cards[:HAND_SIZE])
+        self.deal(1, cards[HAND_SIZE:])
+        return order
+
+    def set_card(self, slot, card):
+        """
+        Puts a card in a slot that is still in hand, replacing whatever card
+        the slot held. Used when dealing, and by the AI to try out guesses
+        of the cards in a hidden hand.
+
+        Args:
+            slot (int): Card slot, 0 to 9.
+            card (int): Card id.
+        """
+        self.key = (self.key - self.hand_keys[slot]) & MASK64
+        self.cards[slot] = card
+        base = slot * 4
+        self.ranks[base:base + 4] = RANKS[card * 4:card * 4 + 4]
+        self.elements[slot] = ELEMENTS[card]
+        if self.effective:
+            self._bake_ranks(slot)
+        self._set_card_keys(slot)
+        self.key = (self.key + self.hand_keys[slot]) & MASK64
+
+    def _set_card_keys(self, slot):
+        """
+        Derives the position key terms for a card slot from its contents.
+        """
+        code = 0
+        for rank in self.card_ranks(slot):
+            code = (code << 4) | rank
+        code |= _element_code(self.elements[slot]) << 16
+        player = slot // HAND_SIZE
+        self.hand_keys[slot] = mix64((code << 1 | player) ^ _HAND_SALT)
+        base = slot * CELLS
+        for cell in range(CELLS):
+            self.cell_keys[base + cell] = mix64((code << 4 | cell) ^ _CELL_SALT)
+
+    def _bake_ranks(self, slot):
+        """
+        Works out the Elemental ranks of a card slot on every cell: one 
+        higher on a cell of its element, one lower on a cell of another.
+        """
+        element = self.elements[slot]
+        printed = self.ranks[slot * 4:slot * 4 + 4]
+        for cell, marked in enumerate(self.cell_elements):
+            modifier = 0 if marked is None else (1 if marked == element else -1)
+            start = (slot * CELLS + cell) * 4
+            self.effective[start:start + 4] = [rank + modifier for rank in printed]
+
+    def copy(self):
+        """
+        Returns an independent copy of the engine.
+        """
+        other = TripleTriadEngine()
+        self.copy_into(other)
+        return other
+
+    def copy_into(self, other):
+        """
+        Overwrites another engine with this one's state, in place.
+        """
+        other.cards[:] = self.cards
+        other.ranks[:] = self.ranks
+        other.elements[:] = self.elements
+        other.hand[:] = self.hand
+        other.board[:] = self.board
+        other.owner[:] = self.owner
+        other.scores[:] = self.scores
+        other.turn = self.turn
+        other.empty = self.empty
+        other.key = self.key
+        other.hand_keys[:] = self.hand_keys
+        other.cell_keys[:] = self.cell_keys
+        other.rules = self.rules
+        other.cell_elements[:] = self.cell_elements
+        if self.effective or other.effective:
+            other.effective[:] = self.effective
+        other._capture = self._capture
+
+    def pack(self):
+        """
+        Returns the state of the match as a short bytes string.
+        """
+        owned = 0
+        for cell in range(CELLS):
+            if self.owner[cell] == 1:
+                owned |= CELL_BITS[cell]
+        return PACKED_STATE.pack(
+            bytes(_PACKED_EMPTY if card == EMPTY else card for card in self.cards),
+            bytes(_PACKED_EMPTY if slot == EMPTY else slot for slot in self.board),
+            owned, self.turn, self.rules,
+            bytes(0 if element is None else 1 + ELEMENT_NAMES.index(element)
+                  for element in self.cell_elements))
+
+    @classmethod
+    def unpack(cls, data):
+        """
+        Returns an engine restored from the output of pack().
+        """
+        cards, board, owned, turn, rules, elements = PACKED_STATE.unpack(data)
+        engine = cls()
+        engine.set_rules(rules, [ELEMENT_NAMES[code - 1] if code else None for code in elements])
+        for slot, card in enumerate(cards):
+            if card != _PACKED_EMPTY:
+                engine.hand[slot] = True
+                engine.set_card(slot, card)
+                engine.scores[slot // HAND_SIZE] += 1
+
+        key = engine.key
+        for cell, slot in enumerate(board):
+            if slot == _PACKED_EMPTY:
+                continue
+            player = 1 if owned & CELL_BITS[cell] else 0
+            engine.hand[slot] = False
+            engine.board[cell] = slot
+            engine.owner[cell] = player
+            engine.empty -= 1
+            engine.scores[slot // HAND_SIZE] -= 1
+            engine.scores[player] += 1
+            key += (engine.cell_keys[slot * CELLS + cell] - engine.hand_keys[slot]
+                    + _PLACE_DELTA[player][cell])
+        if turn:
+            key += TURN_KEY
+        engine.turn = turn
+        engine.key = key & MASK64
+        return engine
+
+    #########################
+    # Moves
+    #########################
+
+    def play(self, card, cell):
+        """
+        Places a card from the current player's hand on the board, captures
+        opponent cards under the rules in effect and passes the turn.
+
+        The move is assumed to be legal.
+
+        Args:
+            card (int): Position in the current player's hand, 0 to 4.
+            cell (int): Board cell, 0 to 8.
+
+        Returns:
+            captured (int): Bitmask of the cells captured by the move.
+        """
+        player = self.turn
+        slot = player * HAND_SIZE + card
+        ranks = self.ranks
+        board = self.board
+        owner = self.owner
+
+        self.hand[slot] = False
+        board[cell] = slot
+        owner[cell] = player
+        self.empty -= 1
+        key = (self.key - self.hand_keys[slot] + self.cell_keys[slot * CELLS + cell]
+               + _PLACE_DELTA[player][cell] + _TURN_DELTA[player])
+
+        capture = self._capture
+        if capture is not None:
+            captured = capture(self, slot, cell, player)
+            count = POPCOUNT[captured]
+            key += _CAPTURE_MASK_DELTA[player][captured]
+        else:
+            # Basic rules: capture weaker adjacent opponent cards.
+            captured = 0
+            count = 0
+            base = slot * 4
+            for adjacent, side, opposite in NEIGHBOURS[cell]:
+                other = board[adjacent]
+                if (other != EMPTY and owner[adjacent] != player
+                        and ranks[base + side] > ranks[other * 4 + opposite]):
+                    owner[adjacent] = player
+                    captured |= CELL_BITS[adjacent]
+                    count += 1
+                    key += _CAPTURE_DELTA[player][adjacent]
+
+        if count:
+            self.scores[player] += count
+            self.scores[1 - player] -= count
+        self.turn = 1 - player
+        self.key = key & MASK64
+        return captured
+
+    def undo(self, card, cell, captured):
+        """
+        Takes back the last move, which must have been play(card, cell) 
+        returning captured.
+        """
+        player = 1 - self.turn
+        slot = player * HAND_SIZE + card
+        owner = self.owner
+        opponent = self.turn
+
+        key = (self.key + self.hand_keys[slot] - self.cell_keys[slot * CELLS + cell]
+               - _PLACE_DELTA[player][cell] - _TURN_DELTA[player])
+        count = 0
+        while captured:
+            bit = captured & -captured
+            adjacent = bit.bit_length() - 1
+            owner[adjacent] = opponent
+            key -= _CAPTURE_DELTA[player][adjacent]
+            captured ^= bit
+            count += 1
+
+        if count:
+            self.scores[player] -= count
+            self.scores[opponent] += count
+        self.hand[slot] = True
+        self.board[cell] = EMPTY
+        owner[cell] = EMPTY
+        self.empty += 1
+        self.turn = player
+        self.key = key & MASK64
+
+    def is_legal(self, card, cell):
+        """
+        Returns True if the current player may place card on cell.
+        """
+        return (0 <= card < HAND_SIZE and 0 <= cell < CELLS
+                and self.hand[self.turn * HAND_SIZE + card]
+                and self.board[cell] == EMPTY)
+
+    #########################
+    # Queries
+    #########################
+
+    def available_cards(self, player=None):
+        """
+        Returns the hand positions still holding a card.
+        """
+        player = self.turn if player is None else player
+        first = player * HAND_SIZE
+        return [card for card in range(HAND_SIZE) if self.hand[first + card]]
+
+    def available_cells(self):
+        """
+        Returns the empty board cells.
+        """
+        return [cell for cell in range(CELLS) if self.board[cell] == EMPTY]
+
+    def hand_card(self, player, card):
+        """
+        Returns the card slot in a player's hand position, or EMPTY if the
+        card has already been played.
+        """
+        slot = player * HAND_SIZE + card
+        return slot if self.hand[slot] else EMPTY
+
+    def card_ranks(self, slot):
+        """
+        Returns the (up, right, down, left) ranks of a card slot.
+        """
+        base = slot * 4
+        return tuple(self.ranks[base:base + 4])
+
+    def is_over(self):
+        """
+        Returns True once every cell is filled.
+        """
+        return not self.empty
+
+    def winner(self):
+        """
+        Returns the winning seat, or None if the scores are tied.
+        """
+        first, second = self.scores
+        if first == second:
+            return None
+        return 0 if first > second else 1
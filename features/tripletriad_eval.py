@@ -0,0 +1,214 @@
+"""
+Triple Triad Position Evaluator
+
+A static evaluation of a Triple Triad position for the AlphaBetaSearch in
+features/tripletriad_ai.py, used where the search stops short of the end of
+the game. Without one the search scores a position by its score difference
+alone.
+
+The evaluation is a weighted sum of a few features of the position, from
+the point of view of the player to move and each the player's value minus
+the opponent's:
+
+    score      Cards owned, in hand and on the board.
+    corners    Cards owned in the corners, edges and centre of the board,
+    edges      which differ in how many sides can be attacked.
+    centre
+    exposed    Ranks of owned cards facing an empty cell, divided by 10.
+    weak       Sides of owned cards of rank 3 or less facing an empty cell.
+    matched    Owned cards on a cell of their element, and on a cell of
+    mismatched another element, under the Elemental rule.
+    hand       Ranks of the cards still in hand, divided by 10.
+
+Each feature is also given again scaled by the fraction of the board still
+empty, so that its weight can change as the game goes on. The weights are
+fitted offline from self-play games by features/tripletriad_train.py,
+which predicts the final score difference, and saved to a small JSON file.
+The server loads the file once, with get_evaluator(), if it has been
+generated.
+
+Training works out the feature vector of each position with features().
+A search does not: walking every cell, neighbour and hand slot at every
+leaf would cost more than the evaluation gains. Because the evaluation is
+linear, LinearEvaluator.bind() instead folds the weights, the phase and
+the cards dealt into lookup tables once per search, giving each card on
+each cell, and each side of a card facing an empty cell, a single
+precomputed value. A leaf is then scored with one lookup per filled cell
+and per side facing an empty cell. bind() and features() give the same
+value for every position.
+"""
+import json
+import os
+from features.tripletriad_engine import CELLS, HAND_SIZE, SLOTS, EMPTY, NEIGHBOURS
+
+VERSION = 1
+BASE_FEATURES = ("score", "corners", "edges", "centre", "exposed", "weak",
+                 "matched", "mismatched", "hand")
+FEATURES = (("bias",) + BASE_FEATURES
+            + tuple(name + "_x_empty" for name in BASE_FEATURES))
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "server", "tripletriad_eval.json")
+
+CORNERS = (0, 2, 6, 8)
+EDGES = (1, 3, 5, 7)
+CENTRE = 4
+# Index of each cell's placement feature: corners, edges or centre.
+_PLACE = tuple(1 if cell in CORNERS else 2 if cell in EDGES else 3 for cell in range(CELLS))
+WEAK_RANK = 3
+# (adjacent cell, side of the adjacent card facing the cell) of each cell.
+_FACING = tuple(tuple((adjacent, opposite) for adjacent, _, opposite in NEIGHBOURS[cell])
+                for cell in range(CELLS))
+
+
+def features(engine):
+    """
+    Returns the feature vector of a position, in FEATURES order, for the
+    player to move.
+    """
+    board, owner, ranks = engine.board, engine.owner, engine.ranks
+    cell_elements, elements = engine.cell_elements, engine.elements
+    # Per player: score, corners, edges, centre, exposed, weak, matched,
+    # mismatched, hand.
+    totals = ([0] * len(BASE_FEATURES), [0] * len(BASE_FEATURES))
+    for cell in range(CELLS):
+        slot = board[cell]
+        if slot == EMPTY:
+            continue
+        values = totals[owner[cell]]
+        values[_PLACE[cell]] += 1
+        base = slot * 4
+        for adjacent, side, opposite in NEIGHBOURS[cell]:
+            if board[adjacent] == EMPTY:
+                rank = ranks[base + side]
+                values[4] += rank
+                if rank <= WEAK_RANK:
+                    values[5] += 1
+        element = cell_elements[cell]
+        if element is not None:
+            values[6 if elements[slot] == element else 7] += 1
+    for slot in range(SLOTS):
+        if engine.hand[slot]:
+            base = slot * 4
+            totals[slot // HAND_SIZE][8] += (ranks[base] + ranks[base + 1]
+                                             + ranks[base + 2] + ranks[base + 3])
+
+    player = engine.turn
+    mine, theirs = totals[player], totals[1 - player]
+    mine[0], theirs[0] = engine.scores[player], engine.scores[1 - player]
+    difference = [a - b for a, b in zip(mine, theirs)]
+    difference[4] /= 10
+    difference[8] /= 10
+    phase = engine.empty / CELLS
+    return [1.0] + difference + [value * phase for value in difference]
+
+
+class LinearEvaluator:
+    """
+    Scores positions as a weighted sum of their features.
+
+    Args:
+        weights (list): One weight per name in FEATURES.
+
+    Call with an engine to get the expected final score difference for the
+    player to move.
+    """
+
+    __slots__ = ("weights",)
+
+    def __init__(self, weights):
+        if len(weights) != len(FEATURES):
+            raise ValueError("Expected %i evaluator weights." % len(FEATURES))
+        self.weights = tuple(float(weight) for weight in weights)
+
+    def __call__(self, engine):
+        return self.bind(engine)(engine)
+
+    def bind(self, engine):
+        """
+        Returns a function scoring the positions reachable from engine's
+        current position, for the player to move, as __call__ would. The
+        function is only valid until a card in hand is changed or redealt.
+        """
+        weights = self.weights
+        bias = weights[0]
+        count = len(BASE_FEATURES)
+        ranks, elements, cell_elements = engine.ranks, engine.elements, engine.cell_elements
+        hand_ranks = [sum(ranks[slot * 4:slot * 4 + 4]) for slot in range(SLOTS)]
+        dealt = sum(hand_ranks[:HAND_SIZE]) - sum(hand_ranks[HAND_SIZE:])
+
+        # Per number of empty cells, values from player 0's side: of the
+        # position before any card is placed, of each card slot on each cell
+        # (leaving its seat's hand) and of each side of each card slot
+        # facing an empty cell. The last two are given once for each owner,
+        # at index * 2 + owner.
+        starts, placed, facing = [], [], []
+        for empty in range(engine.empty + 1):
+            phase = empty / CELLS
+            weight = [weights[1 + index] + weights[1 + count + index] * phase
+                      for index in range(count)]
+            starts.append((weight[8] * dealt / 10, weight[0]))
+            values = []
+            for slot in range(SLOTS):
+                given = (-1 if slot < HAND_SIZE else 1) * weight[8] * hand_ranks[slot] / 10
+                for cell in range(CELLS):
+                    value = weight[_PLACE[cell]]
+                    if cell_elements[cell] is not None:
+                        value += weight[6 if elements[slot] == cell_elements[cell] else 7]
+                    values += (given + value, given - value)
+            placed.append(values)
+            values = []
+            for rank in ranks:
+                value = weight[4] * rank / 10 + (weight[5] if rank <= WEAK_RANK else 0)
+                values += (value, -value)
+            facing.append(values)
+
+        def evaluate(engine):
+            empty = engine.empty
+            start, scored = starts[empty]
+            placed_values, facing_values = placed[empty], facing[empty]
+            board, owner, scores = engine.board, engine.owner, engine.scores
+            value = start + scored * (scores[0] - scores[1])
+            for cell, slot in enumerate(board):
+                if slot == EMPTY:
+                    for adjacent, side in _FACING[cell]:
+                        other = board[adjacent]
+                        if other != EMPTY:
+                            value += facing_values[(other * 4 + side) * 2 + owner[adjacent]]
+                else:
+                    value += placed_values[(slot * CELLS + cell) * 2 + owner[cell]]
+            return bias + (-value if engine.turn else value)
+
+        return evaluate
+
+    def save(self, path=DEFAULT_PATH):
+        """
+        Writes the weights to a JSON file.
+        """
+        with open(path, "w") as handle:
+            json.dump({"version": VERSION, "features": list(FEATURES),
+                       "weights": list(self.weights)}, handle, indent=1)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        """
+        Reads weights written by save().
+        """
+        with open(path) as handle:
+            data = json.load(handle)
+        if data.get("version") != VERSION or tuple(data.get("features", ())) != FEATURES:
+            raise ValueError("%s was fitted for a different evaluator." % path)
+        return cls(data["weights"])
+
+
+_EVALUATORS = {}
+
+
+def get_evaluator(path=DEFAULT_PATH):
+    """
+    Returns the evaluator saved at path, loading it on first use, or None if
+    no weights have been fitted there.
+    """
+    if path not in _EVALUATORS:
+        _EVALUATORS[path] = LinearEvaluator.load(path) if os.path.exists(path) else None
+    return _EVALUATORS[path]
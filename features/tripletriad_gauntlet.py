@@ -0,0 +1,276 @@
+"""
+Triple Triad AI Gauntlet
+
+Plays AI strategies against each other on every CPU core to measure which
+is stronger before a new NPC opponent ships. Runs outside the game server.
+
+Every pairing plays the same deals:
+
+    - Deal n of a run is dealt from seed + n, so a run can be repeated
+      exactly and two runs with the same seed play the same hands.
+    - Each deal is played twice, with the strategies swapping seats, so
+      neither gains from the cards it was dealt or from moving first.
+    - Searches are limited as the server's AI limits them, by each 
+      difficulty's depth and node budget, or its simulations, rather than 
+      by time, so the strategies measured are the ones shipped. Every 
+      game's searchers are seeded from its deal, so the results do not 
+      depend on machine load or on how deals are split between processes.
+      --nodes gives the AlphaBetaSearch strategies another node budget,
+      and --time bounds every search by time instead, which makes the 
+      results machine dependent.
+
+A deal's result for the first strategy is the mean of its two games (1 for
+a win, 0.5 for a draw, 0 for a loss). The report gives each pairing's wins,
+draws and losses, its mean score with a 95% confidence interval over the
+deals, and the Elo difference the score corresponds to.
+
+Strategies:
+    random          Random card on a random empty cell.
+    greedy          The move capturing the most cards, ties at random.
+    easy ... expert AlphaBetaSearch at that difficulty.
+    eval-<level>    AlphaBetaSearch using the fitted evaluator (see
+                    features/tripletriad_eval.py).
+    mcts-<level>    MonteCarloSearch at that difficulty, with the
+                    opponent's hand hidden.
+
+Usage:
+    python -m features.tripletriad_gauntlet --strategies greedy easy normal
+    python -m features.tripletriad_gauntlet --strategies normal eval-normal
+        --deals 20000 --rules Same Plus
+    python -m features.tripletriad_gauntlet --strategies hard expert --nodes 100000
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from itertools import combinations
+from multiprocessing import Pool, cpu_count
+from features.tripletriad_engine import TripleTriadEngine, RULES, rules_mask, element_layout
+from features.tripletriad_cards import random_hand
+from features.tripletriad_ai import AlphaBetaSearch, DIFFICULTIES, greedy_move
+from features.tripletriad_mcts import MonteCarloSearch
+from features.tripletriad_mcts import DIFFICULTIES as MCTS_DIFFICULTIES
+from features.tripletriad_tablebase import get_tablebase
+from features.tripletriad_eval import get_evaluator
+
+CHUNK = 250
+Z_95 = 1.96
+
+
+##############################################################################
+#
+# Strategies
+#
+##############################################################################
+
+def strategy_names():
+    """
+    Returns the name of every strategy.
+    """
+    searched = [difficulty for difficulty in DIFFICULTIES if difficulty != "random"]
+    return (["random", "greedy"] + searched + ["eval-" + level for level in searched]
+            + ["mcts-" + level for level in MCTS_DIFFICULTIES])
+
+
+def make_player(name, rng, time_budget=None, node_budget=None):
+    """
+    Returns a function choosing a move for the player to move, for one game.
+
+    Args:
+        name (str): Strategy, from strategy_names().
+        rng (random.Random): Source of randomness.
+        time_budget (float, optional): Seconds per move for searches, 
+                                       instead of the difficulty's node 
+                                       budget.
+        node_budget (int, optional): Nodes per move for AlphaBetaSearch
+                                     strategies. Defaults to the 
+                                     difficulty's, as on the server.
+    """
+    budget = math.inf if time_budget is None else time_budget
+    if node_budget is None and time_budget is not None:
+        node_budget = math.inf
+    if name == "random":
+        return lambda engine: (rng.choice(engine.available_cards()),
+                               rng.choice(engine.available_cells()))
+    if name == "greedy":
+        return lambda engine: greedy_move(engine, rng)
+    if name.startswith("mcts-"):
+        searcher = MonteCarloSearch(iterations=MCTS_DIFFICULTIES[name[5:]],
+                                    time_budget=budget, rng=rng)
+        return lambda engine: searcher.choose_move(engine, hidden=True)
+    evaluator = None
+    if name.startswith("eval-"):
+        name = name[5:]
+        evaluator = get_evaluator()
+        if evaluator is None:
+            raise ValueError("No fitted evaluator. Run features.tripletriad_train first.")
+    searcher = AlphaBetaSearch(name, time_budget=budget, rng=rng, tablebase=get_tablebase(), 
+                               evaluator=evaluator, node_budget=node_budget)
+    return searcher.choose_move
+
+
+##############################################################################
+#
+# Playing
+#
+##############################################################################
+
+def play_deal(first, second, seed, rules, time_budget=None, node_budget=None):
+    """
+    Plays one deal twice, swapping seats.
+
+    Returns:
+        results (tuple): The first strategy's result in each game: 1 for a
+                         win, 0.5 for a draw, 0 for a loss.
+    """
+    rng = random.Random(seed)
+    mask = rules_mask(rules)
+    dealt = TripleTriadEngine()
+    dealt.set_rules(mask, element_layout(mask, seed))
+    dealt.deal(0, random_hand(rng))
+    dealt.deal(1, random_hand(rng))
+
+    results = []
+    for seat in (0, 1):
+        engine = dealt.copy()
+        names = (first, second) if seat == 0 else (second, first)
+        players = [make_player(name, random.Random(seed * 4 + seat * 2 + index), 
+                               time_budget, node_budget)
+                   for index, name in enumerate(names)]
+        while not engine.is_over():
+            engine.play(*players[engine.turn](engine))
+        winner = engine.winner()
+        results.append(0.5 if winner is None else float(winner == seat))
+    return tuple(results)
+
+
+def _play_chunk(job):
+    """
+    Plays a run of deals in a worker process.
+
+    Returns:
+        start (int): Index of the first deal.
+        results (list): Result pair of each deal.
+    """
+    first, second, seed, start, count, rules, time_budget, node_budget = job
+    return start, [play_deal(first, second, seed + index, rules, time_budget, node_budget)
+                   for index in range(start, start + count)]
+
+
+##############################################################################
+#
+# Statistics
+#
+##############################################################################
+
+def elo_difference(score):
+    """
+    Returns the Elo rating difference implied by a mean score.
+    """
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def summarise(results):
+    """
+    Summarises the results of a pairing from the first strategy's side.
+
+    Args:
+        results (list): Result pair of each deal.
+
+    Returns:
+        summary (dict): Games won, drawn and lost, the mean score with its
+                        95% confidence interval over the deals, and the
+                        matching Elo difference.
+    """
+    games = [result for pair in results for result in pair]
+    scores = [sum(pair) / 2 for pair in results]
+    deals = len(scores)
+    mean = sum(scores) / deals
+    variance = sum((score - mean) ** 2 for score in scores) / (deals - 1) if deals > 1 else 0.0
+    margin = Z_95 * math.sqrt(variance / deals)
+    low, high = max(0.0, mean - margin), min(1.0, mean + margin)
+    return {
+        "deals": deals, "games": len(games),
+        "wins": games.count(1.0), "draws": games.count(0.5), "losses": games.count(0.0),
+        "score": mean, "score_95": [low, high],
+        "elo": elo_difference(mean), "elo_95": [elo_difference(low), elo_difference(high)],
+    }
+
+
+def run(strategies, deals=1000, seed=0, rules=(), time_budget=None, processes=None,
+        chunk=CHUNK, node_budget=None):
+    """
+    Plays every pairing of strategies across worker processes.
+
+    Args:
+        strategies (list): Names of the strategies, from strategy_names().
+        deals (int, optional): Deals per pairing, each played twice.
+        seed (int, optional): Seed of the first deal.
+        rules (list, optional): Game Rules of every game.
+        time_budget (float, optional): Seconds per move for searches. Results
+                                       then depend on the machine.
+        node_budget (int, optional): Nodes per move for AlphaBetaSearch 
+                                     strategies, instead of each 
+                                     difficulty's.
+        processes (int, optional): Worker processes. Defaults to all cores.
+        chunk (int, optional): Deals sent to a worker at a time.
+
+    Returns:
+        report (dict): Summary of each pairing, keyed "first vs second".
+    """
+    pairings = list(combinations(strategies, 2))
+    jobs = [(first, second, seed, start, min(chunk, deals - start), list(rules), time_budget,
+             node_budget)
+            for first, second in pairings for start in range(0, deals, chunk)]
+    results = {pairing: {} for pairing in pairings}
+    started = time.perf_counter()
+    with Pool(processes) as pool:
+        for job, (start, chunk_results) in zip(
+                jobs, pool.imap(_play_chunk, jobs)):
+            results[job[:2]][start] = chunk_results
+
+    report = {"seed": seed, "deals": deals, "rules": list(rules),
+              "processes": processes or cpu_count(), "pairings": {}}
+    for pairing, chunks in results.items():
+        ordered = [pair for start in sorted(chunks) for pair in chunks[start]]
+        report["pairings"]["%s vs %s" % pairing] = summarise(ordered)
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Play Triple Triad AI strategies "
+                                                 "against each other.")
+    parser.add_argument("--strategies", nargs="+", default=["random", "greedy", "easy", "normal"],
+                        choices=strategy_names())
+    parser.add_argument("--deals", type=int, default=1000,
+                        help="Deals per pairing. Each deal is played twice.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rules", nargs="*", default=[], choices=RULES)
+    parser.add_argument("--time", type=float, default=None,
+                        help="Seconds per move for searches, instead of the server's node "
+                             "budgets. Makes results machine dependent.")
+    parser.add_argument("--nodes", type=int, default=None,
+                        help="Nodes per move for AlphaBetaSearch strategies, instead of "
+                             "each difficulty's.")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Also write the report to this file.")
+    args = parser.parse_args(argv)
+
+    report = run(args.strategies, args.deals, args.seed, args.rules, args.time, args.processes,
+                 node_budget=args.nodes)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Triple Triad Match History
+
+Keeps the result of every finished match in a SQLite database, for the
+`tt history`, `tt versus` and `tt games` commands, however many games have been played.
+
+    - Each match is stored as two rows, one from each player's side (the
+      player, their opponent, their result and score), so that every query
+      is about one player and is answered from an index on that player
+      alone, whichever seat they sat in.
+    - Results are queued on the reactor and written in batches, in one
+      transaction, by Twisted's thread pool, so the game never waits on the
+      disk. The queue is written out when it reaches BATCH_SIZE rows or
+      FLUSH_DELAY seconds after the first result in it, and straight away
+      when the server stops.
+    - Queries also run in the thread pool, after any queued results have
+      been written, and return a Deferred.
+
+Indexes:
+    history_player    (player, ended)            A player's latest games.
+    history_versus    (player, opponent, result)  Records, overall and
+                                                  head to head, counted
+                                                  from the index alone.
+    history_ended     (ended)                    Games by date.
+    history_rules     (rules, ended)             Games by ruleset.
+
+Rows are never replaced: a result whose match id is already recorded for
+that player is logged and left out. The manager starts match ids after the
+last one recorded (see last_match), so that only happens if the database
+has been edited by hand.
+
+The database is server/tripletriad_history.db by default. It is opened in
+WAL mode, so it can be read, for example by offline tools, while the server
+writes to it.
+"""
+import os
+import sqlite3
+import threading
+import time
+from twisted.internet import defer, reactor, threads
+from evennia.utils import logger
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "server", "tripletriad_history.db")
+BATCH_SIZE = 500        # Queued rows which are written straight away.
+FLUSH_DELAY = 5.0       # Seconds a result may wait to be written.
+RECENT_GAMES = 20       # Games shown by tt history.
+
+WIN, DRAW, LOSS = 1, 0, -1
+RESULT_NAMES = {WIN: "Win", DRAW: "Draw", LOSS: "Loss"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    match INTEGER NOT NULL,
+    player INTEGER NOT NULL,
+    opponent INTEGER NOT NULL,
+    player_name TEXT NOT NULL,
+    opponent_name TEXT NOT NULL,
+    result INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    opponent_score INTEGER NOT NULL,
+    rules INTEGER NOT NULL,
+    rated INTEGER NOT NULL,
+    ended REAL NOT NULL,
+    PRIMARY KEY (match, player)
+);
+CREATE INDEX IF NOT EXISTS history_player ON history (player, ended);
+CREATE INDEX IF NOT EXISTS history_versus ON history (player, opponent, result);
+CREATE INDEX IF NOT EXISTS history_ended ON history (ended);
+CREATE INDEX IF NOT EXISTS history_rules ON history (rules, ended);
+"""
+COLUMNS = ("match", "player", "opponent", "player_name", "opponent_name", "result",
+           "score", "opponent_score", "rules", "rated", "ended")
+INSERT = "INSERT OR IGNORE INTO history VALUES (%s)" % ", ".join("?" * len(COLUMNS))
+
+
+def result_rows(match_id, players, scores, winner, rules, rated=False, ended=None):
+    """
+    Returns the two rows recording a finished match.
+
+    Args:
+        match_id (int): The match.
+        players (list): (id, name) of the player in each seat.
+        scores (list): Final score of each seat.
+        winner (int or None): Seat of the winner, or None for a tie.
+        rules (int): Rules bitmask, see features/tripletriad_engine.py.
+        rated (bool, optional): Whether the match was rated.
+        ended (float, optional): Time the match ended. Defaults to now.
+    """
+    ended = time.time() if ended is None else ended
+    rows = []
+    for seat in (0, 1):
+        result = DRAW if winner is None else WIN if winner == seat else LOSS
+        (player, name), (opponent, opponent_name) = players[seat], players[1 - seat]
+        rows.append((match_id, player, opponent, name, opponent_name, result,
+                     scores[seat], scores[1 - seat], rules, int(bool(rated)), ended))
+    return rows
+
+
+class MatchHistory:
+    """
+    The match history database. Its methods block, so the server calls
+    them through the queue and the thread pool (see record() and query()).
+
+    Args:
+        path (str): Database file. Created, with its tables, on first use.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.pending = []
+        self._connection = None
+        self._lock = threading.Lock()
+        self._flush_call = None
+
+    def _connect(self):
+        """
+        Returns the connection to the database, opening it if needed. Only
+        called with the lock held.
+        """
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def write(self, rows):
+        """
+        Writes rows from result_rows() in one transaction. Rows for a match
+        and player already recorded are left out.
+
+        Returns:
+            skipped (int): Number of rows left out.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                before = connection.total_changes
+                connection.executemany(INSERT, rows)
+                return len(rows) - (connection.total_changes - before)
+
+    def _select(self, sql, parameters):
+        """
+        Returns the rows of a query.
+        """
+        with self._lock:
+            return self._connect().execute(sql, parameters).fetchall()
+
+    def recent(self, player, count=RECENT_GAMES, opponent=None):
+        """
+        Returns a player's latest games, newest first, as dicts keyed by
+        COLUMNS. Only games against opponent if given.
+        """
+        if opponent is None:
+            rows = self._select("SELECT * FROM history WHERE player = ? "
+                                "ORDER BY ended DESC LIMIT ?", (player, count))
+        else:
+            rows = self._select("SELECT * FROM history WHERE player = ? AND opponent = ? "
+                                "ORDER BY ended DESC LIMIT ?", (player, opponent, count))
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def record(self, player, opponent=None):
+        """
+        Returns a player's (wins, draws, losses), overall or against one
+        opponent.
+        """
+        if opponent is None:
+            rows = self._select("SELECT result, COUNT(*) FROM history WHERE player = ? "
+                                "GROUP BY result", (player,))
+        else:
+            rows = self._select("SELECT result, COUNT(*) FROM history WHERE player = ? "
+                                "AND opponent = ? GROUP BY result", (player, opponent))
+        counts = dict(rows)
+        return counts.get(WIN, 0), counts.get(DRAW, 0), counts.get(LOSS, 0)
+
+    def last_match(self):
+        """
+        Returns the highest match id recorded or queued, or 0.
+        """
+        (last,) = self._select("SELECT MAX(match) FROM history", ())[0]
+        return max([last or 0] + [row[0] for row in self.pending])
+
+    def by_rules(self, rules, count=RECENT_GAMES):
+        """
+        Returns the latest games played under a rules bitmask, newest first,
+        one row per match.
+        """
+        rows = self._select("SELECT * FROM history WHERE rules = ? AND result >= 0 "
+                            "ORDER BY ended DESC LIMIT ?", (rules, count * 2))
+        seen, games = set(), []
+        for row in rows:
+            game = dict(zip(COLUMNS, row))
+            if game["match"] not in seen:
+                seen.add(game["match"])
+                games.append(game)
+        return games[:count]
+
+    def close(self):
+        """
+        Closes the connection, if open.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    #########################
+    # Server Side
+    #########################
+
+    def add(self, rows):
+        """
+        Queues rows to be written. Called on the reactor.
+        """
+        self.pending.extend(rows)
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+        elif self._flush_call is None:
+            self._flush_call = reactor.callLater(FLUSH_DELAY, self.flush)
+
+    def flush(self, wait=False):
+        """
+        Writes the queued rows in the thread pool, or straight away if wait.
+        Rows that fail to write are queued again.
+
+        Returns:
+            deferred (Deferred): Fires once the rows have been written.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        rows, self.pending = self.pending, []
+        if not rows:
+            return defer.succeed(None)
+        if wait:
+            try:
+                self._written(self.write(rows))
+            except Exception:
+                logger.log_trace("Triple Triad match history write failed.")
+                self.pending[:0] = rows
+            return defer.succeed(None)
+        deferred = threads.deferToThread(self.write, rows)
+        deferred.addCallbacks(self._written, self._failed, errbackArgs=(rows,))
+        return deferred
+
+    def _written(self, skipped):
+        """
+        Logs rows left out of a write because their match was already 
+        recorded.
+        """
+        if skipped:
+            logger.log_warn("Triple Triad match history: %i results left out as their "
+                            "match ids were already recorded." % skipped)
+
+    def _failed(self, failure, rows):
+        """
+        Logs a failed write and queues its rows to be tried again.
+        """
+        logger.log_err("Triple Triad match history write failed: %s" % failure.getErrorMessage())
+        self.pending[:0] = rows
+        if self._flush_call is None:
+            self._flush_call = reactor.callLater(FLUSH_DELAY, self.flush)
+
+    def query(self, method, *args, **kwargs):
+        """
+        Runs a query method, such as recent or record, in the thread pool
+        once the queued rows are written.
+
+        Returns:
+            deferred (Deferred): Fires with the query's result.
+        """
+        deferred = self.flush()
+        deferred.addCallback(lambda _: threads.deferToThread(method, *args, **kwargs))
+        return deferred
+
+
+_HISTORIES = {}
+
+
+def get_history(path=DEFAULT_PATH):
+    """
+    Returns the match history at path.
+    """
+    if path not in _HISTORIES:
+        _HISTORIES[path] = MatchHistory(path)
+    return _HISTORIES[path]
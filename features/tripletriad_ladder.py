@@ -0,0 +1,226 @@
+"""
+Triple Triad Ladder and Matchmaking
+
+Elo ratings, the leaderboard and the matchmaking queue for rated Triple
+Triad matches. Players are referred to by id, so nothing here needs
+Evennia; the TripleTriadManager in features/tripletriad.py holds one Ladder
+and one MatchmakingQueue for the whole game.
+
+Ladder:
+    Ratings are kept in a dictionary for lookups and in a list of
+    (-rating, player id) kept sorted with bisect, so a rating update, a
+    player's rank and a page of the leaderboard never sort or scan every
+    player. The ladder is saved as a plain dictionary by the manager every
+    few minutes rather than after every match.
+
+MatchmakingQueue:
+    Waiting players are kept in join order and in a list sorted by rating.
+    A player is matched with the nearest rated waiting player if their
+    ratings are inside either player's rating window, which starts at WINDOW
+    and widens by WINDOW_GROWTH a second while they wait, up to MAX_WINDOW,
+    so nobody waits forever.
+"""
+from bisect import bisect_left, insort
+
+DEFAULT_RATING = 1200
+K_FACTOR = 32
+# Players' first few games move their rating faster.
+PROVISIONAL_GAMES = 10
+PROVISIONAL_K_FACTOR = 48
+
+WINDOW = 100
+WINDOW_GROWTH = 5
+MAX_WINDOW = 400
+PAGE_SIZE = 10
+
+
+def expected_score(rating, opponent):
+    """
+    Returns the Elo expected score, 0 to 1, of a player against an opponent.
+    """
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+##############################################################################
+#
+# Ladder
+#
+##############################################################################
+
+class Ladder:
+    """
+    Ratings of every rated player.
+
+    Args:
+        data (dict, optional): Saved ladder, from dump().
+    """
+
+    def __init__(self, data=None):
+        self.ratings = {}
+        self.games = {}
+        self.names = {}
+        self._sorted = []
+        self.dirty = False
+        for player_id, (rating, games, name) in (data or {}).items():
+            self.ratings[player_id] = rating
+            self.games[player_id] = games
+            self.names[player_id] = name
+            self._sorted.append((-rating, player_id))
+        self._sorted.sort()
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def rating(self, player_id):
+        """
+        Returns a player's rating, or DEFAULT_RATING if they are unrated.
+        """
+        return self.ratings.get(player_id, DEFAULT_RATING)
+
+    def _set(self, player_id, rating, name):
+        """
+        Sets a player's rating, keeping the sorted list in order.
+        """
+        old = self.ratings.get(player_id)
+        if old is not None:
+            del self._sorted[bisect_left(self._sorted, (-old, player_id))]
+        self.ratings[player_id] = rating
+        self.names[player_id] = name
+        insort(self._sorted, (-rating, player_id))
+        self.dirty = True
+
+    def record(self, players, score):
+        """
+        Updates both players' ratings after a rated match.
+
+        Args:
+            players (tuple): (id, name) of each player.
+            score (float): Result for the first player: 1 for a win, 0.5 for
+                           a tie and 0 for a loss.
+
+        Returns:
+            changes (tuple): Rating change of each player.
+        """
+        (first, first_name), (second, second_name) = players
+        ratings = self.rating(first), self.rating(second)
+        expected = expected_score(ratings[0], ratings[1])
+        changes = []
+        for player_id, name, rating, result, expect in (
+                (first, first_name, ratings[0], score, expected),
+                (second, second_name, ratings[1], 1 - score, 1 - expected)):
+            games = self.games.get(player_id, 0)
+            k = PROVISIONAL_K_FACTOR if games < PROVISIONAL_GAMES else K_FACTOR
+            change = round(k * (result - expect))
+            self.games[player_id] = games + 1
+            self._set(player_id, rating + change, name)
+            changes.append(change)
+        return tuple(changes)
+
+    def rank(self, player_id):
+        """
+        Returns a player's position on the leaderboard, from 1, or None if
+        they are unrated.
+        """
+        rating = self.ratings.get(player_id)
+        if rating is None:
+            return None
+        return bisect_left(self._sorted, (-rating, player_id)) + 1
+
+    def page(self, number=1, size=PAGE_SIZE):
+        """
+        Returns a page of the leaderboard as (rank, name, rating, games)
+        tuples.
+        """
+        start = max(0, (number - 1) * size)
+        return [(start + index + 1, self.names[player_id], -negative, self.games[player_id])
+                for index, (negative, player_id) in enumerate(self._sorted[start:start + size])]
+
+    def dump(self):
+        """
+        Returns the ladder as a dictionary for saving, and marks it saved.
+        """
+        self.dirty = False
+        return {player_id: (rating, self.games[player_id], self.names[player_id])
+                for player_id, rating in self.ratings.items()}
+
+
+##############################################################################
+#
+# Matchmaking
+#
+##############################################################################
+
+class MatchmakingQueue:
+    """
+    Players waiting for a rated match.
+    """
+
+    def __init__(self):
+        self.waiting = {}   # {player id: (rating, time joined)}, in join order.
+        self._sorted = []   # [(rating, player id)]
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def __contains__(self, player_id):
+        return player_id in self.waiting
+
+    def join(self, player_id, rating, now):
+        """
+        Adds a player to the queue, if they are not already waiting.
+        """
+        if player_id not in self.waiting:
+            self.waiting[player_id] = (rating, now)
+            insort(self._sorted, (rating, player_id))
+
+    def leave(self, player_id):
+        """
+        Removes a player from the queue, if they are waiting.
+        """
+        entry = self.waiting.pop(player_id, None)
+        if entry is not None:
+            del self._sorted[bisect_left(self._sorted, (entry[0], player_id))]
+
+    def window(self, player_id, now):
+        """
+        Returns the rating difference a waiting player will accept.
+        """
+        joined = self.waiting[player_id][1]
+        return min(MAX_WINDOW, WINDOW + WINDOW_GROWTH * (now - joined))
+
+    def _nearest(self, player_id):
+        """
+        Returns the waiting player with the closest rating, and the
+        difference, or (None, None).
+        """
+        rating = self.waiting[player_id][0]
+        index = bisect_left(self._sorted, (rating, player_id))
+        best, difference = None, None
+        for neighbour in (index - 1, index + 1):
+            if 0 <= neighbour < len(self._sorted):
+                other_rating, other = self._sorted[neighbour]
+                if difference is None or abs(other_rating - rating) < difference:
+                    best, difference = other, abs(other_rating - rating)
+        return best, difference
+
+    def pop_pairs(self, now):
+        """
+        Matches waiting players, longest waiting first, and removes them from
+        the queue.
+
+        Returns:
+            pairs (list): (player id, player id) of each match made.
+        """
+        pairs = []
+        for player_id in list(self.waiting):
+            if player_id not in self.waiting:
+                continue    # Already paired.
+            other, difference = self._nearest(player_id)
+            if other is None:
+                continue
+            # Either player's window will do, so a long wait helps both.
+            if difference <= max(self.window(player_id, now), self.window(other, now)):
+                self.leave(player_id)
+                self.leave(other)
+                pairs.append((player_id, other))
+        return pairs
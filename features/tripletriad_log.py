@@ -0,0 +1,333 @@
+"""
+Triple Triad Move Log
+
+Every match is recorded as a compact binary log from which any turn can be
+rebuilt, for match history, replays and reproducible bug reports.
+
+Log layout:
+    header - magic, version, rules bitmask, seed and the card id of each of
+             the ten card slots in seat order (see HEADER). The Elemental
+             layout is not stored as it is generated from the seed.
+    moves  - one byte per move: hand position << 4 | cell, with FALLBACK
+             set on an AI move that was the fallback move played when the
+             AI workers missed their deadline (see 
+             features/tripletriad_workers.py), so a re-run of the match 
+             knows not to expect the AI's own choice there.
+
+A Sudden Death round is logged as another header and its moves, straight
+after the nine moves of the tied round before it. A finished match is 35
+bytes a round. A live log is saved with the rest of its
+match; when the match ends the log is appended to the match archive, a file
+of (match id, length, log) records which is only ever appended to.
+
+Next to the archive, an index file holds (match id, offset, length) of 
+each log, written just before the log itself, so finding a log never means
+reading the archive. The archive is only scanned for logs missing from the
+index, which only happens once, for an archive written before there was an
+index. Appending needs neither. The index is loaded on the first get(), 
+which the server makes in a thread.
+
+A Replay fast-forwards a TripleTriadEngine through the logged moves, and
+can seek to any turn, forwards or backwards, by playing or undoing the
+moves in between. positions() steps through every position in order, as
+the AI re-runs a match.
+"""
+import os
+import struct
+import threading
+from features.tripletriad_engine import (TripleTriadEngine, CELLS, HAND_SIZE, SLOTS,
+                                         rules_mask, mask_rules, element_layout)
+
+MAGIC = b"TTML"
+VERSION = 1
+# magic, version, rules, seed, card id of each slot
+HEADER = struct.Struct("<4sBxHQ%iB" % SLOTS)
+# match id, length of the log
+RECORD = struct.Struct("<IH")
+# match id, offset and length of the log in the archive
+INDEX_RECORD = struct.Struct("<IQH")
+# Move byte flag of a fallback move.
+FALLBACK = 0x80
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "server", "tripletriad_matches.bin")
+
+
+##############################################################################
+#
+# Writing
+#
+##############################################################################
+
+def new_log(engine, rules=(), seed=0):
+    """
+    Starts the log of a match which has just been dealt.
+
+    Args:
+        engine (TripleTriadEngine): The match, before the first move.
+        rules (list, optional): Game Rules in effect.
+        seed (int, optional): Seed the match was set up with.
+
+    Returns:
+        log (bytearray): The log header. Append a byte per move.
+    """
+    return bytearray(HEADER.pack(MAGIC, VERSION, rules_mask(rules), seed, *engine.cards))
+
+
+def encode_move(card, cell, fallback=False):
+    """
+    Packs a move, as (hand position, cell), into a byte, flagged if it was
+    a fallback move.
+    """
+    return card << 4 | cell | (FALLBACK if fallback else 0)
+
+
+def decode_move(move):
+    """
+    Unpacks a move byte into (hand position, cell), ignoring FALLBACK.
+    """
+    return (move & ~FALLBACK) >> 4, move & 15
+
+
+##############################################################################
+#
+# Replay
+#
+##############################################################################
+
+class Replay:
+    """
+    Steps through a logged match. Turns are counted through every Sudden
+    Death round, so turn 9 is the end of the first round and turn 10 the
+    first move of the next.
+
+    Args:
+        data (bytes): A log started with new_log().
+
+    Attributes:
+        rules (list): Game Rules of the match.
+        seed (int): Seed the match was set up with.
+        cards (tuple): Card id of each card slot in the first round.
+        rounds (list): (card ids, moves) of each round.
+        moves (bytes): One byte per move, every round.
+        engine (TripleTriadEngine): The match as of `turn`.
+        turn (int): Number of moves played on the engine.
+    """
+
+    def __init__(self, data):
+        self.rounds = []
+        offset = 0
+        while offset < len(data):
+            if len(data) - offset < HEADER.size:
+                raise ValueError("Triple Triad log is truncated.")
+            magic, version, rules, seed, *cards = HEADER.unpack_from(data, offset)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a version %i Triple Triad log." % VERSION)
+            offset += HEADER.size
+            self.rounds.append((tuple(cards), bytes(data[offset:offset + CELLS])))
+            offset += CELLS
+        if not self.rounds:
+            raise ValueError("Triple Triad log is truncated.")
+        self.mask = rules
+        self.rules = mask_rules(rules)
+        self.seed = seed
+        self.cards = self.rounds[0][0]
+        self.moves = b"".join(moves for _, moves in self.rounds)
+        self._start_round(0, 0)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def _start_round(self, index, turn):
+        """
+        Deals a round onto a fresh engine.
+        """
+        cards = self.rounds[index][0]
+        self.engine = TripleTriadEngine()
+        self.engine.set_rules(self.mask, element_layout(self.mask, self.seed))
+        self.engine.deal(0, cards[:HAND_SIZE])
+        self.engine.deal(1, cards[HAND_SIZE:])
+        self.round = index
+        self.round_start = turn
+        self.turn = turn
+        self._captured = []
+
+    def seek(self, turn):
+        """
+        Moves the replay to just after `turn` moves have been played,
+        clamped to the start and end of the match.
+
+        Returns:
+            engine (TripleTriadEngine): The match as of that turn.
+        """
+        turn = max(0, min(turn, len(self.moves)))
+        index, start = 0, 0
+        while index < len(self.rounds) - 1 and turn > start + len(self.rounds[index][1]):
+            start += len(self.rounds[index][1])
+            index += 1
+        if index != self.round:
+            self._start_round(index, start)
+
+        engine = self.engine
+        moves = self.rounds[index][1]
+        while self.turn < turn:
+            card, cell = decode_move(moves[self.turn - start])
+            self._captured.append(engine.play(card, cell))
+            self.turn += 1
+        while self.turn > turn:
+            self.turn -= 1
+            card, cell = decode_move(moves[self.turn - start])
+            engine.undo(card, cell, self._captured.pop())
+        return engine
+
+
+def positions(data):
+    """
+    Steps through every position of a logged match, Sudden Death rounds 
+    included, in the order they were played. The engine yielded is changed
+    by the next step, so copy it to keep it.
+
+    Yields:
+        (offset, engine, move): The log length before each move, the match
+            before it and the move as (hand position, cell), then the log 
+            length, the match and None at the end of the log.
+    """
+    replay = Replay(data)
+    offset = 0
+    for cards, moves in replay.rounds:
+        engine = TripleTriadEngine()
+        engine.set_rules(replay.mask, element_layout(replay.mask, replay.seed))
+        engine.deal(0, cards[:HAND_SIZE])
+        engine.deal(1, cards[HAND_SIZE:])
+        offset += HEADER.size
+        for move in moves:
+            card, cell = decode_move(move)
+            yield offset, engine, (card, cell)
+            engine.play(card, cell)
+            offset += 1
+    yield offset, engine, None
+
+
+##############################################################################
+#
+# Archive
+#
+##############################################################################
+
+class MatchArchive:
+    """
+    The append-only file of finished match logs, and its index. Safe to 
+    use from several threads.
+
+    Args:
+        path (str): File to read and append to. Created on first append,
+                    with its index at path + ".idx".
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.index_path = path + ".idx"
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _build_index(self):
+        """
+        Loads the offset of every log from the index file, and adds any log
+        of the archive missing from it. Only called with the lock held.
+        """
+        self._index = {}
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        end = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as handle:
+                data = handle.read()
+            usable = len(data) - len(data) % INDEX_RECORD.size
+            # A log lost as it was written leaves an entry whose offset is
+            # reused by the next log, or which runs past the archive.
+            entries = {}
+            for match_id, offset, length in INDEX_RECORD.iter_unpack(data[:usable]):
+                entries[offset] = (match_id, length)
+            for offset in sorted(entries):
+                match_id, length = entries[offset]
+                if offset + length <= size:
+                    self._index[match_id] = (offset, length)
+                    end = offset + length
+
+        missing = []
+        if end < size:
+            with open(self.path, "rb") as handle:
+                handle.seek(end)
+                data = handle.read()
+            position = 0
+            while position + RECORD.size <= len(data):
+                match_id, length = RECORD.unpack_from(data, position)
+                position += RECORD.size
+                if position + length > len(data):
+                    break   # Partly written record.
+                self._index[match_id] = (end + position, length)
+                missing.append(INDEX_RECORD.pack(match_id, end + position, length))
+                position += length
+        if missing:
+            with open(self.index_path, "ab") as handle:
+                handle.write(b"".join(missing))
+
+    def append(self, match_id, log):
+        """
+        Adds the log of a finished match, and its entry in the index.
+        """
+        with self._lock:
+            with open(self.path, "ab") as handle:
+                offset = handle.tell() + RECORD.size
+                with open(self.index_path, "ab") as index:
+                    index.write(INDEX_RECORD.pack(match_id, offset, len(log)))
+                handle.write(RECORD.pack(match_id, len(log)) + bytes(log))
+            if self._index is not None:
+                self._index[match_id] = (offset, len(log))
+
+    def last_match(self):
+        """
+        Returns the id of the match archived last, or 0. Only reads the end
+        of the index, unless the archive has never been indexed.
+        """
+        with self._lock:
+            if self._index is None and not os.path.exists(self.index_path):
+                self._build_index()
+            if self._index is not None:
+                return max(self._index, default=0)
+            size = os.path.getsize(self.index_path)
+            size -= size % INDEX_RECORD.size
+            if not size:
+                return 0
+            with open(self.index_path, "rb") as handle:
+                handle.seek(size - INDEX_RECORD.size)
+                return INDEX_RECORD.unpack(handle.read(INDEX_RECORD.size))[0]
+
+    def get(self, match_id):
+        """
+        Returns the log of a finished match, or None. Loads the index on
+        first use.
+        """
+        with self._lock:
+            if self._index is None:
+                self._build_index()
+            location = self._index.get(match_id)
+        if location is None:
+            return None
+        offset, length = location
+        with open(self.path, "rb") as handle:
+            handle.seek(offset)
+            return handle.read(length)
+
+
+_ARCHIVES = {}
+
+
+def get_archive(path=DEFAULT_PATH):
+    """
+    Returns the match archive at path.
+    """
+    if path not in _ARCHIVES:
+        _ARCHIVES[path] = MatchArchive(path)
+    return _ARCHIVES[path]
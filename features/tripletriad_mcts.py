@@ -0,0 +1,287 @@
+"""
+Triple Triad Monte Carlo AI
+
+Opponent engine for Triple Triad games played without the "Open" rule,
+where the AI must not see its opponent's hand. It runs an information set
+Monte Carlo tree search (ISMCTS) over the TripleTriadEngine:
+
+    - Determinization: before each batch of simulations, the cards still in
+      the opponent's hand are replaced with plausible guesses from a
+      sampler. Cards the opponent has already played are on the board and
+      are known exactly. By default a guess can be any card: random deals
+      only hold levels 1 to 5, but hands dealt from a collection may hold
+      any level, so each level is weighted by a prior leaning towards the
+      random deals plus the levels of the cards the opponent has played.
+    - Each batch runs several simulations against the same guess, so the
+      cost of building the guess is shared. A simulation walks the tree
+      with UCB1, only considering moves that are legal in the current
+      guess, adds one new node and finishes the game with random moves.
+    - Simulations run on a scratch engine which is overwritten in place
+      from the guessed position, so a playout allocates nothing but its
+      result.
+    - The tree is kept between turns. On the next move the search works
+      out which cards were played since it last ran and continues from the
+      matching grandchild of the old root.
+
+Usage:
+    searcher = MonteCarloSearch(time_budget=0.05)
+    card, cell = searcher.choose_move(engine)
+
+In pure Python a simulation costs roughly 40 microseconds, so the default
+budget of 50ms allows a little over a thousand simulations per move.
+"""
+import math
+import random
+import time
+from features.tripletriad_engine import TripleTriadEngine, CELLS, HAND_SIZE, EMPTY
+from features.tripletriad_cards import BY_LEVEL, LEVELS
+
+# Default number of simulations and time budget per move in seconds. The
+# search stops at whichever limit is reached first.
+ITERATIONS = 2000
+TIME_BUDGET = 0.05
+# Simulations run against each guess of the hidden hand.
+BATCH_SIZE = 16
+EXPLORATION = 0.7
+
+# Maximum simulations per move at each difficulty of features/tripletriad_ai.
+DIFFICULTIES = {
+    "easy": 100,
+    "normal": 500,
+    "hard": 1000,
+    "expert": ITERATIONS,
+}
+
+
+# Weight of each card level when guessing a hidden card before the 
+# opponent has played: random deals are dealt from levels 1 to 5, but 
+# collection hands may hold any level.
+LEVEL_PRIOR = {level: 1.0 if level <= 5 else 0.2 for level in BY_LEVEL}
+# Weight added to a level, and to the levels either side of it, for each
+# card of that level the opponent has played.
+SEEN_WEIGHT = 2.0
+
+
+def level_weights(engine, opponent):
+    """
+    Returns the levels a hidden card of opponent may be and their 
+    cumulative weights, from LEVEL_PRIOR and the cards opponent has played.
+    """
+    weights = dict(LEVEL_PRIOR)
+    for cell in range(CELLS):
+        slot = engine.board[cell]
+        if slot != EMPTY and slot // HAND_SIZE == opponent:
+            level = LEVELS[engine.cards[slot]]
+            for near in (level - 1, level, level + 1):
+                if near in weights:
+                    weights[near] += SEEN_WEIGHT
+    levels = tuple(sorted(weights))
+    total, cumulative = 0.0, []
+    for level in levels:
+        total += weights[level]
+        cumulative.append(total)
+    return levels, cumulative
+
+
+def random_card(rng, weights):
+    """
+    Default sampler for hidden cards. Guesses a card id from any level, 
+    picked with weights from level_weights().
+    """
+    levels, cumulative = weights
+    level = rng.choices(levels, cum_weights=cumulative)[0]
+    return rng.choice(BY_LEVEL[level])
+
+
+class _Node:
+    """
+    A node of the search tree, reached by playing `move`.
+    """
+
+    __slots__ = ("move", "parent", "player", "children", "visits", "wins",
+                 "avails")
+
+    def __init__(self, move=None, parent=None, player=EMPTY):
+        self.move = move
+        self.parent = parent
+        # Player who made the move leading to this node.
+        self.player = player
+        self.children = {}
+        self.visits = 0
+        self.wins = 0.0
+        # Number of times this node was available for selection.
+        self.avails = 1
+
+
+class MonteCarloSearch:
+    """
+    Information set Monte Carlo tree search for hidden-hand games.
+
+    Args:
+        iterations (int, optional): Maximum simulations per move.
+        time_budget (float, optional): Maximum seconds per move.
+        batch_size (int, optional): Simulations run against each guess of
+                                    the hidden hand.
+        sampler (callable, optional): Called with rng and the opponent's
+                                      level_weights() to guess a hidden
+                                      card. Returns a card id.
+        rng (random.Random, optional): Source of randomness.
+    """
+
+    def __init__(self, iterations=ITERATIONS, time_budget=TIME_BUDGET,
+                 batch_size=BATCH_SIZE, sampler=random_card, rng=None):
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.rng = rng or random.Random()
+        self.simulations = 0
+        self._root = None
+        self._board = None
+        self._guess = TripleTriadEngine()
+        self._scratch = TripleTriadEngine()
+
+    #########################
+    # Public
+    #########################
+
+    def choose_move(self, engine, hidden=True):
+        """
+        Picks a move for the player whose turn it is.
+
+        Args:
+            engine (TripleTriadEngine): The match. It is not modified.
+            hidden (bool, optional): If True, the opponent's remaining cards
+                                     are treated as unknown.
+
+        Returns:
+            move (tuple): (hand position, cell) to play.
+        """
+        player = engine.turn
+        root = self._reuse_root(engine)
+        guess, scratch, rng = self._guess, self._scratch, self.rng
+        deadline = time.perf_counter() + self.time_budget
+
+        self.simulations = 0
+        while self.simulations < self.iterations and time.perf_counter() < deadline:
+            engine.copy_into(guess)
+            if hidden:
+                self._determinize(guess, 1 - player)
+            for _ in range(self.batch_size):
+                guess.copy_into(scratch)
+                self._simulate(root, scratch, rng)
+                self.simulations += 1
+
+        move = max(root.children.values(), key=lambda node: node.visits).move
+        self._remember(engine, root, move)
+        return move
+
+    #########################
+    # Tree Reuse
+    #########################
+
+    def _reuse_root(self, engine):
+        """
+        Returns the node for the current position from the previous search,
+        or a new root if it cannot be found.
+        """
+        root, board = self._root, self._board
+        if root is not None and board is not None:
+            # Only the opponent's reply should have been played since then.
+            played = [cell for cell in range(CELLS)
+                      if board[cell] == EMPTY and engine.board[cell] != EMPTY]
+            if len(played) == 1:
+                cell = played[0]
+                move = (engine.board[cell] % HAND_SIZE, cell)
+                node = root.children.get(move)
+                if node is not None:
+                    node.parent = None
+                    return node
+        return _Node(player=1 - engine.turn)
+
+    def _remember(self, engine, root, move):
+        """
+        Keeps the subtree below our chosen move for the next search, along
+        with the board it will be reached from.
+        """
+        node = root.children[move]
+        node.parent = None
+        self._root = node
+        self._board = list(engine.board)
+        self._board[move[1]] = engine.turn * HAND_SIZE + move[0]
+
+    #########################
+    # Simulation
+    #########################
+
+    def _determinize(self, engine, opponent):
+        """
+        Replaces the opponent's remaining cards with guesses.
+        """
+        first = opponent * HAND_SIZE
+        weights = level_weights(engine, opponent)
+        for slot in range(first, first + HAND_SIZE):
+            if engine.hand[slot]:
+                engine.set_card(slot, self.sampler(self.rng, weights))
+
+    def _simulate(self, root, engine, rng):
+        """
+        Runs one selection, expansion, playout and backpropagation.
+        """
+        node = root
+        # Selection and expansion.
+        while engine.empty:
+            moves = self._legal_moves(engine)
+            children = node.children
+            untried = [move for move in moves if move not in children]
+            if untried:
+                move = rng.choice(untried)
+                player = engine.turn
+                engine.play(*move)
+                child = children[move] = _Node(move, node, player)
+                node = child
+                break
+            best, best_score = None, -1.0
+            for move in moves:
+                child = children[move]
+                child.avails += 1
+                score = (child.wins / child.visits + EXPLORATION
+                         * math.sqrt(math.log(child.avails) / child.visits))
+                if score > best_score:
+                    best, best_score = child, score
+            engine.play(*best.move)
+            node = best
+
+        # Playout.
+        hand, board = engine.hand, engine.board
+        randrange = rng.randrange
+        while engine.empty:
+            first = engine.turn * HAND_SIZE
+            card = randrange(HAND_SIZE)
+            while not hand[first + card]:
+                card = randrange(HAND_SIZE)
+            cell = randrange(CELLS)
+            while board[cell] != EMPTY:
+                cell = randrange(CELLS)
+            engine.play(card, cell)
+
+        # Backpropagation.
+        first, second = engine.scores
+        while node is not None:
+            if first == second:
+                node.wins += 0.5
+            elif (first > second) == (node.player == 0):
+                node.wins += 1.0
+            node.visits += 1
+            node = node.parent
+
+    @staticmethod
+    def _legal_moves(engine):
+        """
+        Returns every legal (hand position, cell) move.
+        """
+        first = engine.turn * HAND_SIZE
+        hand, board = engine.hand, engine.board
+        cards = [card for card in range(HAND_SIZE) if hand[first + card]]
+        return [(card, cell) for cell in range(CELLS) if board[cell] == EMPTY
+                for card in cards]
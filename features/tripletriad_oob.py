@@ -0,0 +1,124 @@
+"""
+Triple Triad Webclient Messages
+
+Builds the structured board messages sent to webclient sessions in place of
+the text board. They are sent as the "tripletriad" OOB command through
+session.msg, and drawn by the webclient plugin in
+web/static_overrides/webclient/js/plugins/tripletriad.js. A webclient
+session only gets them once the plugin has announced itself with the
+tripletriad_client inputfunc (see server/conf/inputfuncs.py); until then it
+is sent the text board like any other session.
+
+Messages are JSON-safe dicts, given as the kwargs of the command. Each has
+a "type":
+
+    state   The whole board as the session's character sees it: names,
+            rules, cell elements, cards on the board with their owners,
+            both hands, scores and whose turn it is.
+    move    The move since the last message: the card placed and where,
+            the cells it flipped, the scores and whose turn it is. At the
+            end of a game without the Open rule it also reveals the hands.
+    end     The match has ended and its board can be put away.
+
+Every message carries the match id and "moves", the length of the match
+log when it was sent. The server keeps the last match and moves each
+session was sent, and only sends a move to a session that was sent the
+board just before it, so a client never has to put a board together from
+messages it missed. Cells are numbered 0 to 8 across from a1, and a card
+is {"id", "name", "ranks": [up, right, down, left], "element"}, or
+{"hidden": true} when face down. A card on a cell marked by the Elemental
+rule also has "modifier", +1 or -1, and its ranks are the ones the
+captures use there, so they may be 0 or 11.
+"""
+from features import tripletriad_cards as cards
+from features.tripletriad_engine import CELLS, HAND_SIZE, EMPTY
+
+HIDDEN = {"hidden": True}
+
+
+def card_data(engine, slot, cell=None):
+    """
+    Returns a card slot as sent to the webclient. A card on a cell marked
+    by the Elemental rule is sent with its ranks as changed there.
+    """
+    data = {"id": engine.cards[slot], "name": cards.NAMES[engine.cards[slot]],
+            "ranks": list(engine.card_ranks(slot)), "element": engine.elements[slot]}
+    marked = None if cell is None else engine.cell_elements[cell]
+    if marked is not None:
+        start = (slot * CELLS + cell) * 4
+        data["ranks"] = list(engine.effective[start:start + 4])
+        data["modifier"] = 1 if marked == engine.elements[slot] else -1
+    return data
+
+
+def hand_data(engine, player, hidden=False):
+    """
+    Returns a player's hand as sent to the webclient: a card, or None once
+    played, for each hand position.
+    """
+    hand = []
+    for card in range(HAND_SIZE):
+        slot = engine.hand_card(player, card)
+        if slot == EMPTY:
+            hand.append(None)
+        else:
+            hand.append(HIDDEN if hidden else card_data(engine, slot))
+    return hand
+
+
+def state_message(match_id, moves, engine, seat, hidden, names, rules, title=None):
+    """
+    Returns the message showing the whole board.
+
+    Args:
+        match_id (int): The match.
+        moves (int): Length of the match log.
+        engine (TripleTriadEngine): The match's engine.
+        seat (int): Seat of the viewer, or None for spectators.
+        hidden (tuple): For each seat, whether its hand is face down.
+        names (list): Name of the player in each seat.
+        rules (list): Game Rules of the match.
+        title (str, optional): Shown instead of whose turn it is.
+    """
+    board = []
+    for cell in range(CELLS):
+        slot = engine.board[cell]
+        if slot == EMPTY:
+            board.append(None)
+        else:
+            board.append(dict(card_data(engine, slot, cell), owner=engine.owner[cell]))
+    return {"type": "state", "match": match_id, "moves": moves, "seat": seat,
+            "names": list(names), "rules": list(rules), "title": title,
+            "elements": list(engine.cell_elements), "board": board,
+            "hands": [hand_data(engine, player, hidden[player]) for player in (0, 1)],
+            "scores": list(engine.scores), "turn": engine.turn}
+
+
+def move_message(match_id, moves, engine, card, cell, flips, title=None, reveal=False):
+    """
+    Returns the message showing the last move.
+
+    Args:
+        match_id (int): The match.
+        moves (int): Length of the match log, including the move.
+        engine (TripleTriadEngine): The match's engine, after the move.
+        card (int): Hand position the card was played from.
+        cell (int): Cell the card was played to.
+        flips (list): Cells captured by the move.
+        title (str, optional): Shown instead of whose turn it is.
+        reveal (bool, optional): Whether to send both hands face up.
+    """
+    message = {"type": "move", "match": match_id, "moves": moves,
+               "seat": engine.owner[cell], "hand": card, "cell": cell,
+               "card": card_data(engine, engine.board[cell], cell), "flips": list(flips),
+               "scores": list(engine.scores), "turn": engine.turn, "title": title}
+    if reveal:
+        message["hands"] = [hand_data(engine, player) for player in (0, 1)]
+    return message
+
+
+def end_message(match_id):
+    """
+    Returns the message ending a match.
+    """
+    return {"type": "end", "match": match_id}
@@ -0,0 +1,200 @@
+"""
+Triple Triad Regions
+
+Every region of the world plays Triple Triad under its own Game Rules, and
+players carry the rules of the region they last played in with them. When a
+match starts, the rules the challenger carries can change the local rules:
+
+    Spread   One of the carried rules the region does not have is added to
+             the region, with a chance of SPREAD_CHANCE.
+    Abolish  Otherwise, one of the region's rules the challenger does not
+             carry is removed from it, with a chance of ABOLISH_CHANCE.
+
+The match is played under the region's rules once any change is made and the
+challenger then carries those rules. As described in features/tripletriad.py,
+Same Wall is not played without Same but is still carried and can spread.
+
+Rules are bitmasks (see RULES in features/tripletriad_engine.py). Everything
+a match start needs from a (region rules, carried rules) pair, the rules
+played and the rules that could spread or be abolished, is worked out once
+and cached in ruleset(), so starting a match is a dictionary lookup and a
+couple of random draws.
+
+The regions' rules are kept by the TripleTriadManager and each character's
+carried rules in their `tripletriad_carried` Attribute. Rooms set their
+region with the `tripletriad_region` Attribute.
+
+Usage:
+    python -m features.tripletriad_regions --matches 100000 --players 50
+
+simulates players travelling between regions and playing, and reports how
+the rules spread.
+"""
+import argparse
+import json
+import random
+import sys
+from features.tripletriad_engine import RULES, RULE_BITS, rules_mask, mask_rules
+
+SPREAD_CHANCE = 0.25
+ABOLISH_CHANCE = 0.15
+
+# Starting rules of each region.
+REGION_RULES = {
+    "Balamb": ("Open",),
+    "Galbadia": ("Open", "Same"),
+    "Dollet": ("Elemental", "Random", "Sudden Death"),
+    "Trabia": ("Random", "Plus"),
+    "Centra": ("Same", "Plus", "Random"),
+    "Fisherman's Horizon": ("Elemental", "Sudden Death"),
+    "Esthar": ("Elemental", "Same Wall"),
+    "Lunar": ("Open", "Same", "Plus", "Elemental", "Same Wall", "Random", "Sudden Death"),
+}
+DEFAULT_REGION = "Balamb"
+REGION_ATTRIBUTE = "tripletriad_region"
+CARRIED_ATTRIBUTE = "tripletriad_carried"
+
+_SAME = RULE_BITS["Same"]
+_SAME_WALL = RULE_BITS["Same Wall"]
+_BITS = tuple(RULE_BITS[rule] for rule in RULES)
+
+
+def starting_rules():
+    """
+    Returns the starting {region: rules bitmask}.
+    """
+    return {region: rules_mask(rules) for region, rules in REGION_RULES.items()}
+
+
+def played_rules(rules):
+    """
+    Returns the rules actually played from a region's rules: Same Wall is
+    left out without Same.
+    """
+    if rules & _SAME_WALL and not rules & _SAME:
+        return rules ^ _SAME_WALL
+    return rules
+
+
+_RULESETS = {}
+
+
+def ruleset(region, carried):
+    """
+    Returns what can happen when a match starts under region rules with a
+    challenger carrying other rules, computed once per pair.
+
+    Args:
+        region (int): Rules bitmask of the region.
+        carried (int): Rules bitmask carried by the challenger.
+
+    Returns:
+        ruleset (tuple): (rules played if nothing changes, bits that can
+                         spread, bits that can be abolished)
+    """
+    key = (region, carried)
+    cached = _RULESETS.get(key)
+    if cached is None:
+        cached = _RULESETS[key] = (
+            played_rules(region),
+            tuple(bit for bit in _BITS if carried & bit and not region & bit),
+            tuple(bit for bit in _BITS if region & bit and not carried & bit))
+    return cached
+
+
+def start_match(region, carried, rng=random):
+    """
+    Applies spread and abolish for a match starting in a region.
+
+    Args:
+        region (int): Rules bitmask of the region.
+        carried (int): Rules bitmask carried by the challenger.
+        rng (random.Random, optional): Source of randomness.
+
+    Returns:
+        result (tuple): (new region rules, rules played, change) where change
+                        is ("spread", rule name), ("abolish", rule name) or
+                        None. The challenger now carries the new region
+                        rules.
+    """
+    played, spread, abolish = ruleset(region, carried)
+    if spread and rng.random() < SPREAD_CHANCE:
+        bit = rng.choice(spread)
+        region |= bit
+        return region, played_rules(region), ("spread", RULES[bit.bit_length() - 1])
+    if abolish and rng.random() < ABOLISH_CHANCE:
+        bit = rng.choice(abolish)
+        region ^= bit
+        return region, played_rules(region), ("abolish", RULES[bit.bit_length() - 1])
+    return region, played, None
+
+
+##############################################################################
+#
+# Propagation Simulator
+#
+##############################################################################
+
+def simulate(matches, players=50, travel=0.2, seed=None, regions=None):
+    """
+    Simulates rules spreading as players travel and play.
+
+    Each match, a random player challenges someone in their current region,
+    then moves to another random region with a chance of `travel`.
+
+    Args:
+        matches (int): Matches to play.
+        players (int, optional): Number of travelling players.
+        travel (float, optional): Chance a player moves after a match.
+        seed (int, optional): Seed for a reproducible run.
+        regions (dict, optional): Starting {region: rules bitmask}.
+
+    Returns:
+        report (dict): Final rules of each region, how many of the regions
+                       have each rule, and how many spreads and abolitions
+                       there were of each rule.
+    """
+    rng = random.Random(seed)
+    regions = dict(regions or starting_rules())
+    names = list(regions)
+    location = [rng.choice(names) for _ in range(players)]
+    carried = [regions[place] for place in location]
+    changes = {"spread": dict.fromkeys(RULES, 0), "abolish": dict.fromkeys(RULES, 0)}
+
+    for _ in range(matches):
+        player = rng.randrange(players)
+        place = location[player]
+        regions[place], _, change = start_match(regions[place], carried[player], rng)
+        carried[player] = regions[place]
+        if change:
+            changes[change[0]][change[1]] += 1
+        if rng.random() < travel:
+            location[player] = rng.choice(names)
+
+    return {
+        "regions": {place: mask_rules(rules) for place, rules in regions.items()},
+        "regions_with_rule": {rule: sum(1 for rules in regions.values() if rules & RULE_BITS[rule])
+                              for rule in RULES},
+        "changes": changes,
+        "rulesets_cached": len(_RULESETS),
+    }
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Simulate Triple Triad rules spreading.")
+    parser.add_argument("--matches", type=int, default=100000)
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--travel", type=float, default=0.2,
+                        help="Chance a player moves region after a match.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    report = simulate(args.matches, args.players, args.travel, args.seed)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Triple Triad Board Renderer
+
+Draws the Triple Triad board for each TripleTriadMatch.
+
+The board template (FORM) uses the same layout as an EvForm: each block of
+"x" characters with a capital letter in it is a cell to be filled in, and
+each "*" marks where a card's owner arrow goes. Instead of filling the form
+through EvForm for every player on every turn, the template is compiled
+once at import into a single format string with one field per line of each
+cell and one per owner arrow. A frame is then built in one str.format call.
+
+Card faces are cached by (up, right, down, left, element), so each distinct
+card is only ever drawn once. render_frames() builds the pieces shared by
+both players once and assembles both players' frames from them, plus a
+neutral frame for spectators when asked. Every spectator is sent the same
+neutral frame, so a match costs the same to draw however many watch it.
+
+For terminals that understand cursor addressing, redraw_full() and
+redraw_diff() turn frames into escape sequences: a full redraw pins the
+board to the top of the screen, with everything else scrolling in the
+region below it, and after that only the characters that changed since the
+last frame are rewritten, in place.
+"""
+from features import tripletriad_cards as cards
+from features.tripletriad_engine import CELLS, HAND_SIZE, EMPTY
+
+FORM = """
+Your Cards                        xxxxKxxxx                        Their Cards
+  xxxxx                       A       B       C                       xxxxx
+1 xxAxx       Score       ┌───────┬───────┬───────┐       Score       xxFxx 6
+  xxxxx         xUx       │*xxxxx │*xxxxx │*xxxxx │         xVx       xxxxx
+    xxxxx               1 │ xxLxx │ xxMxx │ xxNxx │                 xxxxx
+  2 xxBxx                 │ xxxxx │ xxxxx │ xxxxx │                 xxGxx 7
+    xxxxx                 ├───────┼───────┼───────┤                 xxxxx
+      xxxxx               │*xxxxx │*xxxxx │*xxxxx │               xxxxx
+    3 xxCxx             2 │ xxOxx │ xxPxx │ xxQxx │               xxHxx 8
+      xxxxx               │ xxxxx │ xxxxx │ xxxxx │               xxxxx
+        xxxxx             ├───────┼───────┼───────┤             xxxxx
+      4 xxDxx             │*xxxxx │*xxxxx │*xxxxx │             xxIxx 9
+        xxxxx           3 │ xxRxx │ xxSxx │ xxTxx │             xxxxx
+          xxxxx           │ xxxxx │ xxxxx │ xxxxx │           xxxxx
+        5 xxExx           └───────┴───────┴───────┘           xxJxx 10
+          xxxxx                                               xxxxx
+"""
+
+# Cells of the form.
+YOUR_HAND = "ABCDE"
+THEIR_HAND = "FGHIJ"
+TITLE = "K"
+BOARD = "LMNOPQRST"
+YOUR_SCORE = "U"
+THEIR_SCORE = "V"
+MARK = "*"
+
+# Owner arrows, by whether the viewer owns the card. Spectators see seat 0 
+# as the viewer.
+ARROWS = {True: "<", False: ">"}
+# The spectators' form only differs in its labels, so it shares the fields.
+SPECTATOR_FORM = FORM.replace("Your Cards", "Player One").replace("Their Cards", " Player Two")
+
+
+##############################################################################
+#
+# Template Compilation
+#
+##############################################################################
+
+def _find_cells(lines):
+    """
+    Finds each lettered block of "x" in the template.
+
+    Returns:
+        cells (dict): {letter: (top row, left column, width, height)}
+    """
+    found = {}
+    for row, line in enumerate(lines):
+        for column, letter in enumerate(line):
+            if not letter.isupper() or not (
+                    line[column - 1:column] == "x" or line[column + 1:column + 2] == "x"):
+                continue
+            left, right = column, column + 1
+            while left > 0 and line[left - 1] == "x":
+                left -= 1
+            while right < len(line) and line[right] == "x":
+                right += 1
+
+            def is_block(other):
+                return 0 <= other < len(lines) and lines[other][left:right] == "x" * (right - left)
+
+            top, bottom = row, row + 1
+            while is_block(top - 1):
+                top -= 1
+            while is_block(bottom):
+                bottom += 1
+            found[letter] = (top, left, right - left, bottom - top)
+    return found
+
+
+def compile_form(form):
+    """
+    Compiles a template into a format string.
+
+    Returns:
+        template (str): Format string with a positional field for every cell
+                        line and owner mark.
+        fields (dict): {letter: [field of each line]} for each cell.
+        widths (dict): {letter: width} for each cell.
+        marks (list): Field of each owner mark, in reading order.
+        size (int): Total number of fields.
+    """
+    lines = form.split("\n")[1:]
+    cells = _find_cells(lines)
+    owners = {}
+    for top, left, width, height in cells.values():
+        for row in range(top, top + height):
+            for column in range(left, left + width):
+                owners[(row, column)] = None
+
+    # Number fields in reading order so that str.format fills them in one pass.
+    starts = {(top + line, left): (letter, line)
+              for letter, (top, left, width, height) in cells.items()
+              for line in range(height)}
+    fields, marks = {}, []
+    parts, number = [], 0
+    for row, line in enumerate(lines):
+        column = 0
+        while column < len(line):
+            if (row, column) in starts:
+                letter, offset = starts[(row, column)]
+                top, left, width, height = cells[letter]
+                if offset == 0:
+                    fields[letter] = [None] * height
+                fields[letter][offset] = number
+                parts.append("{%i}" % number)
+                number += 1
+                column += width
+                continue
+            letter = line[column]
+            if letter == MARK:
+                marks.append(number)
+                parts.append("{%i}" % number)
+                number += 1
+            elif (row, column) in owners:
+                parts.append(" ")
+            else:
+                parts.append(letter.replace("{", "{{").replace("}", "}}"))
+            column += 1
+        parts.append("\n")
+    widths = {letter: cells[letter][2] for letter in cells}
+    return "".join(parts).rstrip("\n"), fields, widths, marks, number
+
+
+TEMPLATE, FIELDS, WIDTHS, MARKS, FIELD_COUNT = compile_form(FORM)
+SPECTATOR_TEMPLATE = compile_form(SPECTATOR_FORM)[0]
+
+
+##############################################################################
+#
+# Card Faces
+#
+##############################################################################
+
+BLANK = (" " * 5,) * 3
+# An empty cell marked with an element under the Elemental rule.
+MARKED = {element: ("     ", "  {}  ".format(glyph), "     ")
+          for element, glyph in cards.ELEMENT_GLYPHS.items()}
+MARKED[None] = BLANK
+FACE_DOWN = ("┌───┐", "|░░░|", "└───┘")
+_FACES = {}
+
+
+def card_face(up, right, down, left, element):
+    """
+    Returns the three lines of a card face, e.g. Geezard:
+        ┌ 1 ┐
+        |5 4|
+        └ 1 ┘
+    Faces are cached, so each distinct card is only drawn once.
+    """
+    key = (up, right, down, left, element)
+    face = _FACES.get(key)
+    if face is None:
+        glyphs = cards.RANK_GLYPHS
+        face = _FACES[key] = (
+            "┌ {} ┐".format(glyphs[up]),
+            "|{}{}{}|".format(glyphs[left], cards.ELEMENT_GLYPHS[element], glyphs[right]),
+            "└ {} ┘".format(glyphs[down]))
+    return face
+
+
+def slot_face(engine, slot):
+    """
+    Returns the face of the card in an engine's card slot, or a blank.
+    """
+    if slot == EMPTY:
+        return BLANK
+    base = slot * 4
+    ranks = engine.ranks
+    return card_face(ranks[base], ranks[base + 1], ranks[base + 2], ranks[base + 3],
+                     engine.elements[slot])
+
+
+##############################################################################
+#
+# Rendering
+#
+##############################################################################
+
+def _fill(values, letter, lines):
+    """
+    Writes the lines of a cell into the field values.
+    """
+    width = WIDTHS[letter]
+    for field, line in zip(FIELDS[letter], lines):
+        values[field] = line.ljust(width)[:width]
+
+
+def render_frames(engine, title=None, hidden=(False, False), neutral=None):
+    """
+    Draws the board as seen by each player.
+
+    Args:
+        engine (TripleTriadEngine): The match.
+        title (str, optional): Shown instead of whose turn it is.
+        hidden (tuple, optional): For each player, whether their opponent's
+                                  hand is face down.
+        neutral (bool, optional): If not None, also draws the board as seen
+                                  by spectators, with both hands face down 
+                                  if True.
+
+    Returns:
+        frames (list): The board as seen from seat 0 and from seat 1, then
+                       by spectators if asked for.
+    """
+    # Shared pieces.
+    board = [slot_face(engine, engine.board[cell]) for cell in range(CELLS)]
+    for cell, element in enumerate(engine.cell_elements):
+        if element is not None and engine.board[cell] == EMPTY:
+            board[cell] = MARKED[element]
+    hands = [[slot_face(engine, engine.hand_card(player, card)) for card in range(HAND_SIZE)]
+             for player in (0, 1)]
+    values = [" "] * FIELD_COUNT
+    for letter, face in zip(BOARD, board):
+        _fill(values, letter, face)
+
+    frames = []
+    for player in (0, 1):
+        opponent = 1 - player
+        for letter, face in zip(YOUR_HAND, hands[player]):
+            _fill(values, letter, face)
+        for letter, face in zip(THEIR_HAND, hands[opponent]):
+            if hidden[player] and face is not BLANK:
+                face = FACE_DOWN
+            _fill(values, letter, face)
+        if title:
+            heading = title
+        else:
+            heading = "YOUR TURN" if engine.turn == player else "OPPS TURN"
+        _fill(values, TITLE, (heading.center(WIDTHS[TITLE]),))
+        _fill(values, YOUR_SCORE, (str(engine.scores[player]).center(WIDTHS[YOUR_SCORE]),))
+        _fill(values, THEIR_SCORE, (str(engine.scores[opponent]).center(WIDTHS[THEIR_SCORE]),))
+        for field, owner in zip(MARKS, engine.owner):
+            values[field] = " " if owner == EMPTY else ARROWS[owner == player]
+        frames.append(TEMPLATE.format(*values))
+
+    if neutral is not None:
+        for letters, hand in ((YOUR_HAND, hands[0]), (THEIR_HAND, hands[1])):
+            for letter, face in zip(letters, hand):
+                _fill(values, letter, FACE_DOWN if neutral and face is not BLANK else face)
+        heading = title or ("P1'S TURN", "P2'S TURN")[engine.turn]
+        _fill(values, TITLE, (heading.center(WIDTHS[TITLE]),))
+        _fill(values, YOUR_SCORE, (str(engine.scores[0]).center(WIDTHS[YOUR_SCORE]),))
+        _fill(values, THEIR_SCORE, (str(engine.scores[1]).center(WIDTHS[THEIR_SCORE]),))
+        for field, owner in zip(MARKS, engine.owner):
+            values[field] = " " if owner == EMPTY else ARROWS[owner == 0]
+        frames.append(SPECTATOR_TEMPLATE.format(*values))
+    return frames
+
+
+##############################################################################
+#
+# Terminal Redraw
+#
+##############################################################################
+
+ESCAPE = "\x1b["
+SAVE_CURSOR = "\x1b7"
+RESTORE_CURSOR = "\x1b8"
+# Unchanged characters between two changes shorter than this are rewritten
+# rather than jumped over, as a jump costs about as much.
+JUMP_COST = 8
+# Makes the whole screen scroll again, leaving the cursor where it was.
+REDRAW_RESET = SAVE_CURSOR + ESCAPE + "r" + RESTORE_CURSOR
+
+
+def frame_height(frame):
+    """
+    Returns the number of lines in a frame.
+    """
+    return frame.count("\n") + 1
+
+
+def redraw_full(frame, screen_height):
+    """
+    Returns the escape sequence clearing the screen, drawing the frame at
+    the top and scrolling everything else below it.
+
+    Args:
+        frame (str): Frame from render_frames().
+        screen_height (int): Lines on the terminal.
+    """
+    height = frame_height(frame)
+    return "".join((ESCAPE, "r", ESCAPE, "2J", ESCAPE, "H", frame.replace("\n", "\r\n"),
+                    ESCAPE, "%i;%ir" % (height + 1, screen_height),
+                    ESCAPE, "%i;1H" % screen_height))
+
+
+def redraw_diff(old, new):
+    """
+    Returns the escape sequence rewriting a frame drawn by redraw_full() as
+    old into new, leaving the cursor where it was, or "" if nothing
+    changed. Only runs of changed characters are sent.
+    """
+    parts = []
+    for row, (before, after) in enumerate(zip(old.split("\n"), new.split("\n"))):
+        if before == after:
+            continue
+        if len(before) != len(after):
+            parts.append("%s%i;1H%s%sK" % (ESCAPE, row + 1, after, ESCAPE))
+            continue
+        column, width = 0, len(after)
+        while column < width:
+            if before[column] == after[column]:
+                column += 1
+                continue
+            start = end = column
+            while column < width:
+                if before[column] != after[column]:
+                    end = column = column + 1
+                elif column - end < JUMP_COST:
+                    column += 1
+                else:
+                    break
+            parts.append("%s%i;%iH%s" % (ESCAPE, row + 1, start + 1, after[start:end]))
+    if not parts:
+        return ""
+    return SAVE_CURSOR + "".join(parts) + RESTORE_CURSOR
@@ -0,0 +1,471 @@
+"""
+Triple Triad Batch Simulator
+
+Plays large numbers of Triple Triad games at once to answer balancing
+questions ("what is Geezard's win rate under Same+Plus?") without playing
+live games. Requires NumPy, which the game server itself does not need.
+
+Every game in a batch is played in lock step as NumPy arrays:
+
+    ranks    (games x slots x sides)  ranks of the ten cards dealt.
+    board    (games x cells)          card slot on each cell, -1 if empty.
+    owner    (games x cells)          player owning each cell, -1 if empty.
+    effect   (games x cells x sides)  ranks on the board after Elemental.
+
+Captures use the same neighbour tables as TripleTriadEngine.play in
+features/tripletriad_engine.py, and implement the Game Rules listed in
+features/tripletriad.py:
+
+    Same, Same Wall, Plus  Flip the matched opponent cards.
+    Combo                  Cards flipped by Same, Same Wall or Plus capture
+                           weaker adjacent opponent cards, and so on. Always
+                           in effect alongside Same or Plus.
+    Elemental              Cells are marked with elements at random; ranks
+                           are raised or lowered by one for basic captures
+                           and Combo, but not for Same or Plus.
+    Sudden Death           Drawn games are replayed with the cards each
+                           player owned, up to SUDDEN_DEATH_ROUNDS times.
+    Open, Random           Both policies always see both hands and every
+                           hand is dealt at random, so these have no effect.
+
+Policies:
+    random  Plays a random card on a random empty cell.
+    greedy  Plays the move capturing the most cards, ties broken at random.
+
+Usage:
+    python -m features.tripletriad_simulate --games 1000000 --rules Same Plus
+    python -m features.tripletriad_simulate --policies greedy random --compare
+"""
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from features.tripletriad_engine import (CELLS, HAND_SIZE, SLOTS, NEIGHBOURS, RULES,
+                                         ELEMENT_CHANCE, WALL_RANK)
+from features import tripletriad_cards as catalog
+from features.tripletriad_collection import TRADE_RULES
+
+POLICIES = ("random", "greedy")
+ELEMENTS = catalog.ELEMENT_NAMES
+
+SUDDEN_DEATH_ROUNDS = 5
+
+# Neighbouring cell on each side of each cell, -1 at the edge of the board.
+NEIGHBOUR_CELLS = np.full((CELLS, 4), -1, dtype=np.int64)
+for _cell, _neighbours in enumerate(NEIGHBOURS):
+    for _adjacent, _side, _opposite in _neighbours:
+        NEIGHBOUR_CELLS[_cell, _side] = _adjacent
+OPPOSITE = np.array([2, 3, 0, 1])
+# Every (cell, side, neighbour) pair, used to spread Combo captures.
+_PAIRS = [(cell, side, adjacent) for cell, neighbours in enumerate(NEIGHBOURS)
+          for adjacent, side, _ in neighbours]
+PAIR_CELL = np.array([pair[0] for pair in _PAIRS])
+PAIR_SIDE = np.array([pair[1] for pair in _PAIRS])
+PAIR_NEIGHBOUR = np.array([pair[2] for pair in _PAIRS])
+PAIR_TARGETS = np.zeros((len(_PAIRS), CELLS), dtype=np.int64)
+PAIR_TARGETS[np.arange(len(_PAIRS)), PAIR_NEIGHBOUR] = 1
+
+
+##############################################################################
+#
+# Card Pools
+#
+##############################################################################
+
+def pool_arrays(pool):
+    """
+    Converts card ids from features/tripletriad_cards.py into (names, ranks,
+    elements) arrays. Elements are numbered from 1 in the order of ELEMENTS,
+    0 for none.
+    """
+    names = [catalog.NAMES[card] for card in pool]
+    ranks = np.array([catalog.card_ranks(card) for card in pool], dtype=np.int8)
+    elements = np.array([ELEMENTS.index(catalog.ELEMENTS[card]) + 1 if catalog.ELEMENTS[card] else 0
+                         for card in pool], dtype=np.int8)
+    return names, ranks, elements
+
+
+##############################################################################
+#
+# Simulator
+#
+##############################################################################
+
+class BatchSimulator:
+    """
+    Plays batches of games under one set of rules.
+
+    Args:
+        rules (list, optional): Game Rules in effect.
+        pool (list, optional): Card ids to deal from. Defaults to every card.
+        policies (tuple, optional): Policy of the first and second player.
+        seed (int, optional): Seed for dealing, layouts and policies.
+    """
+
+    def __init__(self, rules=(), pool=None, policies=("random", "random"), seed=None):
+        for rule in rules:
+            if rule not in RULES:
+                raise ValueError("Unknown rule: %s" % rule)
+        for policy in policies:
+            if policy not in POLICIES:
+                raise ValueError("Unknown policy: %s" % policy)
+        self.rules = tuple(rules)
+        self.same = "Same" in rules
+        self.same_wall = self.same and "Same Wall" in rules
+        self.plus = "Plus" in rules
+        self.elemental = "Elemental" in rules
+        self.sudden_death = "Sudden Death" in rules
+        self.policies = tuple(policies)
+        self.rng = np.random.default_rng(seed)
+        self.names, self.pool_ranks, self.pool_elements = pool_arrays(pool or range(catalog.CARD_COUNT))
+        self.stats = Statistics(self.names)
+
+    #########################
+    # Public
+    #########################
+
+    def run(self, games, batch_size=100000):
+        """
+        Plays games in batches and adds them to self.stats.
+
+        Returns:
+            stats (Statistics): Totals over every game run so far.
+        """
+        while games > 0:
+            size = min(games, batch_size)
+            self._run_batch(size)
+            games -= size
+        return self.stats
+
+    #########################
+    # Games
+    #########################
+
+    def _run_batch(self, size):
+        """
+        Deals and plays one batch of games, including any Sudden Death.
+        """
+        cards = self.rng.integers(0, len(self.names), size=(size, SLOTS))
+        results = self._play(cards)
+
+        # Sudden Death: drawn games restart with the cards each player owned.
+        rounds = 0
+        games = np.flatnonzero(results["winner"] < 0)
+        while self.sudden_death and len(games) and rounds < SUDDEN_DEATH_ROUNDS:
+            replay = self._play(results["redeal"][games])
+            self.stats.sudden_deaths += len(games)
+            for key, values in replay.items():
+                results[key][games] = values
+            games = games[replay["winner"] < 0]
+            rounds += 1
+        self.stats.add_games(cards, results)
+
+    def _play(self, cards):
+        """
+        Plays one game per row of cards, seat 0 holding the first five.
+
+        Returns:
+            results (dict): Winner, final scores, cards that changed colour
+                            and the cards of each colour at the end, as 
+                            arrays.
+        """
+        rng = self.rng
+        size = len(cards)
+        rows = np.arange(size)
+        state = {
+            "ranks": self.pool_ranks[cards].astype(np.int16),
+            "elements": self.pool_elements[cards],
+            "board": np.full((size, CELLS), -1, dtype=np.int64),
+            "owner": np.full((size, CELLS), -1, dtype=np.int8),
+            "effect": np.zeros((size, CELLS, 4), dtype=np.int16),
+            "hand": np.ones((size, SLOTS), dtype=bool),
+            "cells": np.zeros((size, CELLS), dtype=np.int8),
+        }
+        if self.elemental:
+            marked = rng.random((size, CELLS)) < ELEMENT_CHANCE
+            state["cells"] = np.where(marked, rng.integers(1, len(ELEMENTS) + 1, (size, CELLS)),
+                                      0).astype(np.int8)
+
+        for turn in range(CELLS):
+            player = turn % 2
+            slot, cell = self._choose(state, player, self.policies[player])
+            flips = self._captures(state, rows, slot, cell, player)
+            self._place(state, rows, slot, cell, player)
+            state["owner"][flips] = player
+            self.stats.add_captures(flips)
+
+        owner, hand = state["owner"], state["hand"]
+        scores = np.stack([(owner == player).sum(1)
+                           + hand[:, player * HAND_SIZE:(player + 1) * HAND_SIZE].sum(1)
+                           for player in (0, 1)], axis=1)
+        winner = np.where(scores[:, 0] > scores[:, 1], 0,
+                          np.where(scores[:, 1] > scores[:, 0], 1, -1))
+
+        # Cards changing colour, for the Direct trade rule.
+        taken = (owner != state["board"] // HAND_SIZE).sum(1)
+
+        # Cards of each colour at the end, for Sudden Death: sort the cards
+        # on the board and still in hand by colour. In a draw each player
+        # has exactly five.
+        colour = np.concatenate([owner, np.where(hand, np.arange(SLOTS) // HAND_SIZE, 2)], 1)
+        pooled = np.concatenate([np.take_along_axis(cards, state["board"], axis=1), cards], 1)
+        order = np.argsort(colour, axis=1, kind="stable")[:, :SLOTS]
+        redeal = np.take_along_axis(pooled, order, axis=1)
+        return {"winner": winner, "scores": scores, "taken": taken, "redeal": redeal}
+
+    def _place(self, state, rows, slot, cell, player):
+        """
+        Moves a card from hand to the board.
+        """
+        state["board"][rows, cell] = slot
+        state["owner"][rows, cell] = player
+        state["hand"][rows, slot] = False
+        state["effect"][rows, cell] = state["ranks"][rows, slot] + self._modifier(state, rows, slot, cell)[:, None]
+
+    def _modifier(self, state, rows, slot, cell):
+        """
+        Returns the Elemental rank modifier of a card placed on a cell.
+        """
+        if not self.elemental:
+            return np.zeros(len(rows), dtype=np.int16)
+        marked = state["cells"][rows, cell]
+        matching = marked == state["elements"][rows, slot]
+        return np.where(marked == 0, 0, np.where(matching, 1, -1)).astype(np.int16)
+
+    #########################
+    # Captures
+    #########################
+
+    def _captures(self, state, rows, slot, cell, player):
+        """
+        Works out which cells a move captures, without making it.
+
+        Args:
+            rows (array): Game of each move. May repeat a game to evaluate
+                          several moves in it.
+            slot, cell (array): Card slot and cell of each move.
+            player (int): Player making the moves.
+
+        Returns:
+            flips (array): (moves x cells) mask of captured cells.
+        """
+        count = len(rows)
+        index = np.arange(count)
+        board = state["board"][rows]
+        owner = state["owner"][rows].copy()
+        ranks = state["ranks"]
+        placed = ranks[rows, slot]
+        placed_effect = placed + self._modifier(state, rows, slot, cell)[:, None]
+
+        # Neighbour on each side of the placed card.
+        neighbours = NEIGHBOUR_CELLS[cell]
+        wall = neighbours < 0
+        neighbours = np.where(wall, 0, neighbours)
+        neighbour_slot = np.take_along_axis(board, neighbours, axis=1)
+        occupied = ~wall & (neighbour_slot >= 0)
+        enemy = occupied & (np.take_along_axis(owner, neighbours, axis=1) == 1 - player)
+        facing = ranks[rows[:, None], np.where(occupied, neighbour_slot, 0), OPPOSITE[None, :]]
+        facing_effect = state["effect"][rows[:, None], neighbours, OPPOSITE[None, :]]
+
+        basic = enemy & (placed_effect > facing_effect)
+        special = np.zeros_like(basic)
+        if self.same:
+            equal = occupied & (placed == facing)
+            matches = equal.sum(1)
+            if self.same_wall:
+                matches += (wall & (placed == WALL_RANK)).sum(1)
+            special |= equal & enemy & (matches >= 2)[:, None]
+        if self.plus:
+            sums = np.where(occupied, placed + facing, -1 - np.arange(4))
+            paired = ((sums[:, :, None] == sums[:, None, :]).sum(2) > 1) & occupied
+            special |= paired & enemy
+
+        # Scatter into a spare column for walls, so they cannot overwrite a
+        # capture of cell 0.
+        targets = np.where(wall, CELLS, neighbours)
+        flips = np.zeros((count, CELLS + 1), dtype=bool)
+        flips[index[:, None], targets] = basic | special
+        flips = flips[:, :CELLS]
+        if not (self.same or self.plus):
+            return flips
+
+        # Combo: cards flipped by Same or Plus go on to capture.
+        frontier = np.zeros((count, CELLS + 1), dtype=bool)
+        frontier[index[:, None], targets] = special
+        frontier = frontier[:, :CELLS]
+        effect = state["effect"][rows]
+        effect[index, cell] = placed_effect
+        owner[flips] = player
+        owner[index, cell] = player
+        while frontier.any():
+            hits = (frontier[:, PAIR_CELL]
+                    & (owner[:, PAIR_NEIGHBOUR] == 1 - player)
+                    & (effect[:, PAIR_CELL, PAIR_SIDE]
+                       > effect[:, PAIR_NEIGHBOUR, OPPOSITE[PAIR_SIDE]]))
+            frontier = (hits.astype(np.int64) @ PAIR_TARGETS) > 0
+            owner[frontier] = player
+            flips |= frontier
+        return flips
+
+    #########################
+    # Policies
+    #########################
+
+    def _choose(self, state, player, policy):
+        """
+        Returns the (slot, cell) arrays of the moves chosen by a policy.
+        """
+        rng = self.rng
+        size = len(state["board"])
+        first = player * HAND_SIZE
+        hand = state["hand"][:, first:first + HAND_SIZE]
+        empty = state["board"] < 0
+        if policy == "random":
+            card = np.argmax(np.where(hand, rng.random(hand.shape), -1), axis=1)
+            cell = np.argmax(np.where(empty, rng.random(empty.shape), -1), axis=1)
+            return first + card, cell
+
+        # Greedy: count the captures of all 45 moves of every game.
+        cards = np.repeat(np.arange(HAND_SIZE), CELLS)
+        cells = np.tile(np.arange(CELLS), HAND_SIZE)
+        moves = len(cards)
+        rows = np.repeat(np.arange(size), moves)
+        flips = self._captures(state, rows, first + np.tile(cards, size), np.tile(cells, size), player)
+        score = flips.sum(1).reshape(size, moves) + rng.random((size, moves))
+        legal = hand[:, cards] & empty[:, cells]
+        best = np.argmax(np.where(legal, score, -1), axis=1)
+        return first + cards[best], cells[best]
+
+
+##############################################################################
+#
+# Statistics
+#
+##############################################################################
+
+class Statistics:
+    """
+    Running totals of simulated games.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.games = 0
+        self.first_wins = 0
+        self.second_wins = 0
+        self.draws = 0
+        self.sudden_deaths = 0
+        self.captures = 0
+        self.card_plays = np.zeros(len(names), dtype=np.int64)
+        self.card_wins = np.zeros(len(names), dtype=np.int64)
+        self.trades = dict.fromkeys(TRADE_RULES, 0)
+
+    def add_captures(self, flips):
+        """
+        Records the cells captured by one move of every game in a batch.
+        """
+        self.captures += int(flips.sum())
+
+    def add_games(self, cards, results):
+        """
+        Records the final results of a batch of games.
+
+        Args:
+            cards (array): (games x slots) cards originally dealt.
+            results (dict): Results returned by BatchSimulator._play.
+        """
+        winner, scores = results["winner"], results["scores"]
+        self.games += len(winner)
+        self.first_wins += int((winner == 0).sum())
+        self.second_wins += int((winner == 1).sum())
+        self.draws += int((winner < 0).sum())
+
+        size = len(self.names)
+        self.card_plays += np.bincount(cards.ravel(), minlength=size)
+        for player in (0, 1):
+            won = cards[winner == player, player * HAND_SIZE:(player + 1) * HAND_SIZE]
+            self.card_wins += np.bincount(won.ravel(), minlength=size)
+
+        # Cards that would change hands under each trade rule.
+        decided = winner >= 0
+        difference = np.abs(scores[:, 0] - scores[:, 1])
+        self.trades["One"] += int(decided.sum())
+        self.trades["Diff"] += int(np.minimum(difference[decided], HAND_SIZE).sum())
+        self.trades["Direct"] += int(results["taken"].sum())
+        self.trades["All"] += int(decided.sum()) * HAND_SIZE
+
+    def summary(self, top=10, card=None):
+        """
+        Returns the totals as a dict suitable for printing or JSON.
+        """
+        games = max(self.games, 1)
+        plays = np.maximum(self.card_plays, 1)
+        rates = self.card_wins / plays
+        order = np.argsort(-rates)
+        cards = {self.names[index]: {"plays": int(self.card_plays[index]),
+                                     "win_rate": round(float(rates[index]), 4)}
+                 for index in order[:top]}
+        if card is not None:
+            index = [name.lower() for name in self.names].index(card.lower())
+            cards[self.names[index]] = {"plays": int(self.card_plays[index]),
+                           "win_rate": round(float(rates[index]), 4)}
+        return {
+            "games": self.games,
+            "first_player_win_rate": round(self.first_wins / games, 4),
+            "second_player_win_rate": round(self.second_wins / games, 4),
+            "draw_rate": round(self.draws / games, 4),
+            "sudden_deaths": self.sudden_deaths,
+            "captures_per_game": round(self.captures / games, 3),
+            "cards_traded_per_game": {rule: round(count / games, 3)
+                                      for rule, count in self.trades.items()},
+            "cards": cards,
+        }
+
+
+##############################################################################
+#
+# Command Line
+#
+##############################################################################
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Simulate Triple Triad games in bulk.")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=100000)
+    parser.add_argument("--rules", nargs="*", default=[], choices=RULES)
+    parser.add_argument("--policies", nargs=2, default=["random", "random"], choices=POLICIES)
+    parser.add_argument("--card", default=None, help="Always report this card.")
+    parser.add_argument("--levels", nargs="*", type=int, default=list(catalog.BY_LEVEL),
+                        help="Only deal cards of these levels.")
+    parser.add_argument("--top", type=int, default=10, help="Report the best N cards.")
+    parser.add_argument("--compare", action="store_true",
+                        help="Also run every rule on its own for per-rule totals.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    rulesets = {"+".join(args.rules) or "Basic": args.rules}
+    if args.compare:
+        rulesets["Basic"] = []
+        for rule in ("Same", "Plus", "Elemental", "Sudden Death"):
+            rulesets[rule] = [rule]
+        rulesets["Same+Same Wall"] = ["Same", "Same Wall"]
+        rulesets["Same+Plus"] = ["Same", "Plus"]
+
+    report = {}
+    for name, rules in rulesets.items():
+        pool = [card for level in args.levels for card in catalog.BY_LEVEL[level]]
+        simulator = BatchSimulator(rules, pool, policies=args.policies, seed=args.seed)
+        start = time.perf_counter()
+        stats = simulator.run(args.games, args.batch)
+        report[name] = stats.summary(args.top, args.card)
+        report[name]["games_per_minute"] = int(args.games / (time.perf_counter() - start) * 60)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
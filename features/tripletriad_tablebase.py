@@ -0,0 +1,395 @@
+"""
+Triple Triad Endgame Tablebase
+
+Once most of the board is filled, few enough moves remain that a position
+can be solved exactly. A Tablebase answers late-game positions in two ways:
+
+    - Positions with at most SOLVE_EMPTY empty cells are solved exactly
+      when an AI first asks for a move in one, under the match's own rules
+      and element layout, in a few milliseconds. The position and every
+      position below it are cached, so the rest of that match's endgame,
+      and any later match reaching the same cards, costs a lookup.
+    - Positions with more empty cells can be solved offline for known
+      hands, such as the decks of NPCs, and stored in a file which the
+      server memory-maps and probes without searching. With 110 cards a
+      random deal is unlikely to come up in play, so the file is only worth
+      generating for hands that will.
+
+File layout:
+    header  - magic, version, maximum empty cells covered, rules and table
+              size (see HEADER).
+    records - an open-addressed hash table of RECORD entries: position key,
+              final score difference for the player to move under perfect
+              play, and the best move.
+
+The position key is the TripleTriadEngine's 64-bit key, which depends on
+the cards rather than where they sit in a hand, so a stored position is
+found whichever hand positions the cards were dealt to. For the same reason
+the best move is stored as a cell and the index of the card among the
+mover's remaining cards sorted by key, and translated back to a hand
+position when probed.
+
+Usage:
+    python -m features.tripletriad_tablebase --deck Geezard Funguar "Bite Bug"
+        "Red Bat" Blobra --deals 200 --openings 50 --filled 3 --rules Same
+    python -m features.tripletriad_tablebase --hands npc_hands.json
+
+--deck solves an NPC's five cards against random hands, in both seats.
+--hands takes a JSON list of [hand, hand] pairs of card names or ids. A
+file is generated under one set of capture rules, given with --rules; it
+cannot cover the Elemental rule, whose layout changes with every match.
+
+A probe is a handful of reads at a fixed offset in the mapped file, or a
+dictionary lookup in the cache of solved positions. The AlphaBetaSearch in
+features/tripletriad_ai.py takes a tablebase, plays its root moves from
+best_move(), which solves the position if needed, and probes it for every
+other position it reaches.
+"""
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+from multiprocessing import Pool
+from features.tripletriad_engine import (TripleTriadEngine, CELLS, HAND_SIZE, CAPTURE_RULES,
+                                         RULES, RULE_BITS, rules_mask)
+from features.tripletriad_cards import random_hand, find
+
+MAGIC = b"TTTB"
+VERSION = 1
+# magic, version, maximum empty cells, rules, number of records in the table
+HEADER = struct.Struct("<4sHBxIQ")
+# position key, score difference, move (card index << 4 | cell)
+RECORD = struct.Struct("<QbB")
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "server", "tripletriad_tablebase.bin")
+DEFAULT_FILLED = 5
+# Most empty cells of a position solved when probed. Solving five empty 
+# cells takes up to about 30ms, six up to about half a second.
+SOLVE_EMPTY = 5
+# Solved positions cached before the cache is cleared.
+SOLVED_SIZE = 500000
+
+
+##############################################################################
+#
+# Moves
+#
+##############################################################################
+
+def encode_move(engine, card, cell):
+    """
+    Packs a move into a byte that does not depend on hand order.
+    """
+    first = engine.turn * HAND_SIZE
+    keys = sorted(engine.hand_keys[slot] for slot in range(first, first + HAND_SIZE)
+                  if engine.hand[slot])
+    return keys.index(engine.hand_keys[first + card]) << 4 | cell
+
+
+def decode_move(engine, move):
+    """
+    Unpacks a move byte into a (hand position, cell) for the current hand.
+    """
+    first = engine.turn * HAND_SIZE
+    slots = sorted((engine.hand_keys[slot], slot) for slot in range(first, first + HAND_SIZE)
+                   if engine.hand[slot])
+    return slots[move >> 4][1] - first, move & 15
+
+
+##############################################################################
+#
+# Probing
+#
+##############################################################################
+
+def _group(engine):
+    """
+    Returns the key of the cache of positions solved under the same capture
+    rules and element layout as the engine.
+    """
+    return engine.rules & CAPTURE_RULES, tuple(engine.cell_elements)
+
+
+class Tablebase:
+    """
+    Solved late-game positions: a memory-mapped tablebase file, if one has
+    been generated, and a cache of positions solved when probed.
+
+    Args:
+        path (str, optional): File written by generate(). Positions are 
+                              only solved when probed if not given or if 
+                              there is no file there.
+        solve_empty (int, optional): Most empty cells of a position solved 
+                                     when probed.
+    """
+
+    def __init__(self, path=None, solve_empty=SOLVE_EMPTY):
+        self._file = self.data = None
+        self.max_empty, self.rules, self.mask = -1, None, 0
+        if path is not None and os.path.exists(path):
+            self._file = open(path, "rb")
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self.max_empty, self.rules, size = HEADER.unpack_from(self.data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("%s is not a version %i tablebase." % (path, VERSION))
+            self.mask = size - 1
+        self.solve_empty = solve_empty
+        # {(capture rules, cell elements): {position key: (value, move byte)}}
+        self.solved = {}
+        self.solved_count = 0
+
+    def probe(self, engine, solved=True):
+        """
+        Looks up the current position, without solving it.
+
+        Args:
+            engine (TripleTriadEngine): The position.
+            solved (bool, optional): Also look among the positions solved 
+                                     so far. Which those are depends on
+                                     every probe before, so a search that
+                                     must be repeatable leaves them out.
+
+        Returns:
+            result (tuple or None): (score difference, move byte) for the
+                                    player to move, or None if the position
+                                    is not in the file or solved yet.
+        """
+        key = engine.key
+        if engine.empty <= self.max_empty and engine.rules & CAPTURE_RULES == self.rules:
+            index = key & self.mask
+            while True:
+                stored, value, move = RECORD.unpack_from(self.data,
+                                                         HEADER.size + index * RECORD.size)
+                if stored == key:
+                    return value, move
+                if not stored:
+                    break
+                index = (index + 1) & self.mask
+        if solved and engine.empty <= self.solve_empty:
+            group = self.solved.get(_group(engine))
+            if group is not None:
+                return group.get(key)
+        return None
+
+    def solve(self, engine):
+        """
+        Solves the current position exactly and caches it with every 
+        position below it.
+
+        Returns:
+            result (tuple): (score difference, move byte) for the player to
+                            move.
+        """
+        if self.solved_count > SOLVED_SIZE:
+            self.solved.clear()
+            self.solved_count = 0
+        group = self.solved.setdefault(_group(engine), {})
+        before = len(group)
+        solve(engine, group)
+        self.solved_count += len(group) - before
+        return group[engine.key]
+
+    def best_move(self, engine):
+        """
+        Returns the perfect (hand position, cell) move for the current
+        position, solving it if it has at most solve_empty empty cells, or
+        None if it is not covered.
+        """
+        result = self.probe(engine)
+        if result is None and 0 < engine.empty <= self.solve_empty:
+            result = self.solve(engine)
+        if result is None:
+            return None
+        return decode_move(engine, result[1])
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self._file.close()
+            self._file = self.data = None
+
+
+_TABLEBASES = {}
+
+
+def get_tablebase(path=DEFAULT_PATH):
+    """
+    Returns the tablebase using the file at path, mapping it on first use. 
+    Positions are still solved when probed if no file has been generated.
+    """
+    if path not in _TABLEBASES:
+        _TABLEBASES[path] = Tablebase(path)
+    return _TABLEBASES[path]
+
+
+##############################################################################
+#
+# Generation
+#
+##############################################################################
+
+def solve(engine, table):
+    """
+    Solves the position exactly, adding it and every position below it to
+    table as {key: (score difference, move byte)}.
+
+    Returns:
+        value (int): Final score difference for the player to move.
+    """
+    entry = table.get(engine.key)
+    if entry is not None:
+        return entry[0]
+    player = engine.turn
+    if not engine.empty:
+        return engine.scores[player] - engine.scores[1 - player]
+
+    best_value, best_move = None, None
+    for card in engine.available_cards():
+        for cell in engine.available_cells():
+            captured = engine.play(card, cell)
+            value = -solve(engine, table)
+            engine.undo(card, cell, captured)
+            if best_value is None or value > best_value:
+                best_value, best_move = value, (card, cell)
+    table[engine.key] = (best_value, encode_move(engine, *best_move))
+    return best_value
+
+
+def _solve_deal(arguments):
+    """
+    Worker: deals a random match from seed and solves the endgames of
+    `openings` random openings played to `filled` cells.
+    """
+    seed, openings, filled, hands, rules = arguments
+    rng = random.Random(seed)
+    if hands is None:
+        hands = [random_hand(rng) for _ in range(2)]
+    engine = TripleTriadEngine()
+    engine.set_rules(rules)
+    for player, cards in enumerate(hands):
+        engine.deal(player, cards)
+
+    table = {}
+    for _ in range(openings):
+        moves = []
+        while CELLS - engine.empty < filled:
+            move = rng.choice(engine.available_cards()), rng.choice(engine.available_cells())
+            moves.append((move, engine.play(*move)))
+        solve(engine, table)
+        for move, captured in reversed(moves):
+            engine.undo(*move, captured)
+    return table
+
+
+def generate(path, deals=100, openings=50, filled=DEFAULT_FILLED, hands=None,
+             seed=0, processes=None, rules=(), deck=None):
+    """
+    Solves late-game positions on every CPU core and writes a tablebase.
+
+    Args:
+        path (str): File to write.
+        deals (int, optional): Number of random deals to solve, if hands is
+                               not given.
+        openings (int, optional): Random openings solved per deal.
+        filled (int, optional): Cells filled before positions are solved.
+        hands (list, optional): Pairs of five-card hands, as card ids, to
+                                solve instead of random deals.
+        seed (int, optional): Seed of the first random deal.
+        processes (int, optional): Worker processes. Defaults to all cores.
+        rules (list, optional): Game Rules the positions are solved under.
+                                Only the capture rules matter, and the 
+                                Elemental rule cannot be covered.
+        deck (list, optional): Five card ids, e.g. an NPC's deck, to solve
+                               against `deals` random hands, taking turns 
+                               at each seat.
+
+    Returns:
+        count (int): Number of positions written.
+    """
+    capture_rules = rules_mask(rules) & CAPTURE_RULES
+    if capture_rules & RULE_BITS["Elemental"]:
+        raise ValueError("A tablebase file cannot cover the Elemental rule.")
+    if deck is not None:
+        rng = random.Random(seed)
+        hands = []
+        for index in range(deals):
+            opponent = random_hand(rng)
+            hands.append([deck, opponent] if index % 2 == 0 else [opponent, deck])
+    if hands is not None:
+        jobs = [(seed + index, openings, filled, pair, capture_rules)
+                for index, pair in enumerate(hands)]
+    else:
+        jobs = [(seed + index, openings, filled, None, capture_rules) for index in range(deals)]
+
+    records = {}
+    with Pool(processes) as pool:
+        for table in pool.imap_unordered(_solve_deal, jobs):
+            records.update(table)
+    records.pop(0, None)
+
+    # Keep the table at most half full so probes stay short.
+    size = 1
+    while size < len(records) * 2:
+        size <<= 1
+    mask = size - 1
+    data = bytearray(HEADER.size + size * RECORD.size)
+    HEADER.pack_into(data, 0, MAGIC, VERSION, CELLS - filled, capture_rules, size)
+    for key, (value, move) in records.items():
+        index = key & mask
+        while RECORD.unpack_from(data, HEADER.size + index * RECORD.size)[0]:
+            index = (index + 1) & mask
+        RECORD.pack_into(data, HEADER.size + index * RECORD.size, key, value, move)
+
+    with open(path, "wb") as handle:
+        handle.write(data)
+    return len(records)
+
+
+def card_id(card):
+    """
+    Returns the card id of a card name or id.
+    """
+    if isinstance(card, int) or str(card).isdigit():
+        return int(card)
+    found = find(card)
+    if found is None:
+        raise ValueError("There is no card called %s." % card)
+    return found
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Generate a Triple Triad endgame tablebase.")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH)
+    parser.add_argument("--deals", type=int, default=100)
+    parser.add_argument("--openings", type=int, default=50)
+    parser.add_argument("--filled", type=int, default=DEFAULT_FILLED)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--rules", nargs="*", default=[], choices=RULES,
+                        help="Game Rules to solve under. Only capture rules matter.")
+    parser.add_argument("--deck", nargs=HAND_SIZE, default=None, metavar="CARD",
+                        help="An NPC's five cards, solved against random hands.")
+    parser.add_argument("--hands", default=None,
+                        help="JSON file of [hand, hand] pairs of card names or ids.")
+    args = parser.parse_args(argv)
+    hands = deck = None
+    if args.hands:
+        with open(args.hands) as handle:
+            hands = [[[card_id(card) for card in hand] for hand in pair]
+                     for pair in json.load(handle)]
+    if args.deck:
+        deck = [card_id(card) for card in args.deck]
+    count = generate(args.path, deals=args.deals, openings=args.openings,
+                     filled=args.filled, hands=hands, seed=args.seed, 
+                     processes=args.processes, rules=args.rules, deck=deck)
+    print("Wrote %i positions to %s" % (count, args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Triple Triad Evaluator Training
+
+Fits the weights of the LinearEvaluator in features/tripletriad_eval.py
+from self-play. Requires NumPy, which the game server itself does not need.
+
+    1. Games are played between two greedy AIs, each playing the move that
+       captures the most cards, or a random move with a chance of EPSILON
+       so that the positions seen vary. The Game Rules of each game are
+       drawn at random from the capture rules unless given.
+    2. Every position before a move is recorded as its feature vector, with
+       the final score difference of the game, from the point of view of
+       the player to move, as the target.
+    3. The weights are fitted by ridge regression on all but a held out
+       part of the positions, which is used to compare the fit with scoring
+       positions by their score difference alone.
+    4. Optionally, a search using the fitted evaluator plays a search 
+       using the score difference, over the same deals with both seatings,
+       as a check of playing strength. Both searches are given the same
+       budget, the difficulty's node budget or a time budget, so that the
+       cost of the evaluation is counted, and the speed of each search in
+       nodes a second is reported.
+
+Usage:
+    python -m features.tripletriad_train --games 20000 --match 200
+    python -m features.tripletriad_train --match 200 --match-time 0.05
+    python -m features.tripletriad_train --rules Same Plus --output eval.json
+
+The weights are saved to server/tripletriad_eval.json by default, where the
+AI workers load them. The report is written as JSON.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import numpy as np
+from features.tripletriad_engine import TripleTriadEngine, RULES, rules_mask, element_layout
+from features.tripletriad_cards import random_hand
+from features.tripletriad_ai import AlphaBetaSearch, DIFFICULTIES, greedy_move
+from features.tripletriad_eval import FEATURES, DEFAULT_PATH, LinearEvaluator, features
+
+EPSILON = 0.2
+RIDGE = 1.0
+HOLDOUT = 0.1
+# Rules drawn at random for each game, each with an even chance.
+RANDOM_RULES = ("Same", "Same Wall", "Plus", "Elemental")
+MATCH_DIFFICULTY = "expert"
+
+
+def deal(rng, rules=None):
+    """
+    Returns a freshly dealt engine under rules, or under random rules.
+    """
+    if rules is None:
+        rules = [rule for rule in RANDOM_RULES if rng.random() < 0.5]
+    mask = rules_mask(rules)
+    engine = TripleTriadEngine()
+    engine.set_rules(mask, element_layout(mask, rng.getrandbits(32)))
+    engine.deal(0, random_hand(rng))
+    engine.deal(1, random_hand(rng))
+    return engine
+
+
+##############################################################################
+#
+# Self-Play
+#
+##############################################################################
+
+def self_play(games, rng, rules=None, epsilon=EPSILON):
+    """
+    Plays games between greedy AIs and records every position.
+
+    Returns:
+        positions (numpy.ndarray): Feature vector of each position.
+        targets (numpy.ndarray): Final score difference for the player to
+                                 move in each position.
+    """
+    rows, targets = [], []
+    for _ in range(games):
+        engine = deal(rng, rules)
+        movers = []
+        while not engine.is_over():
+            rows.append(features(engine))
+            movers.append(engine.turn)
+            if rng.random() < epsilon:
+                move = rng.choice(engine.available_cards()), rng.choice(engine.available_cells())
+            else:
+                move = greedy_move(engine, rng)
+            engine.play(*move)
+        difference = engine.scores[0] - engine.scores[1]
+        targets.extend(difference if mover == 0 else -difference for mover in movers)
+    return np.array(rows, dtype=np.float64), np.array(targets, dtype=np.float64)
+
+
+##############################################################################
+#
+# Fitting
+#
+##############################################################################
+
+def fit(positions, targets, ridge=RIDGE):
+    """
+    Returns ridge regression weights predicting targets from positions. The
+    bias, the first feature, is not penalised.
+    """
+    penalty = np.eye(positions.shape[1]) * ridge
+    penalty[0, 0] = 0.0
+    return np.linalg.solve(positions.T @ positions + penalty, positions.T @ targets)
+
+
+def r_squared(predicted, targets):
+    """
+    Returns the fraction of the variance of targets explained.
+    """
+    residual = np.sum((targets - predicted) ** 2)
+    total = np.sum((targets - targets.mean()) ** 2)
+    return 1.0 - residual / total if total else 0.0
+
+
+def play_match(evaluator, games, rng, rules=None, difficulty=MATCH_DIFFICULTY,
+               time_budget=None):
+    """
+    Plays a search using the evaluator against one using the score
+    difference, over the same deals with both seatings. Both searches have
+    the difficulty's node budget, or time_budget seconds a move if given.
+
+    Returns:
+        results (dict): Wins, draws and losses of the evaluator, and the
+                        nodes a second searched with and without it.
+    """
+    results = {"wins": 0, "draws": 0, "losses": 0}
+    nodes, seconds = [0, 0], [0.0, 0.0]
+    budgets = ({"time_budget": math.inf} if time_budget is None
+               else {"time_budget": time_budget, "node_budget": math.inf})
+    for _ in range(games):
+        dealt = deal(rng, rules)
+        for seat in (0, 1):
+            engine = dealt.copy()
+            searchers = [AlphaBetaSearch(difficulty, rng=random.Random(0), **budgets)
+                         for _ in (0, 1)]
+            searchers[seat].evaluator = evaluator
+            while not engine.is_over():
+                searcher = searchers[engine.turn]
+                start = time.perf_counter()
+                move = searcher.choose_move(engine)
+                # Index 0 is the evaluator's search.
+                side = 0 if engine.turn == seat else 1
+                seconds[side] += time.perf_counter() - start
+                nodes[side] += searcher.nodes
+                engine.play(*move)
+            winner = engine.winner()
+            if winner is None:
+                results["draws"] += 1
+            elif winner == seat:
+                results["wins"] += 1
+            else:
+                results["losses"] += 1
+    results["budget"] = ("%i nodes" % DIFFICULTIES[difficulty]["nodes"]
+                         if time_budget is None else "%g seconds" % time_budget)
+    results["nodes_per_second"] = nodes[0] / seconds[0] if seconds[0] else 0.0
+    results["baseline_nodes_per_second"] = nodes[1] / seconds[1] if seconds[1] else 0.0
+    return results
+
+
+def train(games, seed=0, rules=None, ridge=RIDGE, match=0, match_difficulty=MATCH_DIFFICULTY,
+          match_time=None):
+    """
+    Plays self-play games, fits the evaluator and reports on it.
+
+    Returns:
+        evaluator (LinearEvaluator): The fitted evaluator.
+        report (dict): Positions used, fit on the held out positions and
+                       the weight of each feature.
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    positions, targets = self_play(games, rng, rules)
+    played = time.perf_counter() - start
+
+    order = np.random.default_rng(seed).permutation(len(targets))
+    held = order[:int(len(order) * HOLDOUT)]
+    used = order[len(held):]
+    weights = fit(positions[used], targets[used], ridge)
+    # Scoring by the score difference alone, as the search does without an
+    # evaluator, is the second feature.
+    baseline = fit(positions[used][:, :2], targets[used], ridge)
+
+    evaluator = LinearEvaluator(weights.tolist())
+    report = {
+        "games": games, "positions": len(targets), "seconds_playing": played,
+        "holdout_r_squared": r_squared(positions[held] @ weights, targets[held]),
+        "baseline_r_squared": r_squared(positions[held][:, :2] @ baseline, targets[held]),
+        "weights": dict(zip(FEATURES, weights.tolist())),
+    }
+    if match:
+        report["match"] = play_match(evaluator, match, rng, rules, match_difficulty, 
+                                     match_time)
+    return evaluator, report
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(description="Fit the Triple Triad position evaluator.")
+    parser.add_argument("--games", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rules", nargs="*", default=None, choices=RULES,
+                        help="Rules of every game. Random capture rules if not given.")
+    parser.add_argument("--ridge", type=float, default=RIDGE)
+    parser.add_argument("--match", type=int, default=0,
+                        help="Deals to play the fitted evaluator against the score difference.")
+    parser.add_argument("--match-difficulty", default=MATCH_DIFFICULTY,
+                        choices=[level for level in DIFFICULTIES if level != "random"],
+                        help="Difficulty of both searches in the match.")
+    parser.add_argument("--match-time", type=float, default=None,
+                        help="Seconds a move for both searches in the match, instead of "
+                             "the difficulty's node budget.")
+    parser.add_argument("--output", default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    evaluator, report = train(args.games, args.seed, args.rules, args.ridge, args.match,
+                              args.match_difficulty, args.match_time)
+    evaluator.save(args.output)
+    report["output"] = args.output
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Triple Triad AI Workers
+
+Runs NPC move decisions in a pool of worker processes so that no search
+ever runs on the Twisted reactor, however many NPCs are thinking at once.
+
+    - A decision is requested with the match's log (see
+      features/tripletriad_log.py), a few dozen bytes, and returns a 
+      Deferred which fires on the reactor with the (hand position, cell) 
+      to play and whether it is the fallback move. The worker searches the position at the end of the log, 
+      bounded by nodes or simulations rather than time and seeded from the
+      log, so the decision can be made again from the archived log.
+    - Every decision of a match goes to the same worker, which keeps the
+      match's searcher between moves (see MatchAI in
+      features/tripletriad_ai.py), so the transposition table or the Monte
+      Carlo tree built for one move is reused for the next.
+    - Requests made during the same reactor tick are batched: each worker
+      is sent its share in one job, so ten NPCs moving at once cost a
+      handful of round trips rather than ten.
+    - Every decision has a deadline. If the workers have not answered by
+      then, or the pool has broken, the Deferred fires with a fallback move,
+      the move capturing the most cards outright, which is cheap enough to
+      work out on the reactor. A late answer is ignored. The match logs
+      the fallback move with the FALLBACK flag, so that a re-run of the
+      match knows the AI did not choose it.
+
+Workers are started with "spawn", so they share no database connections or
+threads with the server. They only import the AI modules, which need
+neither Twisted nor Evennia. The workers are started and warmed up, with
+the endgame tablebase and the fitted evaluator loaded, when the server
+starts, so the first decisions are not lost to their start-up, and they
+are shut down when the server stops.
+
+The `tt hint` command's hints are worked out by the match's worker as 
+well, so a hint never searches on the reactor either.
+
+Usage:
+    get_ai_service().start()
+    deferred = get_ai_service().request(match_id, seat, engine, log, "hard", hidden=False)
+    deferred.addCallback(lambda result: ...)   # ((hand position, cell), fallback)
+    deferred = get_ai_service().hint(match_id, engine, depth)
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+from evennia.utils import logger
+from features.tripletriad_engine import TripleTriadEngine
+from features.tripletriad_ai import decide, warm_up, hint_state, greedy_move
+
+# Worker processes, leaving a core for the server.
+WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+# Seconds a decision may take before the fallback move is played. Well
+# above the slowest difficulty's search budget.
+DEADLINE = 1.0
+
+
+##############################################################################
+#
+# Decision Service
+#
+##############################################################################
+
+class _Decision:
+    """
+    A decision waiting for its move.
+    """
+
+    __slots__ = ("request", "state", "deferred", "timer", "done")
+
+    def __init__(self, request, state, deferred):
+        self.request = request
+        self.state = state
+        self.deferred = deferred
+        self.timer = None
+        self.done = False
+
+
+class AIService:
+    """
+    Hands NPC decisions to the worker processes. Each worker is a pool of
+    its own, so a match's decisions can always be sent to the same one.
+
+    Args:
+        workers (int, optional): Worker processes. They are started by
+                                 start(), or else on the first request.
+        deadline (float, optional): Seconds before a decision falls back.
+    """
+
+    def __init__(self, workers=WORKERS, deadline=DEADLINE):
+        self.workers = workers
+        self.deadline = deadline
+        self.pools = [None] * workers
+        self.pending = []
+        self._flush_call = None
+
+    def start(self):
+        """
+        Starts every worker and has it load the AI's data files. Called
+        when the server starts.
+        """
+        for index in range(self.workers):
+            try:
+                self._get_pool(index).submit(warm_up)
+            except Exception:
+                logger.log_trace("Triple Triad AI workers failed to start.")
+                self.pools[index] = None
+
+    def request(self, match_id, seat, engine, log, difficulty, hidden=False):
+        """
+        Asks for a move for the player to move.
+
+        Args:
+            match_id (int): The match, which decides the worker.
+            seat (int): The AI's seat, 0 or 1.
+            engine (TripleTriadEngine): The match, for the fallback move.
+            log (bytes): The match log, which is what is sent.
+            difficulty (str): AI difficulty, see features/tripletriad_ai.py.
+            hidden (bool, optional): Whether the opponent's hand is hidden.
+
+        Returns:
+            deferred (Deferred): Fires with ((hand position, cell), fallback),
+                                 fallback being True for the fallback move.
+        """
+        decision = _Decision((match_id, seat, bytes(log), difficulty, hidden), 
+                             engine.pack(), defer.Deferred())
+        decision.timer = reactor.callLater(self.deadline, self._resolve, decision, None)
+        self.pending.append(decision)
+        if self._flush_call is None:
+            self._flush_call = reactor.callLater(0, self._flush)
+        return decision.deferred
+
+    def _get_pool(self, index):
+        """
+        Returns a worker, starting it if needed.
+        """
+        if self.pools[index] is None:
+            self.pools[index] = ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("spawn"))
+        return self.pools[index]
+
+    def _flush(self):
+        """
+        Sends the decisions requested this tick to their matches' workers, 
+        one job per worker.
+        """
+        self._flush_call = None
+        pending, self.pending = self.pending, []
+        batches = {}
+        for decision in pending:
+            batches.setdefault(decision.request[0] % self.workers, []).append(decision)
+        for index, batch in batches.items():
+            try:
+                future = self._get_pool(index).submit(
+                    decide, [decision.request for decision in batch])
+            except Exception:
+                # The worker has broken. Fall back now and start a new one
+                # for the next request.
+                logger.log_trace("Triple Triad AI workers failed.")
+                self.pools[index] = None
+                for decision in batch:
+                    self._resolve(decision, None)
+                continue
+            future.add_done_callback(
+                lambda future, batch=batch: reactor.callFromThread(self._finished, batch, future))
+
+    def _finished(self, batch, future):
+        """
+        Called on the reactor when a worker has finished a batch.
+        """
+        try:
+            moves = future.result()
+        except Exception as error:
+            logger.log_err("Triple Triad AI decision failed: %s" % error)
+            moves = [None] * len(batch)
+        for decision, move in zip(batch, moves):
+            self._resolve(decision, move)
+
+    def _resolve(self, decision, move):
+        """
+        Fires a decision's Deferred with its move, or the fallback move if
+        move is None. Only the first answer counts.
+        """
+        if decision.done:
+            return
+        decision.done = True
+        if decision.timer is not None and decision.timer.active():
+            decision.timer.cancel()
+        fallback = move is None
+        if fallback:
+            logger.log_warn("Triple Triad AI decision for match %i missed its deadline; "
+                            "playing the fallback move." % decision.request[0])
+            move = greedy_move(TripleTriadEngine.unpack(decision.state))
+        decision.deferred.callback((move, fallback))
+
+    def hint(self, match_id, engine, depth):
+        """
+        Asks the match's worker to score every move of the player to move,
+        see hint() in features/tripletriad_ai.py.
+
+        Args:
+            match_id (int): The match, which decides the worker.
+            engine (TripleTriadEngine): The match. Only a snapshot is sent.
+            depth (int): Plies to search.
+
+        Returns:
+            deferred (Deferred): Fires with the scored moves, or fails if
+                                 the worker does.
+        """
+        index = match_id % self.workers
+        try:
+            future = self._get_pool(index).submit(hint_state, engine.pack(), depth)
+        except Exception:
+            self.pools[index] = None
+            return defer.fail()
+        deferred = defer.Deferred()
+        future.add_done_callback(
+            lambda future: reactor.callFromThread(self._hinted, deferred, future))
+        return deferred
+
+    def _hinted(self, deferred, future):
+        """
+        Called on the reactor when a worker has worked out a hint.
+        """
+        try:
+            scores = future.result()
+        except Exception:
+            deferred.errback(Failure())
+            return
+        deferred.callback(scores)
+
+    def shutdown(self):
+        """
+        Stops the workers. Decisions still waiting fall back when their
+        deadline passes.
+        """
+        for index, pool in enumerate(self.pools):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self.pools[index] = None
+
+
+_SERVICE = []
+
+
+def get_ai_service():
+    """
+    Returns the process-wide AIService.
+    """
+    if not _SERVICE:
+        _SERVICE.append(AIService())
+    return _SERVICE[0]
+
+
+def shutdown_ai_service():
+    """
+    Stops the workers, if any were started.
+    """
+    if _SERVICE:
+        _SERVICE[0].shutdown()
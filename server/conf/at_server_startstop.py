@@ -22,7 +22,10 @@ def at_server_start():
     This is called every time the server starts up, regardless of
     how it was shut down.
     """
-    pass
+    # Start the Triple Triad AI worker processes, so they are ready for
+    # the first NPC move.
+    from features.tripletriad_workers import get_ai_service
+    get_ai_service().start()
 
 
 def at_server_stop():
@@ -30,7 +33,9 @@ def at_server_stop():
     This is called just before the server is shut down, regardless
     of it is for a reload, reset or shutdown.
     """
-    pass
+    # Stop the Triple Triad AI worker processes.
+    from features.tripletriad_workers import shutdown_ai_service
+    shutdown_ai_service()
 
 
 def at_server_reload_start():
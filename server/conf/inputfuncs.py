@@ -50,3 +50,37 @@ as argument.
 #
 #     """
 #     pass
+
+
+def tripletriad_client(session, *args, **kwargs):
+    """
+    Called by the Triple Triad webclient plugin once it has loaded. The
+    session is then sent Triple Triad boards as structured messages rather
+    than text (see features/tripletriad_oob.py).
+
+    Args:
+        session (Session): The webclient Session.
+
+    """
+    from features.tripletriad import start_webclient
+    start_webclient(session)
+
+
+def tripletriad_move(session, *args, **kwargs):
+    """
+    Plays a Triple Triad move sent by the webclient plugin, as if the
+    `tt <card> to <position>` command had been entered, so it is checked
+    like any other move.
+
+    Args:
+        session (Session): The active Session.
+        kwargs (dict): `card`, the hand position from 1 to 5, and `cell`,
+            the board position from a1 to c3.
+
+    """
+    from features.tripletriad_engine import CELL_INDEX
+    card, cell = str(kwargs.get("card", "")), str(kwargs.get("cell", "")).lower()
+    if card not in ("1", "2", "3", "4", "5") or cell not in CELL_INDEX:
+        session.msg("Usage: 'tt [card in hand - 1 to 5] to [board position - A1 to C3]'")
+        return
+    session.execute_cmd("tripletriad %s to %s" % (card, cell))
@@ -9,6 +9,7 @@ from evennia import (DefaultAccount, DefaultChannel, DefaultCharacter,
 from features.searchlock import SearchLockMixin
 from features.delayed_exits import DelayedExitMixin
 from features.seethrough_exits import SeeThroughExitMixin
+from features.tripletriad_collection import CardCollectionMixin
 
 class Account(DefaultAccount):
     """
@@ -26,7 +27,7 @@ class Channel(DefaultChannel):
     pass
 
 
-class Character(SearchLockMixin, DefaultCharacter): 
+class Character(SearchLockMixin, CardCollectionMixin, DefaultCharacter): 
     """
 
     """
@@ -0,0 +1,188 @@
+/*
+ * Triple Triad webclient plugin
+ *
+ * Draws the Triple Triad board from the structured "tripletriad" messages
+ * the server sends (see features/tripletriad_oob.py) instead of the text
+ * board, and plays moves by clicking a card in hand and then a cell.
+ *
+ * The plugin announces itself with the tripletriad_client inputfunc when
+ * the player logs in. From then on the server sends the whole board once,
+ * then only each move. A move that does not follow on from the board held
+ * here means a message was missed, and the whole board is asked for again.
+ */
+let tripletriad_plugin = (function () {
+
+    var RANK_GLYPHS = "0123456789A";
+    var POSITIONS = ["a1", "b1", "c1", "a2", "b2", "c2", "a3", "b3", "c3"];
+
+    var board = null;      // The last state, with every move since applied.
+    var selected = null;   // Hand position picked to play, or null.
+    var panel = null;
+
+    //
+    // Asks the server for the whole board.
+    var requestBoard = function () {
+        Evennia.msg("tripletriad_client", [], {});
+    }
+
+    //
+    // Returns the seat shown at the bottom: the player's own, or the
+    // first for spectators.
+    var ownSeat = function () {
+        return board.seat === null ? 0 : board.seat;
+    }
+
+    //
+    // Builds a card. owner is null for cards in hand. Ranks changed by the
+    // Elemental rule can be 0 or 11, which has no glyph.
+    var cardElement = function (card, owner) {
+        var div = $("<div class='tt-card'></div>");
+        if (card.hidden) {
+            return div.addClass("tt-hidden");
+        }
+        var ranks = card.ranks.map(function (rank) { return RANK_GLYPHS[rank] || "A+"; });
+        div.addClass(owner === null ? "" : (owner === ownSeat() ? "tt-blue" : "tt-red"));
+        div.attr("title", card.name + (card.element ? " (" + card.element + ")" : "")
+                 + (card.modifier ? " " + (card.modifier > 0 ? "+1" : "-1") : ""));
+        if (card.modifier) {
+            div.addClass(card.modifier > 0 ? "tt-boosted" : "tt-weakened");
+        }
+        div.append($("<span class='tt-up'></span>").text(ranks[0]));
+        div.append($("<span class='tt-right'></span>").text(ranks[1]));
+        div.append($("<span class='tt-down'></span>").text(ranks[2]));
+        div.append($("<span class='tt-left'></span>").text(ranks[3]));
+        if (card.element) {
+            div.append($("<span class='tt-element'></span>").text(card.element[0]));
+        }
+        return div;
+    }
+
+    //
+    // Builds a player's hand. Only the player to move can pick from it.
+    var handElement = function (seat) {
+        var div = $("<div class='tt-hand'></div>");
+        var playable = board.seat === seat && board.turn === seat && !board.title;
+        board.hands[seat].forEach(function (card, position) {
+            var slot = $("<div class='tt-slot'></div>").appendTo(div);
+            if (card === null) {
+                return;
+            }
+            slot.append(cardElement(card, null));
+            if (playable) {
+                slot.addClass("tt-playable");
+                slot.toggleClass("tt-selected", selected === position);
+                slot.on("click", function () {
+                    selected = selected === position ? null : position;
+                    render();
+                });
+            }
+        });
+        return div;
+    }
+
+    //
+    // Draws the board held here.
+    var render = function () {
+        var seat = ownSeat();
+        var heading = board.title;
+        if (!heading) {
+            heading = board.seat === null ? board.names[board.turn] + "'s turn"
+                    : (board.turn === seat ? "Your turn" : "Their turn");
+        }
+        var grid = $("<div class='tt-board'></div>");
+        board.board.forEach(function (card, cell) {
+            var div = $("<div class='tt-cell'></div>").appendTo(grid);
+            if (card !== null) {
+                div.append(cardElement(card, card.owner));
+                return;
+            }
+            if (board.elements[cell]) {
+                div.append($("<span class='tt-element'></span>").text(board.elements[cell]));
+            }
+            if (selected !== null) {
+                div.addClass("tt-playable").on("click", function () {
+                    Evennia.msg("tripletriad_move", [], {card: selected + 1,
+                                                        cell: POSITIONS[cell]});
+                    selected = null;
+                });
+            }
+        });
+        panel.empty().append(
+            $("<div class='tt-heading'></div>").text(heading),
+            $("<div class='tt-player'></div>").text(
+                board.names[1 - seat] + ": " + board.scores[1 - seat]),
+            handElement(1 - seat),
+            grid,
+            handElement(seat),
+            $("<div class='tt-player'></div>").text(
+                board.names[seat] + ": " + board.scores[seat]),
+            $("<div class='tt-rules'></div>").text(board.rules.join(", "))
+        ).show();
+    }
+
+    //
+    // Applies a move to the board held here.
+    var applyMove = function (move) {
+        if (board === null || board.match !== move.match || board.moves + 1 !== move.moves) {
+            requestBoard();
+            return;
+        }
+        board.hands[move.seat][move.hand] = null;
+        board.board[move.cell] = $.extend({owner: move.seat}, move.card);
+        move.flips.forEach(function (cell) {
+            board.board[cell].owner = move.seat;
+        });
+        if (move.hands) {
+            board.hands = move.hands;
+        }
+        board.scores = move.scores;
+        board.turn = move.turn;
+        board.title = move.title;
+        board.moves = move.moves;
+        selected = null;
+        render();
+    }
+
+    //
+    // Handles the tripletriad command. Returns true if handled.
+    var onDefault = function (cmdname, args, kwargs) {
+        if (cmdname !== "tripletriad") {
+            return false;
+        }
+        if (kwargs.type === "state") {
+            board = kwargs;
+            selected = null;
+            render();
+        } else if (kwargs.type === "move") {
+            applyMove(kwargs);
+        } else if (kwargs.type === "end" && board !== null && board.match === kwargs.match) {
+            board = null;
+            selected = null;
+            panel.hide();
+        }
+        return true;
+    }
+
+    //
+    // Announces the plugin, so boards are sent as messages.
+    var onLoggedIn = function () {
+        requestBoard();
+    }
+
+    //
+    // Mandatory plugin init function.
+    var init = function () {
+        panel = $("<div id='tripletriad'></div>").hide().appendTo("body");
+        panel.on("dblclick", ".tt-heading", function () {
+            panel.hide();
+        });
+        console.log("Triple Triad Plugin Initialized.");
+    }
+
+    return {
+        init: init,
+        onDefault: onDefault,
+        onLoggedIn: onLoggedIn,
+    }
+})();
+window.plugin_handler.add("tripletriad", tripletriad_plugin);